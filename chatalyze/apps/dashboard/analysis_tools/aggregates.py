@@ -0,0 +1,362 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from .message_table import MessageTable
+
+HOURS = 24
+WEEKDAYS = 7
+# weekday of 1970-01-01, which is day 0 of datetime64
+EPOCH_WEEKDAY = 3
+RESPONSE_MAX_DELAY = "5 hours"
+
+# counters summed over the messages of every (user, day, hour) cell
+CELL_FIELDS = ("messages", "seq_starts", "texts", "words", "media", "responses", "response_seconds")
+
+
+def get_seq(senders: pd.Series) -> np.ndarray:
+    """Numbers the sequences of consecutive messages from the same sender starting from 1
+    Args:
+        senders: message senders
+    Returns the sequence number of every message
+    """
+    if isinstance(senders.dtype, pd.CategoricalDtype):
+        codes = senders.cat.codes.to_numpy()
+    else:
+        codes = pd.factorize(senders)[0]
+    seq = np.ones(len(codes), dtype=int)
+    # missing senders are not equal to each other, so each of their messages starts a new sequence
+    sender_changed = (codes[1:] != codes[:-1]) | (codes[1:] == -1)
+    np.cumsum(sender_changed, out=seq[1:])
+    seq[1:] += 1
+    return seq
+
+
+def get_seq_difference(seq: np.ndarray, diff: np.ndarray, delta_max: str = "1 day") -> np.ndarray:
+    """Returns time in seconds between the sequences at the first message of every sequence
+    or NaN for other messages and if time between the sequences is more than delta_max
+    Args:
+        seq: sequence numbers of the messages
+        diff: time passed since the previous message
+        delta_max: maximal time between the sequences
+    """
+    seq = np.asarray(seq)
+    diff = np.asarray(diff, dtype="timedelta64[ns]")
+    seq_diff = np.full(len(seq), np.nan)
+    seq_starts = np.flatnonzero(seq[1:] != seq[:-1]) + 1
+    gaps = diff[seq_starts]
+    is_response = gaps < np.timedelta64(pd.Timedelta(delta_max).value, "ns")
+    # seconds part of the timedelta like timedelta.seconds
+    seq_diff[seq_starts[is_response]] = (gaps[is_response].astype(np.int64) // 10**9) % (24 * 60 * 60)
+    return seq_diff
+
+
+def count_messages(
+    table: MessageTable, word_mask: np.ndarray, previous: Optional[dict[str, np.ndarray]] = None
+) -> dict[str, np.ndarray]:
+    """Counts the messages in a single pass grouping them into (user, day, hour) cells
+    Args:
+        table: messages
+        word_mask: flags of the messages whose words are counted, media messages are skipped anyway
+        previous: counters of the messages preceding the table, sequences continue from their last message
+    Returns dict of counters, where
+        users: user names, the cells of the messages without a sender have user index equal to the number of users
+        first_day: date of the earliest message
+        first_timestamp, last_timestamp: time of the first and the last message in the chat order
+        last_user: user index of the last message in the chat order
+        total: number of messages
+        first_timestamps, last_timestamps: time of the first and the last message of every user indexed by user,
+            NaT if there are no messages without a sender
+        user, day, hour: cell coordinates, days are counted from the first day
+        messages, seq_starts, texts, words, media, responses, response_seconds: sums over the messages of the cells
+    """
+    timestamps = table.get_datetimes()
+    users = np.asarray(table.senders, dtype=object)
+    user_codes = table.sender_codes.astype(np.int64)
+    user_codes[user_codes == -1] = len(users)
+
+    days = timestamps.astype("datetime64[D]")
+    first_day = days.min()
+
+    seq = get_seq(pd.Series(table.get_senders(), copy=False))
+    seq_starts = np.ones(len(seq), dtype=bool)
+    seq_starts[1:] = seq[1:] != seq[:-1]
+    seq_diff = get_seq_difference(seq, np.diff(timestamps, prepend=timestamps[:1]), RESPONSE_MAX_DELAY)
+    if previous is not None:
+        previous_user = previous["last_user"]
+        previous_sender = previous["users"][previous_user] if previous_user < len(previous["users"]) else None
+        if previous_sender is not None and user_codes[0] < len(users) and users[user_codes[0]] == previous_sender:
+            # the first sequence continues the last sequence of the previous messages
+            seq_starts[0] = False
+        else:
+            gap = np.repeat(timestamps[0] - previous["last_timestamp"], 2)
+            seq_diff[0] = get_seq_difference(np.array([0, 1]), gap, RESPONSE_MAX_DELAY)[1]
+    is_response = ~np.isnan(seq_diff)
+
+    is_media = table.media_codes != -1
+    is_text = np.asarray(word_mask, dtype=bool) & ~is_media
+    words = np.where(is_text, table.get_word_counts(), 0)
+
+    counters = {
+        "users": users,
+        "first_day": first_day,
+        "first_timestamp": timestamps[0],
+        "last_timestamp": timestamps[-1],
+        "last_user": int(user_codes[-1]),
+        "total": len(table),
+    }
+    counters["first_timestamps"], counters["last_timestamps"] = _get_time_bounds(
+        timestamps, user_codes, len(users) + 1
+    )
+    counters.update(
+        _group_cells(
+            user_codes,
+            (days - first_day).astype(np.int64),
+            (timestamps - days) // np.timedelta64(1, "h"),
+            {
+                "messages": None,
+                "seq_starts": seq_starts,
+                "texts": is_text,
+                "words": words,
+                "media": is_media,
+                "responses": is_response,
+                "response_seconds": np.where(is_response, seq_diff, 0),
+            },
+        )
+    )
+    return counters
+
+
+def _group_cells(
+    user: np.ndarray, day: np.ndarray, hour: np.ndarray, fields: dict[str, Optional[np.ndarray]]
+) -> dict[str, np.ndarray]:
+    """Sums the values over the items with the same (user, day, hour) coordinates
+    Args:
+        user, day, hour: coordinates of the items
+        fields: values of the items by the field name, None to count the items
+    Returns dict of the cell coordinates and the sums of the fields
+    """
+    days_count = int(day.max()) + 1
+    keys = (user * days_count + day) * HOURS + hour
+    cells, cell_keys = pd.factorize(keys)
+    cells_count = len(cell_keys)
+    grouped = {
+        "user": cell_keys // (days_count * HOURS),
+        "day": cell_keys // HOURS % days_count,
+        "hour": cell_keys % HOURS,
+    }
+    for field, values in fields.items():
+        grouped[field] = np.bincount(cells, weights=values, minlength=cells_count).astype(np.int64)
+    return grouped
+
+
+def _get_time_bounds(timestamps: np.ndarray, user_codes: np.ndarray, size: int) -> tuple[np.ndarray, np.ndarray]:
+    """Returns time of the first and the last message of every user, NaT for the users without messages"""
+    bounds = pd.Series(timestamps, copy=False).groupby(user_codes).agg(["min", "max"])
+    first_timestamps = np.full(size, np.datetime64("NaT"), dtype="datetime64[ns]")
+    last_timestamps = first_timestamps.copy()
+    first_timestamps[bounds.index] = bounds["min"]
+    last_timestamps[bounds.index] = bounds["max"]
+    return first_timestamps, last_timestamps
+
+
+def merge_counters(*parts: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Merges the counters of consecutive parts of a chat
+    Args:
+        parts: counters of the parts in the chat order, every part follows the previous one
+    Returns counters of all the messages
+    """
+    users = np.asarray(sorted(set().union(*(counters["users"] for counters in parts))), dtype=object)
+    first_day = min(counters["first_day"] for counters in parts)
+    coordinates = {"user": [], "day": [], "hour": []}
+    # NaT are ignored by fmin and fmax
+    first_timestamps = np.full(len(users) + 1, np.datetime64("NaT"), dtype="datetime64[ns]")
+    last_timestamps = first_timestamps.copy()
+    for counters in parts:
+        # the messages without a sender keep the index following the last user
+        user_indexes = np.append(np.searchsorted(users, counters["users"]), len(users))
+        first_timestamps[user_indexes] = np.fmin(first_timestamps[user_indexes], counters["first_timestamps"])
+        last_timestamps[user_indexes] = np.fmax(last_timestamps[user_indexes], counters["last_timestamps"])
+        coordinates["user"].append(user_indexes[counters["user"]])
+        coordinates["day"].append(counters["day"] + (counters["first_day"] - first_day).astype(np.int64))
+        coordinates["hour"].append(counters["hour"])
+    merged = {
+        "users": users,
+        "first_day": first_day,
+        "first_timestamp": parts[0]["first_timestamp"],
+        "last_timestamp": parts[-1]["last_timestamp"],
+        "last_user": int(user_indexes[parts[-1]["last_user"]]),
+        "total": sum(counters["total"] for counters in parts),
+        "first_timestamps": first_timestamps,
+        "last_timestamps": last_timestamps,
+    }
+    merged.update(
+        _group_cells(
+            *(np.concatenate(coordinates[name]) for name in ("user", "day", "hour")),
+            {field: np.concatenate([counters[field] for counters in parts]) for field in CELL_FIELDS},
+        )
+    )
+    return merged
+
+
+def drop_users(counters: dict[str, np.ndarray], stop_users: Iterable[str]) -> dict[str, np.ndarray]:
+    """Removes the cells of the users in the stop list. Reply sequences and response times of the other users stay
+    the ones of the whole chat.
+    Args:
+        counters: message counters
+        stop_users: names of the users to remove
+    Returns counters of the messages of the other users
+    """
+    stop_users = set(stop_users)
+    if not stop_users:
+        return counters
+    users = counters["users"]
+    # the messages without a sender are kept
+    is_kept = np.array([user not in stop_users for user in users.tolist()] + [True])
+    cells = is_kept[counters["user"]]
+    if not cells.any():
+        raise ValueError("All the users are in the stop list")
+    # the last message of a removed user is treated as a message without a sender
+    last_user = counters["last_user"] if is_kept[counters["last_user"]] else len(users)
+    return _select_cells(
+        counters, cells, is_kept, counters["first_timestamps"], counters["last_timestamps"], last_user
+    )
+
+
+def select_days(
+    counters: dict[str, np.ndarray], first_date: Optional[np.datetime64], last_date: Optional[np.datetime64]
+) -> dict[str, np.ndarray]:
+    """Keeps the cells of the days of the period removing the users without messages in it. The times of the first
+    and the last messages of the users are clipped to the period, while reply sequences and response times stay
+    the ones of the whole chat.
+    Args:
+        counters: message counters
+        first_date: first day of the period, the chat beginning if None
+        last_date: last day of the period, the chat end if None
+    Returns counters of the messages of the period
+    """
+    days = counters["first_day"] + counters["day"]
+    first_date = days.min() if first_date is None else np.datetime64(first_date, "D")
+    last_date = days.max() if last_date is None else np.datetime64(last_date, "D")
+    cells = (days >= first_date) & (days <= last_date)
+    if not cells.any():
+        raise ValueError("There are no messages in the period")
+    users = counters["users"]
+    has_cells = np.bincount(counters["user"][cells], minlength=len(users) + 1) > 0
+    first_timestamps = np.maximum(counters["first_timestamps"], np.datetime64(first_date, "ns"))
+    last_timestamps = np.minimum(counters["last_timestamps"], np.datetime64(last_date + 1, "ns") - 1)
+    first_timestamps[~has_cells] = np.datetime64("NaT")
+    last_timestamps[~has_cells] = np.datetime64("NaT")
+    # the sender of the last message is known only for the periods including the chat end
+    last_user = counters["last_user"] if days.max() <= last_date else len(users)
+    is_kept = np.append(has_cells[:-1], True)
+    return _select_cells(counters, cells, is_kept, first_timestamps, last_timestamps, last_user)
+
+
+def _select_cells(
+    counters: dict[str, np.ndarray],
+    cells: np.ndarray,
+    is_kept: np.ndarray,
+    first_timestamps: np.ndarray,
+    last_timestamps: np.ndarray,
+    last_user: int,
+) -> dict[str, np.ndarray]:
+    """Returns counters of the selected cells reindexing the kept users and counting the days from the first
+    selected day
+    Args:
+        counters: message counters
+        cells: flags of the selected cells
+        is_kept: flags of the kept users indexed by user, the last item is the one of the messages without a sender
+        first_timestamps, last_timestamps: time of the first and the last selected message of every user
+        last_user: user index of the last selected message
+    """
+    user_indexes = np.cumsum(is_kept) - 1
+    first_timestamps = first_timestamps[is_kept]
+    last_timestamps = last_timestamps[is_kept]
+    day = counters["day"][cells]
+    first_day = day.min()
+    selected = {
+        "users": counters["users"][is_kept[:-1]],
+        "first_day": counters["first_day"] + first_day,
+        "first_timestamp": first_timestamps[~np.isnat(first_timestamps)].min(),
+        "last_timestamp": last_timestamps[~np.isnat(last_timestamps)].max(),
+        "last_user": int(user_indexes[last_user]),
+        "first_timestamps": first_timestamps,
+        "last_timestamps": last_timestamps,
+        "user": user_indexes[counters["user"][cells]],
+        "day": day - first_day,
+        "hour": counters["hour"][cells],
+    }
+    for field in CELL_FIELDS:
+        selected[field] = counters[field][cells]
+    selected["total"] = int(selected["messages"].sum())
+    return selected
+
+
+def sum_cells(counters: dict[str, np.ndarray], by: str, field: str, size: int = 0) -> np.ndarray:
+    """Sums the counter over the cells with the same coordinate
+    Args:
+        counters: message counters
+        by: cell coordinate name, one of user, day, hour
+        field: counter name
+        size: minimal length of the result
+    Returns array of the sums indexed by the coordinate
+    """
+    return np.bincount(counters[by], weights=counters[field], minlength=size).astype(np.int64)
+
+
+def get_weekdays(counters: dict[str, np.ndarray]) -> np.ndarray:
+    """Returns weekday of every cell, Monday is 0"""
+    first_day = counters["first_day"].astype(np.int64)
+    return (first_day + counters["day"] + EPOCH_WEEKDAY) % WEEKDAYS
+
+
+def get_user_day_matrix(counters: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Sums the messages of every user for every day, the days without messages are not stored
+    Args:
+        counters: message counters
+    Returns dict of the sparse matrix, where
+        user, day, messages: coordinates and values of the days with messages sorted by user and messages
+        starts: index of the first day of every user, the last item is the number of the days
+        first_day, last_day: first and last day with messages of every user, 0 and -1 for users without messages
+    """
+    users_count = len(counters["users"])
+    days_count = int(counters["day"].max()) + 1
+    is_user = counters["user"] < users_count
+    keys = counters["user"][is_user] * days_count + counters["day"][is_user]
+    pair_keys, pairs = np.unique(keys, return_inverse=True)
+    messages = np.bincount(pairs, weights=counters["messages"][is_user], minlength=len(pair_keys)).astype(np.int64)
+    user = pair_keys // days_count
+    day = pair_keys % days_count
+    starts = np.searchsorted(user, np.arange(users_count + 1))
+    has_days = starts[1:] > starts[:-1]
+    first_day = np.where(has_days, day[np.minimum(starts[:-1], len(day) - 1)], 0)
+    last_day = np.where(has_days, day[starts[1:] - 1], -1)
+    # sorting by messages within every user, the users are sorted already
+    order = np.lexsort((messages, user))
+    return {
+        "user": user[order],
+        "day": day[order],
+        "messages": messages[order],
+        "starts": starts,
+        "first_day": first_day,
+        "last_day": last_day,
+    }
+
+
+def get_smallest_sum(matrix: dict[str, np.ndarray], counts: np.ndarray) -> np.ndarray:
+    """Sums the smallest amounts of messages per day of every user counting the days without messages
+    between the first and the last day of the user
+    Args:
+        matrix: user day matrix
+        counts: number of the days to sum for every user
+    Returns array of the sums indexed by user
+    """
+    starts = matrix["starts"]
+    days_with_messages = np.diff(starts)
+    empty_days = matrix["last_day"] - matrix["first_day"] + 1 - days_with_messages
+    cumulative = np.zeros(len(matrix["messages"]) + 1, dtype=np.int64)
+    np.cumsum(matrix["messages"], out=cumulative[1:])
+    taken = np.clip(counts - empty_days, 0, days_with_messages)
+    return cumulative[starts[:-1] + taken] - cumulative[starts[:-1]]
@@ -0,0 +1,141 @@
+import io
+import json
+from typing import BinaryIO, Mapping, Optional
+
+import numpy as np
+
+from .aggregates import CELL_FIELDS
+
+# state files of other versions are ignored and the chat is analyzed from scratch
+STATE_VERSION = 4
+
+COUNTER_SCALARS = ("first_day", "first_timestamp", "last_timestamp", "last_user", "total")
+COUNTER_ARRAYS = ("first_timestamps", "last_timestamps", "user", "day", "hour", *CELL_FIELDS)
+TERM_ENTRIES = ("day", "sender", "word", "count")
+
+
+def dump_analysis_state(
+    counters: dict[str, np.ndarray],
+    word_frequencies: dict[str, int],
+    term_index: dict[str, np.ndarray],
+    settings: dict,
+) -> bytes:
+    """Packs mergeable analysis state into a compressed npz file
+    Args:
+        counters: message counters
+        word_frequencies: dict of words and associated frequency
+        term_index: word frequencies of every day and sender
+        settings: JSON serializable analysis settings the state is valid for
+    Returns file content
+    """
+    output = io.BytesIO()
+    np.savez_compressed(
+        output,
+        settings=np.array(json.dumps({**settings, "version": STATE_VERSION})),
+        **_get_counter_arrays(counters),
+        **_get_frequency_arrays(word_frequencies, term_index),
+    )
+    return output.getvalue()
+
+
+def load_analysis_state(
+    file: BinaryIO, words: bool = True
+) -> tuple[dict[str, np.ndarray], dict[str, int], Optional[dict[str, np.ndarray]], dict]:
+    """Reads analysis state packed by dump_analysis_state
+    Args:
+        file: state file
+        words: whether to read the word frequencies, empty frequencies and no term index are returned otherwise
+    Returns counters, word frequencies, term index and settings. Settings of other state versions are returned
+    without the counters and the frequencies.
+    """
+    with np.load(file, allow_pickle=False) as state:
+        settings = json.loads(state["settings"][()])
+        if settings.get("version") != STATE_VERSION:
+            return {}, {}, None, settings
+        counters = _read_counters(state)
+        word_frequencies, term_index = _read_frequencies(state) if words else ({}, None)
+    return counters, word_frequencies, term_index, settings
+
+
+def dump_counters(counters: dict[str, np.ndarray]) -> bytes:
+    """Packs message counters into an npz file
+    Args:
+        counters: message counters
+    Returns file content
+    """
+    output = io.BytesIO()
+    np.savez(output, **_get_counter_arrays(counters))
+    return output.getvalue()
+
+
+def load_counters(file: BinaryIO) -> dict[str, np.ndarray]:
+    """Reads message counters packed by dump_counters
+    Args:
+        file: counters file
+    """
+    with np.load(file, allow_pickle=False) as arrays:
+        return _read_counters(arrays)
+
+
+def dump_word_frequencies(word_frequencies: dict[str, int], term_index: dict[str, np.ndarray]) -> bytes:
+    """Packs word frequencies into an npz file
+    Args:
+        word_frequencies: dict of words and associated frequency
+        term_index: word frequencies of every day and sender
+    Returns file content
+    """
+    output = io.BytesIO()
+    np.savez(output, **_get_frequency_arrays(word_frequencies, term_index))
+    return output.getvalue()
+
+
+def load_word_frequencies(file: BinaryIO) -> tuple[dict[str, int], dict[str, np.ndarray]]:
+    """Reads word frequencies packed by dump_word_frequencies
+    Args:
+        file: word frequencies file
+    Returns word frequencies and term index
+    """
+    with np.load(file, allow_pickle=False) as arrays:
+        return _read_frequencies(arrays)
+
+
+def _get_counter_arrays(counters: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    arrays = {name: counters[name] for name in (*COUNTER_SCALARS, *COUNTER_ARRAYS)}
+    arrays["users"] = np.array(counters["users"].tolist(), dtype=str)
+    return arrays
+
+
+def _read_counters(arrays: Mapping[str, np.ndarray]) -> dict[str, np.ndarray]:
+    counters = {"users": arrays["users"].astype(object)}
+    for name in COUNTER_SCALARS:
+        counters[name] = arrays[name][()]
+    counters["last_user"] = int(counters["last_user"])
+    counters["total"] = int(counters["total"])
+    for name in COUNTER_ARRAYS:
+        counters[name] = arrays[name]
+    return counters
+
+
+def _get_frequency_arrays(
+    word_frequencies: dict[str, int], term_index: dict[str, np.ndarray]
+) -> dict[str, np.ndarray]:
+    arrays = {
+        "frequency_words": np.array(list(word_frequencies), dtype=str),
+        "frequency_counts": np.array(list(word_frequencies.values()), dtype=np.int64),
+        "term_words": np.array(term_index["words"].tolist(), dtype=str),
+        "term_senders": np.array(term_index["senders"].tolist(), dtype=str),
+    }
+    for name in TERM_ENTRIES:
+        arrays[f"term_{name}"] = term_index[name]
+    return arrays
+
+
+def _read_frequencies(arrays: Mapping[str, np.ndarray]) -> tuple[dict[str, int], dict[str, np.ndarray]]:
+    word_frequencies = dict(zip(arrays["frequency_words"].tolist(), arrays["frequency_counts"].tolist()))
+    term_index = {
+        "words": arrays["term_words"].astype(object),
+        "senders": arrays["term_senders"].astype(object),
+    }
+    for name in TERM_ENTRIES:
+        term_index[name] = arrays[f"term_{name}"]
+    return word_frequencies, term_index
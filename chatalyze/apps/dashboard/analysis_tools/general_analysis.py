@@ -1,53 +1,74 @@
-import statistics
-from datetime import datetime
 import re
 import numpy as np
 import pandas as pd
-from typing import Sequence, Optional
-
-from apps.dashboard.const import TELEGRAM, WHATSAPP, FACEBOOK, DATETIME_FORMATS
+from typing import Iterable, Optional
+
+from apps.dashboard.const import WHATSAPP
+from .aggregates import (
+    HOURS,
+    WEEKDAYS,
+    count_messages,
+    sum_cells,
+    get_weekdays,
+    get_user_day_matrix,
+    get_smallest_sum,
+)
+from .message_table import MessageTable
 from .stopwords import whatsapp_stoplist_except_media
 from apps.dashboard.utils import ProgressBar
 
 
-def make_general_analysis(msg_list: list[dict], chat_platform: str, progress: ProgressBar) -> dict:
+def make_general_analysis(table: MessageTable, chat_platform: str, progress: ProgressBar) -> dict:
     """Returns dict of analyses values
     Args:
-        msg_list: List of Telegram messages
+        table: messages
         chat_platform: The chat platform name
         progress: Task progress object
     """
-    if chat_platform == TELEGRAM:
-        df = df_from_tg(msg_list)
-    elif chat_platform == WHATSAPP:
-        df = df_from_wa(msg_list)
-    elif chat_platform == FACEBOOK:
-        df = df_from_fb(msg_list)
-    else:
-        raise ValueError("Unsupported chat platform")
     progress.value = 20
-    df = generate_more_data(df)
-    df_unique_seq = df.drop_duplicates(subset=["seq"]).reset_index(drop=True)
-    if chat_platform == TELEGRAM and "forwarded_from" in df:
-        df_no_forwarded = df[pd.isna(df["forwarded_from"])].drop("forwarded_from", axis=1).reset_index(drop=True)
-    elif chat_platform == WHATSAPP:
-        df_no_forwarded = df.query("`text`.str.len() < 230")
-    else:
-        df_no_forwarded = df
+    counters = count_chat_messages(table, chat_platform)
     progress.value = 35
+    return get_general_results(counters, progress)
+
 
-    daily_year_msg = get_daily_msg_amount(df, 365)
-    top_day = get_top_day(df_unique_seq)
-    top_weekday = get_top_weekday(df_unique_seq)
-    hourly_messages = get_avg_for_each_hour(df)
-    msg_per_user = get_msg_count_per_user(df)
-    progress.value += 5
-    msg_per_day = get_user_msg_per_day(df)
-    progress.value += 5
-    words_per_message = get_words_per_message(df_no_forwarded)
-    media_text_share = get_media_share(df)
-    response_time = get_response_time(df)
-    response_time_hour = get_response_hours(df)
+def count_chat_messages(
+    table: MessageTable, chat_platform: str, previous: Optional[dict[str, np.ndarray]] = None
+) -> dict[str, np.ndarray]:
+    """Counts the messages of the chat for the general analysis
+    Args:
+        table: messages
+        chat_platform: The chat platform name
+        previous: counters of the messages preceding the table
+    Returns message counters
+    """
+    # words are counted in messages written by the users themselves
+    if chat_platform == WHATSAPP:
+        word_mask = table.get_text_lengths() < 230
+    else:
+        word_mask = ~table.forwarded
+    return count_messages(table, word_mask, previous)
+
+
+def get_general_results(counters: dict[str, np.ndarray], progress: Optional[ProgressBar] = None) -> dict:
+    """Returns dict of analyses values
+    Args:
+        counters: message counters
+        progress: Task progress object, None if the progress is not tracked
+    """
+    daily_year_msg = get_daily_msg_amount(counters, 365)
+    top_day = get_top_day(counters)
+    top_weekday = get_top_weekday(counters)
+    hourly_messages = get_avg_for_each_hour(counters)
+    msg_per_user = get_msg_count_per_user(counters)
+    if progress is not None:
+        progress.value += 5
+    msg_per_day = get_user_msg_per_day(counters)
+    if progress is not None:
+        progress.value += 5
+    words_per_message = get_words_per_message(counters)
+    media_text_share = get_media_share(counters)
+    response_time = get_response_time(counters)
+    response_time_hour = get_response_hours(counters)
     results = {
         "daily_year_msg": daily_year_msg,
         "top_day": top_day,
@@ -63,290 +84,267 @@ def make_general_analysis(msg_list: list[dict], chat_platform: str, progress: Pr
     return results
 
 
-def get_msg_dict_wa(text: str) -> list[dict]:
+WA_LINK_REGEX = re.compile(
+    r"""(?i)\b(?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,6}/)(?:[^\s()<>]+|\((?:[^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’])"""
+)
+# cheap patterns, one of which is found in every line matching WA_LINK_REGEX
+WA_LINK_HINT_REGEXES = (
+    re.compile("://"),
+    re.compile(r"(?i)\.[a-z]{2,6}/"),
+    re.compile(r"(?i)\.(?:(?<=www\.)|(?<=www\d\.)|(?<=www\d\d\.)|(?<=www\d\d\d\.))"),
+)
+# the pattern never spans several lines, so it finds message headers in the whole text at once
+WA_MSG_REGEX = re.compile(
+    r"\[?(?P<datetime>\d{1,2}[\/|\.]\d{1,2}[\/|\.]\d{2,4},?[^\S\n]\d{2}[:|\.]\d{2}(?:[:|\.]\d{2})?(?:[^\S\n]?[APap][Mm])?)\]?[^\S\n]-?[^\S\n]?(?P<sender>\S+|[^:\n]*):[^\S\n](?P<text>.*)"
+)
+# line breaks of str.splitlines except for the newline
+LINE_BREAKS = "\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+
+def _join_lines(text: str) -> str:
+    """Returns the lines of the text joined with newlines, same as "\\n".join(text.splitlines())"""
+    if any(line_break in text for line_break in LINE_BREAKS):
+        return "\n".join(text.splitlines())
+    return text[:-1] if text.endswith("\n") else text
+
+
+def _find_phrases(text: str, phrases: Iterable[str]) -> list[int]:
+    """Returns sorted positions of the phrases in the text"""
+    positions = []
+    for phrase in phrases:
+        position = text.find(phrase)
+        while position != -1:
+            positions.append(position)
+            position = text.find(phrase, position + len(phrase))
+    return sorted(positions)
+
+
+def _get_lines(text: str, positions: Iterable[int]) -> list[tuple[int, int, int]]:
+    """Returns index, start and end of the line containing each of the sorted positions"""
+    lines = []
+    line = 0
+    counted = 0
+    for position in positions:
+        line += text.count("\n", counted, position)
+        counted = position
+        end = text.find("\n", position)
+        lines.append((line, text.rfind("\n", 0, position) + 1, len(text) if end == -1 else end))
+    return lines
+
+
+def _drop_lines(text: str, lines: Iterable[tuple[int, int, int]]) -> str:
+    """Removes the sorted lines given by _get_lines from the text"""
+    kept = []
+    kept_start = 0
+    for _, start, end in lines:
+        if start >= kept_start:
+            kept.append(text[kept_start:start])
+            kept_start = end + 1
+    kept.append(text[kept_start:])
+    dropped_end = kept_start > len(text)
+    text = "".join(kept)
+    # the newline preceding the dropped last line is dropped as well
+    return text[:-1] if dropped_end and text else text
+
+
+def parse_whatsapp(text: str) -> dict[str, list]:
     """Parses WhatsApp export file
     Args:
         text: WhatsApp export file text
-    Returns list of messages
+    Returns dict of message columns
     """
-    link_regex = re.compile(
-        r"""(?i)\b(?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,6}/)(?:[^\s()<>]+|\((?:[^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’])"""
-    )
-
-    msg_pattern = re.compile(
-        r"\[?(?P<datetime>\d{1,2}[\/|\.]\d{1,2}[\/|\.]\d{2,4},?\s\d{2}[:|\.]\d{2}(?:[:|\.]\d{2})?(?:\s?[APap][Mm])?)\]?\s-?\s?(?P<sender>\S+|[^:]*):\s(?P<text>.*)"
-    )
-
-    msg_list = []
-
-    for line_text in text.splitlines():
-        for phrase in whatsapp_stoplist_except_media:
-            if phrase in line_text:
-                break
-        else:
-            message = msg_pattern.search(line_text)
-            if message:
-                msg = {
-                    "from": message.group("sender") or "You",
-                    "date": message.group("datetime"),
-                    "text": message.group("text"),
-                    "media_type": None,
-                }
-                if link_regex.search(line_text):
-                    msg["media_type"] = "url"
-                    msg["text"] = ""
-                elif "Без медиафайлов" in msg["text"] or "Media omitted" in msg["text"]:
-                    msg["media_type"] = "media"
-                    msg["text"] = ""
-                msg_list.append(msg)
-            else:
-                if msg_list:
-                    msg_list[-1]["text"] += "\n" + line_text
-    if len(msg_list) < 3:
+    text = _join_lines(text)
+    # lines containing a stoplist phrase are skipped entirely
+    stopped_lines = _get_lines(text, _find_phrases(text, whatsapp_stoplist_except_media))
+    if stopped_lines:
+        text = _drop_lines(text, stopped_lines)
+
+    # every message header is followed by its text and continuation lines up to the next header
+    parts = WA_MSG_REGEX.split(text)
+    dates = parts[1::4]
+    senders = [sender or "You" for sender in parts[2::4]]
+    texts = parts[3::4]
+    tails = parts[4::4]
+    if len(texts) < 3:
         raise ValueError("msg_list is too short")
-    return msg_list
-
-
-def df_from_tg(msg_list: list[dict]) -> pd.DataFrame:
-    """Makes DataFrame of Telegram messages adding needed info and filtering out service messages
-    Args:
-        msg_list: List of Telegram messages
-    Returns Pandas Dataframe with messages
-    """
-
-    df = pd.DataFrame(msg_list)
-    df = df[df.type == "message"].drop("type", axis=1).reset_index(drop=True)
-    df["timestamp"] = pd.to_datetime(df.date)
-    df["from"] = df["from"].fillna(df["from_id"])
-    if "media_type" not in df:
-        df.insert(-1, "media_type", np.nan)
-    return df
+    media_types = [None] * len(texts)
+
+    # a tail starts with the newline ending the header line, most tails consist of it alone
+    tail_lengths = np.fromiter(map(len, tails), dtype=np.int64, count=len(tails))
+    long_tails = np.flatnonzero(tail_lengths > 1).tolist()
+    newlines = (tail_lengths > 0).astype(np.int64)
+    newlines[long_tails] = [tails[i].count("\n") for i in long_tails]
+    header_lines = parts[0].count("\n") + np.cumsum(newlines) - newlines
+    del parts
+
+    link_hints = sorted({match.start() for hint_regex in WA_LINK_HINT_REGEXES for match in hint_regex.finditer(text)})
+    hint_lines = _get_lines(text, link_hints)
+    hint_messages = np.searchsorted(header_lines, [line for line, _, _ in hint_lines]).tolist()
+    for i, (line, start, end) in zip(hint_messages, hint_lines):
+        # a line with several hints is found once for each of them
+        if i < len(texts) and header_lines[i] == line and media_types[i] is None:
+            if WA_LINK_REGEX.search(text, start, end):
+                media_types[i] = "url"
+                texts[i] = ""
+    for i, msg_text in enumerate(texts):
+        if "Media omitted" in msg_text or "Без медиафайлов" in msg_text:
+            media_types[i] = "media"
+            texts[i] = ""
+
+    # a tail also contains the beginning of the next header line, which is cut off
+    for i in long_tails:
+        if i < len(tails) - 1:
+            texts[i] += tails[i][: tails[i].rfind("\n")]
+    texts[-1] += tails[-1]
+
+    return {"from": senders, "date": dates, "text": texts, "media_type": media_types}
 
 
-def detect_datetime_format(date_list: Sequence[str]) -> Optional[str]:
-    """Guesses datetime format suitable for all dates
+def get_msg_dict_wa(text: str) -> list[dict]:
+    """Parses WhatsApp export file
     Args:
-        date_list: dates list of any iterable type
-    Returns datetime format that is common for all dates in the list. If fails to guess format returns None.
+        text: WhatsApp export file text
+    Returns list of messages
     """
-    if len(date_list) > 200:
-        total = len(date_list)
-        new_date_list = [
-            *date_list[:50],
-            *date_list[int(0.5 * total - 25) : int(0.5 * total + 25)],
-            *date_list[-50:],
-        ]
-        date_list = new_date_list
-    detected_formats: list[set] = []
-    for date in date_list:
-        possible_formats = set()
-        for dt_format in DATETIME_FORMATS:
-            try:
-                dt = datetime.strptime(date, dt_format)
-            except ValueError:
-                pass
-            else:
-                if dt < datetime.now() and dt.year >= 2009:  # WhatsApp was released in 2009
-                    possible_formats.add(dt_format)
-        if not possible_formats:
-            return
-        detected_formats.append(possible_formats)
-    last_format = detected_formats.pop()
-    result = last_format.intersection(*detected_formats)
-    if len(result) == 1:
-        return result.pop()
-    else:
-        return
+    msg_columns = parse_whatsapp(text)
+    return [dict(zip(msg_columns, row)) for row in zip(*msg_columns.values())]
 
 
-def df_from_wa(msg_list: list[dict]) -> pd.DataFrame:
-    """Makes DataFrame of WhatsApp messages adding needed info
-    Args:
-        msg_list: List of WhatsApp messages
-    Returns Pandas Dataframe with messages
-    """
-
-    df = pd.DataFrame(msg_list)
-    df["timestamp"] = pd.to_datetime(df["date"], format=detect_datetime_format(df.date))
-    df.insert(0, "id", np.array(range(0, len(df))))
-    return df
-
-
-def df_from_fb(msg_list):
-    df = pd.DataFrame(msg_list)
-    df = df.iloc[::-1]
-    df = df[(df["type"] == "Generic")].drop("type", axis=1).reset_index(drop=True)
-    df["media_type"] = np.where(df["content"].isna(), "media", pd.NA)  # noqa
-    df["timestamp"] = pd.to_datetime(df["timestamp_ms"], unit="ms")
-    df.rename(columns={"sender_name": "from", "content": "text"}, inplace=True)
-    df.insert(0, "id", np.array(range(0, len(df))))
-    return df
-
-
-def generate_more_data(df: pd.DataFrame) -> pd.DataFrame:
-    def get_seq(series: pd.Series) -> np.ndarray:
-        """Returns count of consequential items that are different from previous"""
-        seq = np.zeros(len(series)).astype(int)
-        _count = 1
-        sender = series[0]
-        seq[0] = _count
-
-        for i in range(1, len(series)):
-            if series[i] != sender:
-                _count += 1
-                sender = series[i]
-            seq[i] = _count
-        return seq
-
-    def get_seq_difference(seq: pd.Series, diff: pd.Series, delta_max: str = "1 day") -> pd.Series:
-        """Returns time between different sequences or
-        NA if they are the same or time between them is more than delta_max"""
-        prev_seq = None
-        seq_diff = []
-        for row in zip(seq, diff):
-            if prev_seq is None:
-                prev_seq = row[0]
-            if row[0] == prev_seq:
-                seq_diff.append(pd.NA)
-            else:
-                prev_seq = row[0]
-                if row[1] < pd.Timedelta(delta_max):
-                    seq_diff.append(row[1].seconds)
-                else:
-                    seq_diff.append(pd.NA)
-        return pd.Series(seq_diff)
-
-    df["hour"] = df["timestamp"].dt.hour
-    df["date"] = df.timestamp.dt.date
-    df["from"] = df["from"].astype("category")
-    df["word"] = df["text"].apply(lambda text: len(text.split()) if type(text) is str else 0)
-    df["weekday"] = df["timestamp"].dt.weekday
-    df["diff"] = np.insert(np.diff(df["timestamp"]), 0, 0)
-    df["seq"] = get_seq(df["from"])
-    df["seq_diff"] = get_seq_difference(df["seq"], df["diff"], "5 hours")
-
-    return df
-
-
-def get_daily_msg_amount(df: pd.DataFrame, days: int = 365) -> dict:
+def get_daily_msg_amount(counters: dict[str, np.ndarray], days: int = 365) -> dict:
     """Generates data for daily amount of messages chart
     Args:
-        df: DataFrame to analyze
+        counters: message counters
         days: amount of days until the final message date
     Returns a dict, where
         values: list[int]: daily number of messages list
         end_date: float: the last day in the unix timestamp format
         average: float: average message amount for all days from the first to the last message in the chat
     """
-    daily_msg = df[["timestamp", "id"]].set_index("timestamp").resample("D").count().reset_index()
-    end_date = daily_msg.iloc[-1:].timestamp.dt.to_pydatetime()[0].timestamp()
-    average_msg_amount = statistics.mean(daily_msg["id"].to_list())
+    daily_msg = sum_cells(counters, "day", "messages")
+    end_date = pd.Timestamp(counters["first_day"] + len(daily_msg) - 1).to_pydatetime().timestamp()
     return {
-        "values": daily_msg.iloc[-days:]["id"].to_list(),
+        "values": daily_msg[-days:].tolist(),
         "end_date": end_date,
-        "average": average_msg_amount,
+        "average": int(daily_msg.sum()) / len(daily_msg),
     }
 
 
-def get_top_day(df: pd.DataFrame) -> str:
-    """Returns date of the highest amount of messages in the format of dd.mm.yyyy"""
-    amount_by_date = df[["id", "date", "seq"]].groupby("date").count()
-    sorted_dates = amount_by_date.sort_values("id", ascending=False).reset_index()
-    return sorted_dates.date[0].strftime("%d.%m.%Y")
+def _argsort(values: np.ndarray, ascending: bool = True) -> np.ndarray:
+    """Returns the indexes sorting the values like pandas sort_values, so equal values keep their order in results"""
+    return pd.Series(values).sort_values(ascending=ascending).index.to_numpy()
 
 
-def get_top_weekday(df: pd.DataFrame) -> int:
-    """Returns name of the weekday with the highest average amount of messages"""
-    weekdays = df[["id", "weekday", "seq"]].groupby("weekday").count()
-    sorted_weekdays = weekdays.sort_values("id", ascending=False).reset_index()
-    return int(sorted_weekdays.weekday[0])
+def get_top_day(counters: dict[str, np.ndarray]) -> str:
+    """Returns date of the highest amount of message sequences in the format of dd.mm.yyyy, the messages are
+    counted if the sequences of all the messages start before the counted period
+    """
+    daily_seq = sum_cells(counters, "day", "seq_starts")
+    if not daily_seq.any():
+        daily_seq = sum_cells(counters, "day", "messages")
+    days_with_seq = np.flatnonzero(daily_seq)
+    top_day = days_with_seq[_argsort(daily_seq[days_with_seq], ascending=False)[0]]
+    return pd.Timestamp(counters["first_day"] + top_day).strftime("%d.%m.%Y")
+
 
+def get_top_weekday(counters: dict[str, np.ndarray]) -> int:
+    """Returns the weekday with the highest amount of message sequences, Monday is 0, the messages are counted if
+    the sequences of all the messages start before the counted period
+    """
+    counts = counters["seq_starts"] if counters["seq_starts"].any() else counters["messages"]
+    weekdays = np.bincount(get_weekdays(counters), weights=counts, minlength=WEEKDAYS)
+    weekdays_with_seq = np.flatnonzero(weekdays)
+    return int(weekdays_with_seq[_argsort(weekdays[weekdays_with_seq], ascending=False)[0]])
 
-def get_days_duration(df: pd.DataFrame) -> int:
+
+def get_days_duration(counters: dict[str, np.ndarray]) -> int:
     """Returns duration of the chat in days"""
-    date_start = df[["timestamp"]].iloc[0]
-    date_end = df[["timestamp"]].iloc[-1]
-    days = int((date_end - date_start).dt.days) + 1
-    return days
+    return int((counters["last_timestamp"] - counters["first_timestamp"]) // np.timedelta64(1, "D")) + 1
+
+
+def get_avg_for_each_hour(counters: dict[str, np.ndarray]) -> list[float]:
+    """Returns list of average amount of messages for each hour having messages"""
+    days = get_days_duration(counters)
+    hourly_msg = sum_cells(counters, "hour", "messages", HOURS)
+    return [round(msg / days, 2) for msg in hourly_msg[hourly_msg > 0].tolist()]
 
 
-def get_avg_for_each_hour(df: pd.DataFrame) -> list[float]:
-    """Returns list of average amount of messages for each hour from 0 to 23"""
-    days = get_days_duration(df)
-    hourly_msg_avg = df[["id", "hour", "seq"]].groupby("hour").count()["id"].to_list()
-    hourly_msg_avg = [*map(lambda x: round(x / days, 2), hourly_msg_avg)]
-    return hourly_msg_avg
+def _sort_users(counters: dict[str, np.ndarray], values: np.ndarray, ascending: bool = False) -> dict:
+    """Returns dict of the users' values sorted by the value"""
+    order = _argsort(values, ascending)
+    return dict(zip(counters["users"][order].tolist(), values[order].tolist()))
 
 
-def get_msg_count_per_user(df: pd.DataFrame) -> dict:
+def get_msg_count_per_user(counters: dict[str, np.ndarray]) -> dict:
     """Returns dict containing amount of messages for top 4 users and sum for others"""
-    total = len(df)
-    users = df["from"].cat.categories.to_list()
-    user_msg_count = df[["id", "from"]].groupby("from").count().sort_values("id", ascending=False)
-    if len(users) > 5:
-        user_msg_count = user_msg_count[:4].to_dict()["id"]
-        user_msg_count["others"] = total - sum(user_msg_count.values())
-    else:
-        user_msg_count = user_msg_count.to_dict()["id"]
+    users_count = len(counters["users"])
+    user_msg_count = _sort_users(counters, sum_cells(counters, "user", "messages", users_count + 1)[:users_count])
+    if users_count > 5:
+        user_msg_count = {user: user_msg_count[user] for user in list(user_msg_count)[:4]}
+        user_msg_count["others"] = counters["total"] - sum(user_msg_count.values())
     return user_msg_count
 
 
-def get_user_msg_per_day(df: pd.DataFrame) -> dict:
-    """Returns dict containing average amount of messages per day for top-5 users"""
-    users = df["from"].cat.categories.to_list()
-    average_msg = {}
-    for user in users:
-        user_messages = df[["timestamp", "id", "from"]][df["from"] == user]
-        msg_per_day = user_messages.set_index("timestamp").resample("D").count()["id"].tolist()
-        msg_per_day.sort()
-        five_perc = int(len(msg_per_day) * 0.05)
-        msg_per_day_cut = msg_per_day[five_perc:-five_perc]
-        msg_per_day = msg_per_day_cut if msg_per_day_cut else msg_per_day
-        average_msg[user] = round(statistics.mean(msg_per_day), 1)
+def get_user_msg_per_day(counters: dict[str, np.ndarray]) -> dict:
+    """Returns dict containing average amount of messages per day for top-5 users,
+    5% of the days with the least and the most messages are not counted
+    """
+    users_count = len(counters["users"])
+    matrix = get_user_day_matrix(counters)
+    days_count = matrix["last_day"] - matrix["first_day"] + 1
+    cut = (days_count * 0.05).astype(np.int64)
+    # the sum of the days between cut and days_count - cut in the order of messages amount
+    trimmed_sum = get_smallest_sum(matrix, days_count - cut) - get_smallest_sum(matrix, cut)
+    average = np.zeros(users_count)
+    np.divide(trimmed_sum, days_count - 2 * cut, out=average, where=days_count > 0)
+    # python sort keeps the order of the users with equal values
+    average_msg = {user: round(value, 1) for user, value in zip(counters["users"].tolist(), average.tolist())}
     average_msg = dict(sorted(average_msg.items(), key=lambda item: item[1], reverse=True))
-    if len(average_msg) > 5:
-        average_msg = {k: average_msg[k] for k in list(average_msg)[:5]}
-    return average_msg
+    return {user: average_msg[user] for user in list(average_msg)[:5]}
 
 
-def get_words_per_message(df: pd.DataFrame) -> dict:
+def get_words_per_message(counters: dict[str, np.ndarray]) -> dict:
     """Returns dict containing average amount of words per message for top-5 users"""
-    df_without_media = df[df["media_type"].isna()].reset_index()
-    user_word_count = df_without_media[["from", "word"]].groupby("from").sum("word")
-    user_word_count = user_word_count.to_dict()["word"]
-
-    total = df_without_media[["from", "word"]].groupby("from").count().to_dict()["word"]
-
-    for user in list(user_word_count):
-        if total[user] == 0:
-            user_word_count[user] = 0
-            continue
-        user_word_count[user] = round(user_word_count[user] / total[user], 2)
-    sorted_user_word_count = dict(sorted(user_word_count.items(), key=lambda item: item[1], reverse=True))
-    if len(sorted_user_word_count) > 5:
-        sorted_user_word_count = {k: sorted_user_word_count[k] for k in list(sorted_user_word_count)[:5]}
-
-    return sorted_user_word_count
+    users_count = len(counters["users"])
+    words = sum_cells(counters, "user", "words", users_count + 1)[:users_count]
+    texts = sum_cells(counters, "user", "texts", users_count + 1)[:users_count]
+    words_per_message = np.zeros(users_count)
+    np.divide(words, texts, out=words_per_message, where=texts > 0)
+    # python sort keeps the order of the users with equal values
+    user_word_count = {
+        user: round(value, 2) for user, value in zip(counters["users"].tolist(), words_per_message.tolist())
+    }
+    user_word_count = dict(sorted(user_word_count.items(), key=lambda item: item[1], reverse=True))
+    return {user: user_word_count[user] for user in list(user_word_count)[:5]}
 
 
-def get_media_share(df: pd.DataFrame) -> dict:
+def get_media_share(counters: dict[str, np.ndarray]) -> dict:
     """Returns dict containing the share of text messages and the share of other messages in percents"""
-    text_perc = round(100 * df.media_type.isna().sum() / len(df), 2)
+    text_perc = round(100 * (counters["total"] - int(counters["media"].sum())) / counters["total"], 2)
     media_perc = round(100 - text_perc, 2)
     return {"text": text_perc, "media": media_perc}
 
 
-def get_response_time(df: pd.DataFrame) -> dict:
+def _get_mean_response(counters: dict[str, np.ndarray], by: str, size: int) -> np.ndarray:
+    """Returns average response time by the cell coordinate or NaN if there are no responses"""
+    response_seconds = sum_cells(counters, by, "response_seconds", size)
+    responses = sum_cells(counters, by, "responses", size)
+    mean_response = np.full(len(responses), np.nan)
+    np.divide(response_seconds, responses, out=mean_response, where=responses > 0)
+    return mean_response
+
+
+def get_response_time(counters: dict[str, np.ndarray]) -> dict:
     """Returns dict containing average time (in seconds) between messages from different users for top-5 users"""
-    answer_time = df[["from", "seq_diff"]].groupby("from").seq_diff.apply(np.mean)
-    return answer_time.sort_values()[:5].to_dict()
+    users_count = len(counters["users"])
+    answer_time = _sort_users(counters, _get_mean_response(counters, "user", users_count + 1)[:users_count], True)
+    return {user: answer_time[user] for user in list(answer_time)[:5]}
 
 
-def get_response_hours(df: pd.DataFrame) -> dict[str:int]:
+def get_response_hours(counters: dict[str, np.ndarray]) -> dict[str:int]:
     """Returns dict containing start and end hours for the fastest response time."""
-    answer_time = df[["hour", "seq_diff"]].groupby("hour").seq_diff.apply(np.mean)
-    answer_time = answer_time.sort_values()
-    hour_list = answer_time.index
+    answer_time = _get_mean_response(counters, "hour", HOURS)
+    hours_with_messages = np.flatnonzero(sum_cells(counters, "hour", "messages", HOURS))
+    hour_list = hours_with_messages[_argsort(answer_time[hours_with_messages])].tolist()
 
     hot_hours = []
     for hour in hour_list:
@@ -0,0 +1,248 @@
+import heapq
+import io
+import json
+import os
+import re
+import zipfile
+from array import array
+from contextlib import contextmanager, ExitStack
+from typing import Iterable, Iterator, Optional
+
+from ftfy import ftfy
+from ftfy.badness import is_bad
+
+from apps.dashboard.const import TELEGRAM, FACEBOOK
+from .json_stream import iter_json_export
+
+JSON_ENCODING = "utf-8-sig"  # UTF-8 with an optional byte order mark
+
+TELEGRAM_FIELDS = ("type", "date", "from", "from_id", "text", "media_type", "forwarded_from")
+FACEBOOK_PART_REGEX = re.compile(r"(?:^|/)message_(\d+)\.json$")
+WHATSAPP_CHAT_FILE_REGEX = re.compile(r"(?:^|/)(?:_chat|WhatsApp Chat with .*|Чат WhatsApp с .*)\.txt$")
+
+FACEBOOK_FIELDS = ("sender_name", "type", "content")
+MOJIBAKE_HINT_REGEX = re.compile("[\u00c2-\u00f4][\u0080-\u00bf\u0152-\u0192\u02c6-\u02dc\u2013-\u2122]")
+
+
+@contextmanager
+def open_json_export(file_path: str) -> Iterator[tuple[dict, Iterator[dict]]]:
+    """Opens JSON chat export file for a single streaming pass
+    Args:
+        file_path: path to the exported chat file
+    Returns a dict of the export fields and an iterator over the messages
+    """
+    with open(file_path, "r", encoding=JSON_ENCODING, errors="replace") as f:
+        yield iter_json_export(f)
+
+
+@contextmanager
+def open_chat_export(file_path: str) -> Iterator[tuple[dict, Iterator[dict]]]:
+    """Opens JSON chat export file or zip archive containing it for a single streaming pass
+    Args:
+        file_path: path to the exported chat file or archive
+    Returns a dict of the export fields and an iterator over the messages
+    """
+    if not file_path.endswith(".zip"):
+        with open_json_export(file_path) as export:
+            yield export
+        return
+
+    with ExitStack() as stack:
+        archive = stack.enter_context(zipfile.ZipFile(file_path))
+        members = find_chat_files(archive.namelist())
+        if not members[0].endswith(".json"):
+            raise ValueError("The archive doesn't contain a JSON chat file")
+        parts = []
+        # only the chat members are decompressed while they are read, media files are skipped
+        for member in members:
+            f = stack.enter_context(io.TextIOWrapper(archive.open(member), encoding=JSON_ENCODING, errors="replace"))
+            parts.append(iter_json_export(f))
+        yield merge_facebook_parts(parts)
+
+
+def read_chat_text(file_path: str) -> str:
+    """Reads text chat export file or the text chat file of a zip archive
+    Args:
+        file_path: path to the exported chat file or archive
+    Returns chat file text
+    """
+    if not file_path.endswith(".zip"):
+        with open(file_path, "r", encoding="UTF8") as f:
+            return f.read()
+
+    with zipfile.ZipFile(file_path) as archive:
+        member = find_chat_files(archive.namelist())[0]
+        if not member.endswith(".txt"):
+            raise ValueError("The archive doesn't contain a text chat file")
+        with io.TextIOWrapper(archive.open(member), encoding="UTF8") as f:
+            return f.read()
+
+
+def get_chat_file_name(file_path: str) -> str:
+    """Returns the name of the chat file itself or the chat file in a zip archive"""
+    if not file_path.endswith(".zip"):
+        return file_path
+    with zipfile.ZipFile(file_path) as archive:
+        return find_chat_files(archive.namelist())[0]
+
+
+def get_chat_file_size(file_path: str) -> int:
+    """Returns the size of the chat file itself or the uncompressed size of the chat files in a zip archive"""
+    if not file_path.endswith(".zip"):
+        return os.path.getsize(file_path)
+    with zipfile.ZipFile(file_path) as archive:
+        return sum(archive.getinfo(member).file_size for member in find_chat_files(archive.namelist()))
+
+
+def find_chat_files(file_names: Iterable[str]) -> list[str]:
+    """Finds the chat file among the files of an exported chat archive
+    Args:
+        file_names: names of the files in the archive
+    Returns a list of the chat file name or sorted names of message_1.json, message_2.json... Facebook export parts
+    """
+    # macOS archives contain resource forks of the files
+    file_names = [file_name for file_name in file_names if not file_name.startswith("__MACOSX/")]
+    parts = {}
+    for file_name in file_names:
+        match = FACEBOOK_PART_REGEX.search(file_name)
+        if match:
+            parts[file_name] = int(match.group(1))
+    if parts:
+        if len({os.path.dirname(file_name) for file_name in parts}) > 1:
+            raise ValueError("The archive contains several chats")
+        return sorted(parts, key=parts.get)
+
+    candidates = (
+        [file_name for file_name in file_names if os.path.basename(file_name) == "result.json"],
+        [file_name for file_name in file_names if WHATSAPP_CHAT_FILE_REGEX.search(file_name)],
+        [file_name for file_name in file_names if file_name.endswith(".json")],
+        [file_name for file_name in file_names if file_name.endswith(".txt")],
+    )
+    for chat_files in candidates:
+        if len(chat_files) == 1:
+            return chat_files
+        if len(chat_files) > 1:
+            raise ValueError("The archive contains several chats")
+    raise ValueError("Couldn't find the chat file in the archive")
+
+
+def merge_facebook_parts(parts: list[tuple[dict, Iterator[dict]]]) -> tuple[dict, Iterator[dict]]:
+    """Merges message streams of Facebook export parts
+    Args:
+        parts: export fields and messages iterators of the parts, messages are sorted from the newest
+    Returns export fields of the first part and an iterator over all the messages from the newest
+    """
+    if len(parts) == 1:
+        return parts[0]
+    header = parts[0][0]
+    messages = heapq.merge(*(messages for _, messages in parts), key=_get_timestamp, reverse=True)
+    return header, messages
+
+
+def _get_timestamp(msg: dict) -> int:
+    return msg.get("timestamp_ms", 0)
+
+
+def detect_json_platform(header: dict) -> str:
+    """Detects the chat platform of the JSON export
+    Args:
+        header: export fields preceding the messages
+    Returns chat platform name
+    """
+    if header.get("participants"):
+        return FACEBOOK
+    return TELEGRAM
+
+
+def read_telegram_columns(messages: Iterable[dict]) -> dict[str, list]:
+    """Collects the message fields used by the analyses into column buffers
+    Args:
+        messages: Telegram messages
+    Returns dict of columns. Formatted texts (lists of text entities) are stored as None
+    as they are not counted in the analyses.
+    """
+    columns = {"id": array("q"), **{field: [] for field in TELEGRAM_FIELDS}}
+    ids = columns["id"]
+    types = columns["type"]
+    dates = columns["date"]
+    senders = columns["from"]
+    sender_ids = columns["from_id"]
+    texts = columns["text"]
+    media_types = columns["media_type"]
+    forwarded = columns["forwarded_from"]
+    # repeated values like sender names share a single string object
+    shared = {}.setdefault
+    for msg in messages:
+        get = msg.get
+        ids.append(get("id", 0))
+        value = get("type")
+        types.append(shared(value, value))
+        dates.append(get("date"))
+        value = get("from")
+        senders.append(shared(value, value))
+        value = get("from_id")
+        sender_ids.append(shared(value, value))
+        value = get("text")
+        texts.append(value if type(value) is str else None)
+        value = get("media_type")
+        media_types.append(shared(value, value))
+        value = get("forwarded_from")
+        forwarded.append(shared(value, value))
+    return columns
+
+
+def read_facebook_columns(messages: Iterable[dict]) -> dict[str, list]:
+    """Collects the message fields used by the analyses into column buffers
+    Args:
+        messages: Facebook messages
+    Returns dict of columns
+    """
+    columns = {"timestamp_ms": array("q"), **{field: [] for field in FACEBOOK_FIELDS}}
+    timestamps = columns["timestamp_ms"]
+    senders = columns["sender_name"]
+    types = columns["type"]
+    contents = columns["content"]
+    shared = {}.setdefault
+    for msg in messages:
+        get = msg.get
+        timestamps.append(get("timestamp_ms", 0))
+        value = get("sender_name")
+        senders.append(shared(value, value))
+        value = get("type")
+        types.append(shared(value, value))
+        value = get("content")
+        contents.append(value if type(value) is str else None)
+    return columns
+
+
+def repair_mojibake(strings: list[Optional[str]]) -> list[Optional[str]]:
+    """Fixes text decoded as latin-1 instead of UTF-8, which is how Facebook exports all the strings
+    Args:
+        strings: strings of a single export file
+    Returns list of repaired strings. Strings that still look broken are fixed with ftfy.
+    """
+    unique_strings = list(dict.fromkeys(string for string in strings if string))
+    separator = "\0"
+    joined = separator.join(unique_strings)
+    fixed = None
+    if joined.count(separator) == len(unique_strings) - 1:
+        try:
+            fixed = joined.encode("latin-1").decode("UTF8").split(separator)
+        except UnicodeError:
+            pass
+    if fixed is None:
+        fixed = list(map(_repair_latin1, unique_strings))
+        joined = separator.join(fixed)
+    # ftfy heuristics are slow, so they run only for strings having UTF-8 lead and continuation bytes shown as text
+    if MOJIBAKE_HINT_REGEX.search(joined):
+        fixed = [ftfy(string) if MOJIBAKE_HINT_REGEX.search(string) and is_bad(string) else string for string in fixed]
+    repaired = dict(zip(unique_strings, fixed))
+    return [repaired.get(string, string) for string in strings]
+
+
+def _repair_latin1(string: str) -> str:
+    """Decodes latin-1 encoded UTF-8 string leaving the string unchanged if it's not the case"""
+    try:
+        return string.encode("latin-1").decode("UTF8")
+    except UnicodeError:
+        return string
@@ -0,0 +1,185 @@
+import json
+import logging
+import re
+from typing import Any, Iterator, TextIO
+
+CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder(strict=False)  # control characters are allowed in strings
+_whitespace = re.compile(r"[ \t\n\r]*")
+_separator = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+_trailing_comma = re.compile(r",(?=[ \t\n\r]*[}\]])")
+_unescaped_quote = re.compile(r'(?<!\\)(?:\\\\)*"')
+
+
+class TruncatedJsonError(json.JSONDecodeError):
+    """The file ends in the middle of a JSON value"""
+
+
+class JsonStreamReader:
+    """Reads JSON values one by one from a text file keeping only a small part of the file in memory"""
+
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._checked = 0  # the buffer is checked for trailing commas up to this position
+
+    def _read_chunk(self) -> bool:
+        """Appends the next chunk of the file to the buffer dropping the consumed part
+        Returns False if the end of the file is reached
+        """
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            # the end of the buffer is checked only now, so a failed value can be decoded after the check
+            return self._remove_trailing_commas()
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._checked -= self._pos
+        self._pos = 0
+        self._remove_trailing_commas()
+        return True
+
+    def _remove_trailing_commas(self) -> bool:
+        """Replaces commas followed by closing brackets with spaces in the new part of the buffer
+        Returns True if some commas are replaced
+        """
+        end = len(self._buffer)
+        if not self._eof:
+            # a comma at the end of the buffer can be followed by a bracket in the next chunk
+            end = max(len(self._buffer.rstrip(" \t\n\r")) - 1, self._checked)
+        commas = []
+        for comma in _trailing_comma.finditer(self._buffer, self._checked):
+            position = comma.start()
+            if position >= end:
+                break
+            # JSON strings can't contain line breaks, so lines start outside of strings
+            line_start = max(self._buffer.rfind("\n", 0, position) + 1, self._pos)
+            if len(_unescaped_quote.findall(self._buffer, line_start, position)) % 2 == 0:
+                commas.append(position)
+        if commas:
+            pieces = []
+            start = 0
+            for position in commas:
+                pieces.append(self._buffer[start:position])
+                start = position + 1
+            pieces.append(self._buffer[start:])
+            self._buffer = " ".join(pieces)
+        self._checked = end
+        return bool(commas)
+
+    def _is_cut(self, e: json.JSONDecodeError) -> bool:
+        """Checks if the decoding error can be caused by the value continuing in the next chunk"""
+        return e.pos >= len(self._buffer) - 6 or e.msg.startswith("Unterminated string")
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character or an empty string at the end of the file"""
+        while True:
+            self._pos = _whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_chunk():
+                return ""
+
+    def expect(self, char: str) -> None:
+        """Consumes the next character raising JSONDecodeError if it's not the expected one"""
+        next_char = self.peek()
+        if next_char != char:
+            error = TruncatedJsonError if not next_char else json.JSONDecodeError
+            raise error(f"Expecting '{char}'", self._buffer, self._pos)
+        self._pos += 1
+
+    def read_value(self) -> Any:
+        """Decodes the next JSON value"""
+        if self._pos >= len(self._buffer) or self._buffer[self._pos] in " \t\n\r":
+            self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._is_cut(e):
+                    if self._read_chunk():
+                        continue
+                    raise TruncatedJsonError(e.msg, e.doc, e.pos) from e
+                raise
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._read_chunk():
+                continue
+            self._pos = end
+            return value
+
+    def iter_array(self) -> Iterator[Any]:
+        """Yields items of the array starting at the current position"""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.read_value()
+            separator = _separator.match(self._buffer, self._pos)
+            if separator and separator.end() < len(self._buffer):
+                self._pos = separator.end()
+                if separator.group(1) == "]":
+                    return
+            elif self.peek() == ",":
+                self._pos += 1
+                # the bracket following a trailing comma can be in the next chunk
+                if self.peek() == "]":
+                    self._pos += 1
+                    return
+            else:
+                self.expect("]")
+                return
+
+
+def iter_json_export(
+    f: TextIO, array_key: str = "messages", chunk_size: int = CHUNK_SIZE
+) -> tuple[dict, Iterator[dict]]:
+    """Reads a chat export object lazily
+    Args:
+        f: exported chat file
+        array_key: key of the messages array
+        chunk_size: number of characters read from the file at once
+    Returns a dict of the export fields preceding the messages array and an iterator over the messages.
+    Fields following the array are added to the dict when the iterator is exhausted.
+    """
+    reader = JsonStreamReader(f, chunk_size)
+    reader.expect("{")
+    header = {}
+    while reader.peek() != "}":
+        key = reader.read_value()
+        reader.expect(":")
+        if key == array_key:
+            return header, _iter_array(reader, header)
+        header[key] = reader.read_value()
+        if reader.peek() == ",":
+            reader.expect(",")
+    raise KeyError(array_key)
+
+
+def _iter_array(reader: JsonStreamReader, header: dict) -> Iterator[Any]:
+    """Yields items of the array and reads the rest of the object into the header dict
+    A file cut off in the middle of the array or after it is read up to the last complete value.
+    """
+    try:
+        yield from reader.iter_array()
+    except TruncatedJsonError:
+        logger.warning("The file is cut off in the middle of the messages array, only complete messages are read")
+        return
+    try:
+        while reader.peek() == ",":
+            reader.expect(",")
+            if reader.peek() == "}":
+                break
+            key = reader.read_value()
+            reader.expect(":")
+            header[key] = reader.read_value()
+        reader.expect("}")
+    except TruncatedJsonError:
+        logger.warning("The file is cut off after the array, some export fields are missing")
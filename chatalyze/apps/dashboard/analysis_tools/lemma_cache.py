@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from django.core.cache import cache
+
+# longer keys are not supported by every cache backend, such words are cached in process memory only
+MAX_SHARED_WORD_LENGTH = 200
+
+
+class LemmaCache:
+    """Normal forms and parts of speech of words kept in the process memory and in the shared cache
+
+    Attributes:
+        max_size: number of the words kept in the process memory, the least recently used words are evicted
+        timeout: expiration time of the words in the shared cache in seconds, None to keep them forever
+        key_prefix: prefix of the shared cache keys
+        hits: number of the words found in the process memory
+        shared_hits: number of the words found in the shared cache
+        misses: number of the words not found in the caches
+        evictions: number of the words evicted from the process memory
+    """
+
+    def __init__(self, max_size: int, timeout: Optional[int] = None, key_prefix: str = "lemma"):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self._lemmas = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._lemmas)
+
+    def get_many(self, words: Iterable[str]) -> dict[str, tuple[str, Optional[str]]]:
+        """Looks up the words in the process memory and then in the shared cache
+        Args:
+            words: distinct words
+        Returns dict of the normal form and the part of speech of the found words
+        """
+        lemmas = {}
+        shared_keys = {}
+        for word in words:
+            lemma = self._lemmas.get(word)
+            if lemma is not None:
+                self._lemmas.move_to_end(word)
+                lemmas[word] = lemma
+            elif len(word) <= MAX_SHARED_WORD_LENGTH:
+                shared_keys[self._get_key(word)] = word
+            else:
+                self.misses += 1
+        self.hits += len(lemmas)
+        if shared_keys:
+            shared_lemmas = {shared_keys[key]: tuple(lemma) for key, lemma in cache.get_many(shared_keys).items()}
+            self.shared_hits += len(shared_lemmas)
+            self.misses += len(shared_keys) - len(shared_lemmas)
+            self._store(shared_lemmas)
+            lemmas.update(shared_lemmas)
+        return lemmas
+
+    def set_many(self, lemmas: dict[str, tuple[str, Optional[str]]]) -> None:
+        """Stores the words in the process memory and in the shared cache
+        Args:
+            lemmas: dict of the normal form and the part of speech of the words
+        """
+        self._store(lemmas)
+        shared_lemmas = {
+            self._get_key(word): lemma for word, lemma in lemmas.items() if len(word) <= MAX_SHARED_WORD_LENGTH
+        }
+        if shared_lemmas:
+            cache.set_many(shared_lemmas, timeout=self.timeout)
+
+    def get_stats(self) -> dict[str, float]:
+        """Returns the size, the hit counters and the hit rate of the caches"""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self._lemmas),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        """Removes the words from the process memory and resets the counters, the shared cache is kept"""
+        self._lemmas.clear()
+        self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def _store(self, lemmas: dict[str, tuple[str, Optional[str]]]) -> None:
+        """Adds the words to the process memory evicting the least recently used words"""
+        self._lemmas.update(lemmas)
+        for word in lemmas:
+            self._lemmas.move_to_end(word)
+        while len(self._lemmas) > self.max_size:
+            self._lemmas.popitem(last=False)
+            self.evictions += 1
+
+    def _get_key(self, word: str) -> str:
+        return f"{self.key_prefix}:{word}"
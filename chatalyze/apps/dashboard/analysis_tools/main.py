@@ -1,155 +1,537 @@
 import json
-import yaml
+import time
+from contextlib import ExitStack
+from datetime import date
+from typing import Iterable, Optional
+from uuid import uuid4
+
+import numpy as np
+from celery.utils.log import get_task_logger
+from django.core.files import File
+from django.core.files.base import ContentFile
 from django.utils import timezone
-from ftfy import ftfy
+from PIL.Image import Image
 
 from apps.dashboard.const import TELEGRAM, WHATSAPP, FACEBOOK
 from apps.dashboard.models import ChatAnalysis
-from apps.dashboard.utils import explain_error, pic_to_imgfile, ProgressBar
-from .general_analysis import get_msg_dict_wa, make_general_analysis
-from .wordcloud_tools import make_wordcloud
+from apps.dashboard.utils import (
+    delete_progress,
+    explain_error,
+    mark_error,
+    pic_to_imgfile,
+    PartProgressBar,
+    ProgressBar,
+)
+from core import settings
+from .aggregates import drop_users, merge_counters, select_days
+from .analysis_state import (
+    dump_analysis_state,
+    dump_counters,
+    dump_word_frequencies,
+    load_analysis_state,
+    load_counters,
+    load_word_frequencies,
+)
+from .general_analysis import parse_whatsapp, count_chat_messages, get_general_results
+from .ingestion import (
+    get_chat_file_size,
+    open_chat_export,
+    read_chat_text,
+    read_telegram_columns,
+    read_facebook_columns,
+    repair_mojibake,
+)
+from .message_table import (
+    MessageTable,
+    dump_message_table,
+    load_message_table,
+    table_from_tg,
+    table_from_wa,
+    table_from_fb,
+)
+from .term_index import get_sender_frequencies, get_term_frequencies, merge_term_indexes
+from .wordcloud_tools import (
+    drop_sender_words,
+    get_word_frequencies,
+    get_pic_from_frequencies,
+    merge_word_frequencies,
+    score_collocations,
+)
+
+logger = get_task_logger(__name__)
+
+# the general analysis and the word cloud generation run in parallel for every chunk of messages
+ANALYSIS_PARTS = ("statistics", "words")
+# temporary files of every chunk, which are removed once the results are saved
+RUN_FILES = ("table", "counters", "frequencies")
 
 
-def analyze_tg(analysis: ChatAnalysis) -> None:
-    """Performs Telegram chat analysis and saves the results
+def analyze_tg(
+    analysis: ChatAnalysis, header: Optional[dict] = None, messages: Optional[Iterable[dict]] = None
+) -> dict:
+    """Reads Telegram chat and prepares the analyses
     Args:
         analysis: analysis info model
+        header: export fields of the already opened chat file
+        messages: messages of the already opened chat file, the chat file is read if not provided
+    Returns parameters of the analyses
     """
     try:
-        try:
-            with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-                chat_history = json.load(f)
-        except json.JSONDecodeError:
-            with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-                chat_history = yaml.safe_load(f)
-
-        chat_id = str(chat_history["id"])
-        chat_name = chat_history["name"]
-        msg_list = chat_history["messages"]
+        with ExitStack() as stack:
+            if messages is None:
+                header, messages = stack.enter_context(open_chat_export(analysis.chat_file.path))
+            chat_id = str(header["id"])
+            chat_name = header["name"]
+            msg_columns = read_telegram_columns(messages)
+        messages_count = len(msg_columns["id"])
+        last_message_id = max(msg_columns["id"], default=0)
+        table = table_from_tg(msg_columns)
+        del msg_columns
     except Exception as e:
         explain_error(analysis, e, "File format is wrong")
     else:
         analysis.chat_name = chat_name if chat_name else "noname"
         analysis.telegram_id = chat_id
-        analysis.messages_count = len(msg_list)
+        analysis.messages_count = messages_count
         analysis.chat_platform = TELEGRAM
         analysis.save()
 
-        run_analyses(analysis, msg_list)
+        return run_analyses(analysis, table, last_message_id=last_message_id)
 
 
-def update_tg(analysis: ChatAnalysis) -> None:
-    """Performs Telegram chat analysis and updates the results
+def update_tg(analysis: ChatAnalysis) -> dict:
+    """Reads updated Telegram chat and prepares the analyses. If the state of the previous analysis is saved,
+    only the messages following the analyzed ones are read and merged into it.
     Args:
         analysis: analysis info model
+    Returns parameters of the analyses
     """
+    previous_state = load_state(analysis)
+    if previous_state is not None and previous_state["last_message_id"] is None:
+        previous_state = None
     try:
-        try:
-            with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-                chat_history = json.load(f)
-        except json.JSONDecodeError:
-            with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-                chat_history = yaml.safe_load(f)
-
-        if str(chat_history["id"]) != analysis.telegram_id:
-            raise ValueError("Chat id doesn't match")
-
-        msg_list = chat_history["messages"]
-        stop_users = analysis.custom_stoplist
-        if stop_users:
-            msg_list = list(
-                filter(
-                    lambda msg: msg.get("from") not in stop_users and msg.get("from_id") not in stop_users, msg_list
-                )
-            )
+        with open_chat_export(analysis.chat_file.path) as (header, messages):
+            if str(header["id"]) != analysis.telegram_id:
+                raise ValueError("Chat id doesn't match")
+
+            if previous_state is not None:
+                last_message_id = previous_state["last_message_id"]
+                messages = (msg for msg in messages if msg.get("id", 0) > last_message_id)
+            msg_columns = read_telegram_columns(messages)
+        last_message_id = max(msg_columns["id"], default=previous_state["last_message_id"] if previous_state else 0)
     except ValueError as e:
         explain_error(analysis, e, "You've uploaded a different chat history.")
     except Exception as e:
         explain_error(analysis, e, "File format is wrong.")
     else:
-        analysis.messages_count = len(msg_list)
+        analysis.messages_count = len(msg_columns["id"])
+        if previous_state is not None:
+            analysis.messages_count += previous_state["messages_count"]
         analysis.save()
+        try:
+            table = table_from_tg(msg_columns)
+            del msg_columns
+        except Exception as e:
+            explain_error(analysis, e, "File format is wrong.")
 
-        run_analyses(analysis, msg_list)
+        return run_analyses(analysis, table, previous_state is not None, last_message_id)
 
 
-def analyze_wa(analysis: ChatAnalysis) -> None:
-    """Performs Telegram chat analysis and saves the results
+def analyze_wa(analysis: ChatAnalysis) -> dict:
+    """Reads WhatsApp chat and prepares the analyses
     Args:
         analysis: analysis info model
+    Returns parameters of the analyses
     """
     try:
-        with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-            text = f.read()
-        msg_list = get_msg_dict_wa(text)
-        if stop_users := analysis.custom_stoplist:
-            msg_list = list(filter(lambda msg: msg.get("from") not in stop_users, msg_list))
+        text = read_chat_text(analysis.chat_file.path)
+        msg_columns = parse_whatsapp(text)
+        del text
+        table = table_from_wa(msg_columns)
+        del msg_columns
     except ValueError as e:
         explain_error(analysis, e, "File format is wrong or this WhatsApp localization is not supported yet.")
     except Exception as e:
         explain_error(analysis, e, "File format is wrong")
     else:
-        analysis.messages_count = len(msg_list)
+        analysis.messages_count = len(table)
         analysis.chat_platform = WHATSAPP
         analysis.save()
 
-        run_analyses(analysis, msg_list)
+        return run_analyses(analysis, table)
 
 
-def analyze_fb(analysis: ChatAnalysis) -> None:
-    """Performs Telegram chat analysis and saves the results
+def analyze_fb(
+    analysis: ChatAnalysis, header: Optional[dict] = None, messages: Optional[Iterable[dict]] = None
+) -> dict:
+    """Reads Facebook chat and prepares the analyses
     Args:
         analysis: analysis info model
+        header: export fields of the already opened chat file
+        messages: messages of the already opened chat file, the chat file is read if not provided
+    Returns parameters of the analyses
     """
     try:
-        with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-            chat_history = json.load(f)
-
-        chat_name = ftfy(chat_history["title"])
-        msg_list_encoded = chat_history["messages"]
-        msg_list = []
-        for msg in msg_list_encoded:
-            if msg.get("content"):
-                msg["content"] = ftfy(msg.get("content"))
-            if msg.get("sender_name"):
-                msg["sender_name"] = ftfy(msg.get("sender_name"))
-            msg_list.append(msg)
+        with ExitStack() as stack:
+            if messages is None:
+                header, messages = stack.enter_context(open_chat_export(analysis.chat_file.path))
+            msg_columns = read_facebook_columns(messages)
+        started = time.perf_counter()
+        msg_columns["content"] = repair_mojibake(msg_columns["content"])
+        msg_columns["sender_name"] = repair_mojibake(msg_columns["sender_name"])
+        chat_name = repair_mojibake([header.get("title")])[0]
+        logger.info("Repaired text encoding of %s in %.2f s", analysis.chat_file.name, time.perf_counter() - started)
+        messages_count = len(msg_columns["timestamp_ms"])
+        table = table_from_fb(msg_columns)
+        del msg_columns
     except Exception as e:
         explain_error(analysis, e, "File format is wrong")
     else:
         analysis.chat_name = chat_name if chat_name else "noname"
-        analysis.messages_count = len(msg_list)
+        analysis.messages_count = messages_count
         analysis.chat_platform = FACEBOOK
         analysis.save()
 
-        run_analyses(analysis, msg_list)
+        return run_analyses(analysis, table)
+
+
+def run_analyses(
+    analysis: ChatAnalysis, table: MessageTable, merge_state: bool = False, last_message_id: Optional[int] = None
+) -> dict:
+    """Stores the messages for the general analysis and the word cloud generation running in parallel.
+    The messages of big chat files are split into time-ordered chunks analyzed by parallel tasks too.
+    The messages of the users in the stop list are analyzed too, so the analysis state allows changing the stop list
+    without reading the chat.
+    Args:
+        analysis: analysis info model
+        table: messages
+        merge_state: whether the messages follow the ones of the saved analysis state and are merged into it
+        last_message_id: id of the last message for the chats having message ids
+    Returns JSON serializable parameters of the analyses
+    """
+    run = {
+        "id": uuid4().hex,
+        "merge_state": merge_state,
+        "last_message_id": last_message_id,
+        "messages_count": analysis.messages_count,
+        "chunks": [],
+    }
+    # the chats of zip archives are compared by their uncompressed size
+    if get_chat_file_size(analysis.chat_file.path) < settings.CHUNKED_ANALYSIS_FILE_SIZE:
+        chunk_size = max(len(table), 1)
+    else:
+        chunk_size = settings.ANALYSIS_CHUNK_MESSAGES
+    for start in range(0, len(table), chunk_size):
+        chunk = len(run["chunks"])
+        _save_run_file(
+            run, "table", chunk, ContentFile(dump_message_table(table.get_slice(start, start + chunk_size)))
+        )
+        run["chunks"].append(_get_chunk_boundary(table, start))
+    return run
+
+
+def _get_chunk_boundary(table: MessageTable, start: int) -> Optional[dict]:
+    """Returns JSON serializable sender and time of the message preceding the chunk, None for the first chunk"""
+    if start == 0:
+        return None
+    sender_code = int(table.sender_codes[start - 1])
+    return {
+        "last_sender": table.senders[sender_code] if sender_code != -1 else None,
+        "last_timestamp": int(table.timestamps[start - 1]),
+    }
+
+
+def analyze_statistics(analysis: ChatAnalysis, run: dict, chunk: int) -> None:
+    """Counts the messages of the chunk for the general analysis
+    Args:
+        analysis: analysis info model
+        run: parameters of the analyses
+        chunk: index of the chunk of messages
+    """
+    progress = PartProgressBar(analysis.progress_id, f"statistics-{chunk}", _get_run_parts(run))
+    progress.value = 2
+    table = _load_run_table(run, chunk)
+    boundary = run["chunks"][chunk]
+    if boundary is not None:
+        # sequences and response times continue from the last message of the previous chunk
+        previous = {
+            "users": np.array([] if boundary["last_sender"] is None else [boundary["last_sender"]], dtype=object),
+            "last_user": 0,
+            "last_timestamp": np.datetime64(boundary["last_timestamp"], "ns"),
+        }
+    else:
+        previous_state = _load_run_state(analysis, run)
+        previous = previous_state["counters"] if previous_state is not None else None
+    progress.value = 20
+    counters = count_chat_messages(table, analysis.chat_platform, previous)
+    _save_run_file(run, "counters", chunk, ContentFile(dump_counters(counters)))
+    progress.value = 85
+
+
+def analyze_words(analysis: ChatAnalysis, run: dict, chunk: int) -> None:
+    """Counts the words of the chunk for the word cloud
+    Args:
+        analysis: analysis info model
+        run: parameters of the analyses
+        chunk: index of the chunk of messages
+    """
+    progress = PartProgressBar(analysis.progress_id, f"words-{chunk}", _get_run_parts(run))
+    progress.value = 2
+    table = _load_run_table(run, chunk)
+    word_frequencies, term_index = get_word_frequencies(table, analysis.chat_platform, analysis.language, progress)
+    content = ContentFile(dump_word_frequencies(word_frequencies, term_index))
+    _save_run_file(run, "frequencies", chunk, content)
+    progress.value = 85
+
+
+def finish_analyses(analysis: ChatAnalysis, run: dict) -> None:
+    """Merges the counters and the word frequencies of the chunks into the analysis state, saves the state,
+    the results of the general analysis and the word cloud
+    Args:
+        analysis: analysis info model
+        run: parameters of the analyses
+    """
+    progress = ProgressBar(analysis.progress_id)
+    progress.value = 85
+    previous_state = _load_run_state(analysis, run)
+    parts = [previous_state] if previous_state is not None else []
+    for chunk in range(len(run["chunks"])):
+        with settings.private_storage.open(_get_run_file_name(run, "counters", chunk)) as f:
+            counters = load_counters(f)
+        with settings.private_storage.open(_get_run_file_name(run, "frequencies", chunk)) as f:
+            word_frequencies, term_index = load_word_frequencies(f)
+        parts.append({"counters": counters, "word_frequencies": word_frequencies, "term_index": term_index})
+    if not parts:
+        raise ValueError("There are no messages to analyze")
+    state = {
+        "counters": merge_counters(*(part["counters"] for part in parts)),
+        "word_frequencies": merge_word_frequencies(*(part["word_frequencies"] for part in parts)),
+        "term_index": merge_term_indexes(*(part["term_index"] for part in parts)),
+        "last_message_id": run["last_message_id"],
+        "messages_count": run["messages_count"],
+    }
+    results, messages_count, wordcloud_pic = _get_stoplist_results(analysis, state, progress)
+    save_state(analysis, state)
+    analysis.results = json.dumps(results)
+    analysis.messages_count = messages_count
+    analysis.word_cloud_pic = pic_to_imgfile(wordcloud_pic, "wc.png")
+    analysis.status = analysis.AnalysisStatus.READY
+    analysis.updated = timezone.now()
+    analysis.save()
+    delete_run_files(run)
+    delete_progress(analysis.progress_id, _get_run_parts(run))
+
+
+def fail_analyses(analysis: Optional[ChatAnalysis], run: dict) -> None:
+    """Shows the error of the failed analyses and removes their files
+    Args:
+        analysis: analysis info model, None if the analysis is deleted
+        run: parameters of the analyses
+    """
+    chunks = range(len(run["chunks"]))
+    # the files of the finished analyses tell which one has failed
+    if not chunks or not all(_run_file_exists(run, "counters", chunk) for chunk in chunks):
+        message = "Couldn't make analysis. Some error."
+    elif not all(_run_file_exists(run, "frequencies", chunk) for chunk in chunks):
+        message = "Couldn't build a wordcloud of your chat."
+    else:
+        message = "Couldn't save the analysis results."
+    delete_run_files(run)
+    if analysis is not None:
+        mark_error(analysis, message)
+        delete_progress(analysis.progress_id, _get_run_parts(run))
+
+
+def delete_run_files(run: dict) -> None:
+    """Removes the temporary files of the analyses"""
+    for chunk in range(len(run["chunks"])):
+        for name in RUN_FILES:
+            settings.private_storage.delete(_get_run_file_name(run, name, chunk))
+
+
+def _get_run_parts(run: dict) -> list[str]:
+    """Returns names of the parallel analyses, whose progress is tracked"""
+    return [f"{part}-{chunk}" for chunk in range(len(run["chunks"])) for part in ANALYSIS_PARTS]
 
 
-def run_analyses(analysis: ChatAnalysis, msg_list: list) -> None:
-    """Starts analyses for provided messages and saves results to analysis object
+def _get_run_file_name(run: dict, name: str, chunk: int) -> str:
+    return f"runs/{run['id']}-{name}-{chunk}.npz"
+
+
+def _run_file_exists(run: dict, name: str, chunk: int) -> bool:
+    return settings.private_storage.exists(_get_run_file_name(run, name, chunk))
+
+
+def _save_run_file(run: dict, name: str, chunk: int, content: File) -> None:
+    """Stores the temporary file replacing the file of the previous task try"""
+    file_name = _get_run_file_name(run, name, chunk)
+    settings.private_storage.delete(file_name)
+    settings.private_storage.save(file_name, content)
+
+
+def _load_run_table(run: dict, chunk: int) -> MessageTable:
+    with settings.private_storage.open(_get_run_file_name(run, "table", chunk)) as f:
+        return load_message_table(f)
+
+
+def _load_run_state(analysis: ChatAnalysis, run: dict) -> Optional[dict]:
+    """Returns the analysis state the analyzed messages are merged to"""
+    if not run["merge_state"]:
+        return None
+    state = load_state(analysis)
+    if state is None:
+        raise ValueError("The analysis state to merge the messages to is missing")
+    return state
+
+
+def _get_stoplist_results(analysis: ChatAnalysis, state: dict, progress: ProgressBar) -> tuple[dict, int, Image]:
+    """Makes the results of the general analysis and the word cloud without the users in the stop list
+    Args:
+        analysis: analysis info model
+        state: dict of counters, word_frequencies, term_index and messages_count
+        progress: Task progress object
+    Returns JSON serializable results, number of the messages and the word cloud picture
+    """
+    counters = drop_users(state["counters"], analysis.custom_stoplist)
+    results = get_general_results(counters, progress)
+    messages_count = state["messages_count"] - (state["counters"]["total"] - counters["total"])
+    word_frequencies = state["word_frequencies"]
+    if analysis.custom_stoplist:
+        word_frequencies = drop_sender_words(
+            word_frequencies, get_sender_frequencies(state["term_index"]), analysis.custom_stoplist
+        )
+    return results, messages_count, get_pic_from_frequencies(score_collocations(word_frequencies))
+
+
+def apply_stoplist(analysis: ChatAnalysis) -> bool:
+    """Updates the results with the changed stop list of users using the saved analysis state
     Args:
         analysis: analysis info model
-        msg_list: list of messages in a format of message service
+    Returns False if there is no suitable analysis state and the chat has to be analyzed again
     """
+    state = load_state(analysis)
+    if state is None:
+        return False
     progress = ProgressBar(analysis.progress_id)
     progress.value = 2
     try:
-        results = make_general_analysis(msg_list, analysis.chat_platform, progress)
+        results, messages_count, wordcloud_pic = _get_stoplist_results(analysis, state, progress)
     except Exception as e:
         explain_error(analysis, e, "Couldn't make analysis. Some error.")
     else:
         analysis.results = json.dumps(results)
-        analysis.save()
-        progress.value = 50
-
-    try:
-        wordcloud_pic = make_wordcloud(msg_list, analysis.chat_platform, analysis.language, progress)
-    except Exception as e:
-        explain_error(analysis, e, "Couldn't build a wordcloud of your chat.")
-    else:
-        progress.value = 100
+        analysis.messages_count = messages_count
         analysis.word_cloud_pic = pic_to_imgfile(wordcloud_pic, "wc.png")
         analysis.status = analysis.AnalysisStatus.READY
         analysis.updated = timezone.now()
         analysis.save()
         del progress.value
+    return True
+
+
+def query_results(
+    analysis: ChatAnalysis,
+    first_date: Optional[date] = None,
+    last_date: Optional[date] = None,
+    users: Optional[Iterable[str]] = None,
+) -> Optional[dict]:
+    """Makes the results of the general analysis for the period and the users using the saved analysis state,
+    the users in the stop list are not counted
+    Args:
+        analysis: analysis info model
+        first_date: first day of the period, the chat beginning if None
+        last_date: last day of the period, the chat end if None
+        users: names of the users to count, all the users if None
+    Returns JSON serializable results or None if there is no suitable analysis state.
+    Raises ValueError if there are no messages of the users in the period.
+    """
+    state = load_state(analysis, words=False)
+    if state is None:
+        return None
+    counters = select_days(state["counters"], first_date, last_date)
+    stop_users = set(analysis.custom_stoplist)
+    if users is not None:
+        stop_users.update(set(counters["users"].tolist()).difference(users))
+    return get_general_results(drop_users(counters, stop_users))
+
+
+def query_wordcloud(
+    analysis: ChatAnalysis,
+    first_date: Optional[date] = None,
+    last_date: Optional[date] = None,
+    users: Optional[Iterable[str]] = None,
+) -> Optional[Image]:
+    """Generates the word cloud of the period and the users using the term index of the saved analysis state,
+    the users in the stop list are not counted
+    Args:
+        analysis: analysis info model
+        first_date: first day of the period, the chat beginning if None
+        last_date: last day of the period, the chat end if None
+        users: names of the users to count, all the users if None
+    Returns a word cloud in a PIL Image format or None if there is no suitable analysis state.
+    Raises ValueError if there are no words of the users in the period.
+    """
+    state = load_state(analysis)
+    if state is None:
+        return None
+    term_index = state["term_index"]
+    stop_users = set(analysis.custom_stoplist)
+    if users is not None:
+        stop_users.update(set(term_index["senders"].tolist()).difference(users))
+    word_frequencies = get_term_frequencies(term_index, first_date, last_date, stop_users)
+    if not word_frequencies:
+        raise ValueError("There are no words in the period")
+    return get_pic_from_frequencies(score_collocations(word_frequencies))
+
+
+def _get_state_settings(analysis: ChatAnalysis) -> dict:
+    """Returns the analysis settings the analysis state depends on"""
+    return {
+        "chat_platform": analysis.chat_platform,
+        "telegram_id": analysis.telegram_id,
+        "language": analysis.language,
+    }
+
+
+def load_state(analysis: ChatAnalysis, words: bool = True) -> Optional[dict]:
+    """Loads the saved state of the analysis if it is valid for the analysis settings
+    Args:
+        analysis: analysis info model
+        words: whether to load the word frequencies, they are empty and the term index is None otherwise
+    Returns dict of counters, word_frequencies, term_index, last_message_id and messages_count or None
+    """
+    if not analysis.analysis_state:
+        return None
+    try:
+        with analysis.analysis_state.open("rb") as f:
+            counters, word_frequencies, term_index, settings = load_analysis_state(f, words)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Couldn't load analysis state %s: %s", analysis.analysis_state.name, e)
+        return None
+    # the chat is analyzed from scratch with other settings
+    expected_settings = _get_state_settings(analysis)
+    if not counters or any(settings.get(name) != value for name, value in expected_settings.items()):
+        return None
+    return {
+        "counters": counters,
+        "word_frequencies": word_frequencies,
+        "term_index": term_index,
+        "last_message_id": settings["last_message_id"],
+        "messages_count": settings["messages_count"],
+    }
+
+
+def save_state(analysis: ChatAnalysis, state: dict) -> None:
+    """Stores the analysis state file, the analysis is not saved
+    Args:
+        analysis: analysis info model
+        state: dict of counters, word_frequencies, term_index, last_message_id and messages_count,
+            last_message_id is None for the chats without message ids
+    """
+    settings = {
+        **_get_state_settings(analysis),
+        "last_message_id": state["last_message_id"],
+        "messages_count": state["messages_count"],
+    }
+    content = dump_analysis_state(state["counters"], state["word_frequencies"], state["term_index"], settings)
+    analysis.analysis_state.save("state.npz", ContentFile(content), save=False)
@@ -0,0 +1,268 @@
+import io
+from typing import BinaryIO, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from apps.dashboard.const import TELEGRAM, WHATSAPP, FACEBOOK
+from .timestamps import detect_datetime_format, parse_timestamps
+
+# lone surrogates of JSON escapes can't be encoded otherwise
+TEXT_ENCODING = "utf-8"
+TEXT_ERRORS = "surrogatepass"
+
+# multibyte characters str.split() splits on as big endian integers of 2 and 3 bytes, they are U+0085, U+00A0,
+# U+1680, U+2000 - U+205F and U+3000 with 0xC2, 0xE1, 0xE2 and 0xE3 lead bytes
+_SPACES = [char.encode(TEXT_ENCODING) for char in map(chr, range(0x3001)) if char.isspace()]
+_SPACE_CODES = {
+    size: np.array([int.from_bytes(space, "big") for space in _SPACES if len(space) == size]) for size in (2, 3)
+}
+
+
+class MessageTable:
+    """Normalized message columns shared by all the analyses of a chat
+
+    Attributes:
+        timestamps: message times in nanoseconds since the epoch
+        senders: sorted sender names
+        sender_codes: index of the sender name of every message, -1 for messages without a sender
+        media_types: sorted media type names
+        media_codes: index of the media type of every message, -1 for text messages
+        forwarded: flags of the messages forwarded from other chats
+        text_data: UTF-8 encoded texts of all the messages one after another
+        text_offsets: offsets of the texts in text_data, the last item is the length of text_data
+    """
+
+    __slots__ = (
+        "timestamps",
+        "senders",
+        "sender_codes",
+        "media_types",
+        "media_codes",
+        "forwarded",
+        "text_data",
+        "text_offsets",
+    )
+
+    def __init__(
+        self,
+        timestamps: np.ndarray,
+        senders: Sequence[Optional[str]],
+        texts: Sequence[Optional[str]],
+        media_types: Optional[Sequence[Optional[str]]] = None,
+        forwarded: Optional[Sequence[bool]] = None,
+    ):
+        """Encodes message columns
+        Args:
+            timestamps: datetime64 or nanoseconds since the epoch message times
+            senders: sender names, None for unknown senders
+            texts: message texts, None for messages without a text
+            media_types: media type names, None for text messages
+            forwarded: flags of the forwarded messages
+        """
+        messages_count = len(timestamps)
+        self.timestamps = np.asarray(timestamps).astype("datetime64[ns]").view(np.int64)
+        self.senders, self.sender_codes = _encode_categories(senders)
+        if media_types is None:
+            media_types = [None] * messages_count
+        self.media_types, self.media_codes = _encode_categories(media_types)
+        if forwarded is None:
+            self.forwarded = np.zeros(messages_count, dtype=bool)
+        else:
+            self.forwarded = np.asarray(forwarded, dtype=bool)
+        encoded = [text.encode(TEXT_ENCODING, TEXT_ERRORS) if type(text) is str else b"" for text in texts]
+        self.text_offsets = np.zeros(messages_count + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=messages_count), out=self.text_offsets[1:])
+        self.text_data = b"".join(encoded)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self) -> int:
+        """Returns memory size of the columns"""
+        arrays = (self.timestamps, self.sender_codes, self.media_codes, self.forwarded, self.text_offsets)
+        names = sum(len(name.encode(TEXT_ENCODING, TEXT_ERRORS)) for name in (*self.senders, *self.media_types))
+        return sum(array.nbytes for array in arrays) + len(self.text_data) + names
+
+    def get_slice(self, start: int, stop: int) -> "MessageTable":
+        """Returns the messages from start to stop keeping the sender names and the media type names
+        Args:
+            start: index of the first message
+            stop: index following the last message
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        table = MessageTable.__new__(MessageTable)
+        table.timestamps = self.timestamps[start:stop]
+        table.senders = self.senders
+        table.sender_codes = self.sender_codes[start:stop]
+        table.media_types = self.media_types
+        table.media_codes = self.media_codes[start:stop]
+        table.forwarded = self.forwarded[start:stop]
+        table.text_data = self.text_data[self.text_offsets[start] : self.text_offsets[max(start, stop)]]
+        table.text_offsets = self.text_offsets[start : max(start, stop) + 1] - self.text_offsets[start]
+        return table
+
+    def get_datetimes(self) -> np.ndarray:
+        """Returns datetime64 message times"""
+        return self.timestamps.view("datetime64[ns]")
+
+    def get_senders(self) -> pd.Categorical:
+        """Returns categorical sender names of the messages"""
+        return pd.Categorical.from_codes(self.sender_codes, self.senders)
+
+    def get_texts(self, rows: Optional[np.ndarray] = None) -> list[str]:
+        """Decodes message texts
+        Args:
+            rows: boolean mask or indexes of the messages, all the messages if not provided
+        Returns list of texts, messages without a text have empty texts
+        """
+        starts = self.text_offsets[:-1]
+        ends = self.text_offsets[1:]
+        if rows is not None:
+            starts = starts[rows]
+            ends = ends[rows]
+        data = memoryview(self.text_data)
+        return [str(data[start:end], TEXT_ENCODING, TEXT_ERRORS) for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def get_text_lengths(self) -> np.ndarray:
+        """Returns number of characters in every text"""
+        # every character has a single byte which is not a UTF-8 continuation byte
+        is_char_start = (np.frombuffer(self.text_data, dtype=np.uint8) & 0xC0) != 0x80
+        chars = np.zeros(len(is_char_start) + 1, dtype=np.int64)
+        np.cumsum(is_char_start, out=chars[1:])
+        return chars[self.text_offsets[1:]] - chars[self.text_offsets[:-1]]
+
+    def get_word_counts(self) -> np.ndarray:
+        """Returns number of words in every text, which is the length of text.split()"""
+        data = np.frombuffer(self.text_data, dtype=np.uint8)
+        # tab, line feed, vertical tab, form feed, carriage return, file, group, record and unit separators and space
+        is_space = (data == 0x20) | (data - np.uint8(0x09) <= 4) | (data - np.uint8(0x1C) <= 3)
+        # multibyte spaces are rare, so only the bytes following their lead bytes are compared
+        leads = np.flatnonzero((data == 0xC2) | (data - np.uint8(0xE1) <= 2))
+        for size, codes in _SPACE_CODES.items():
+            code = data[leads].astype(np.int64)
+            for i in range(1, size):
+                code = code << 8 | data[np.minimum(leads + i, len(data) - 1)]
+            matched = leads[np.isin(code, codes)]
+            for i in range(size):
+                is_space[matched + i] = True
+        # a word starts with a non-space byte at the beginning of a text or after a space
+        word_starts = ~is_space
+        word_starts[1:] &= is_space[:-1]
+        text_starts = self.text_offsets[:-1][self.text_offsets[:-1] < len(data)]
+        word_starts[text_starts] = ~is_space[text_starts]
+        words = np.searchsorted(np.flatnonzero(word_starts), self.text_offsets)
+        return np.diff(words)
+
+
+def dump_message_table(table: MessageTable) -> bytes:
+    """Packs message table into an uncompressed npz file to pass it to other processes
+    Args:
+        table: messages
+    Returns file content
+    """
+    output = io.BytesIO()
+    np.savez(
+        output,
+        timestamps=table.timestamps,
+        senders=np.array(table.senders, dtype=str),
+        sender_codes=table.sender_codes,
+        media_types=np.array(table.media_types, dtype=str),
+        media_codes=table.media_codes,
+        forwarded=table.forwarded,
+        text_data=np.frombuffer(table.text_data, dtype=np.uint8),
+        text_offsets=table.text_offsets,
+    )
+    return output.getvalue()
+
+
+def load_message_table(file: BinaryIO) -> MessageTable:
+    """Reads message table packed by dump_message_table
+    Args:
+        file: message table file
+    """
+    table = MessageTable.__new__(MessageTable)
+    with np.load(file, allow_pickle=False) as arrays:
+        table.timestamps = arrays["timestamps"]
+        table.senders = arrays["senders"].tolist()
+        table.sender_codes = arrays["sender_codes"]
+        table.media_types = arrays["media_types"].tolist()
+        table.media_codes = arrays["media_codes"]
+        table.forwarded = arrays["forwarded"]
+        table.text_data = arrays["text_data"].tobytes()
+        table.text_offsets = arrays["text_offsets"]
+    return table
+
+
+def _encode_categories(values: Sequence[Optional[str]]) -> tuple[list[str], np.ndarray]:
+    """Returns sorted unique values and the smallest integer codes of the values, missing values have -1 code"""
+    categorical = pd.Categorical(np.asarray(values, dtype=object))
+    return categorical.categories.to_list(), categorical.codes
+
+
+def make_message_table(msg_columns: dict[str, Sequence], chat_platform: str) -> MessageTable:
+    """Makes message table of the chat export columns
+    Args:
+        msg_columns: dict of message columns
+        chat_platform: The chat platform name
+    """
+    if chat_platform == TELEGRAM:
+        return table_from_tg(msg_columns)
+    if chat_platform == WHATSAPP:
+        return table_from_wa(msg_columns)
+    if chat_platform == FACEBOOK:
+        return table_from_fb(msg_columns)
+    raise ValueError("Unsupported chat platform")
+
+
+def table_from_tg(msg_columns: dict[str, Sequence]) -> MessageTable:
+    """Makes message table of Telegram messages filtering out service messages
+    Args:
+        msg_columns: Telegram message columns
+    """
+    rows = [i for i, msg_type in enumerate(msg_columns["type"]) if msg_type == "message"]
+    senders = msg_columns["from"]
+    sender_ids = msg_columns["from_id"]
+    # deleted accounts have only an id
+    senders = [senders[i] if senders[i] is not None else sender_ids[i] for i in rows]
+    media_types = msg_columns.get("media_type")
+    forwarded_from = msg_columns.get("forwarded_from")
+    return MessageTable(
+        parse_timestamps([msg_columns["date"][i] for i in rows]),
+        senders,
+        [msg_columns["text"][i] for i in rows],
+        media_types=[media_types[i] for i in rows] if media_types is not None else None,
+        forwarded=[forwarded_from[i] is not None for i in rows] if forwarded_from is not None else None,
+    )
+
+
+def table_from_wa(msg_columns: dict[str, Sequence]) -> MessageTable:
+    """Makes message table of WhatsApp messages
+    Args:
+        msg_columns: WhatsApp message columns
+    """
+    dates = msg_columns["date"]
+    return MessageTable(
+        parse_timestamps(dates, detect_datetime_format(dates)),
+        msg_columns["from"],
+        msg_columns["text"],
+        media_types=msg_columns["media_type"],
+    )
+
+
+def table_from_fb(msg_columns: dict[str, Sequence]) -> MessageTable:
+    """Makes message table of Facebook messages from the oldest filtering out service messages
+    Args:
+        msg_columns: Facebook message columns
+    """
+    rows = [i for i, msg_type in enumerate(msg_columns["type"]) if msg_type == "Generic"]
+    rows.reverse()
+    texts = [msg_columns["content"][i] for i in rows]
+    return MessageTable(
+        np.asarray([msg_columns["timestamp_ms"][i] for i in rows], dtype=np.int64).astype("datetime64[ms]"),
+        [msg_columns["sender_name"][i] for i in rows],
+        texts,
+        # messages without a text have photos, stickers or other attachments
+        media_types=["media" if text is None else None for text in texts],
+    )
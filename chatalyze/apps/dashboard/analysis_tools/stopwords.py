@@ -1,5 +1,18 @@
+from functools import lru_cache
 from os import path
 
+from ..models import ChatAnalysis
+
+STOPWORDS_DIR = path.join(path.dirname(path.abspath(__file__)), "stopwords")
+
+# stop word files of the analysis languages
+LANGUAGE_STOPWORDS = {
+    ChatAnalysis.AnalysisLanguage.ENGLISH: ("english",),
+    ChatAnalysis.AnalysisLanguage.RUSSIAN: ("russian",),
+    ChatAnalysis.AnalysisLanguage.UKRAINIAN: ("ukrainian",),
+    ChatAnalysis.AnalysisLanguage.UKRAINIAN_RUSSIAN: ("ukrainian", "russian"),
+}
+
 whatsapp_stoplist_except_media = (
     "Пропущенный аудиозвонок",
     "Пропущенный видеозвонок",
@@ -21,8 +34,29 @@ whatsapp_stoplist = (
 ) + whatsapp_stoplist_except_media
 
 
-def get_stopwords_for(language: str):
-    filename = language + ".txt"
-    file_path = path.join("apps", "dashboard", "analysis_tools", "stopwords", filename)
-    with open(file_path, "r", encoding="utf-8") as f:
-        return f.readlines()
+@lru_cache(maxsize=None)
+def get_stopwords_for(language: str) -> frozenset[str]:
+    """Reads the stop words of the language once per process
+    Args:
+        language: name of the stop word file, e.g. "english"
+    Returns set of the stop words
+    """
+    with open(path.join(STOPWORDS_DIR, language + ".txt"), "r", encoding="utf-8") as f:
+        # the lines of some files have trailing spaces
+        return frozenset(word for word in map(str.strip, f) if word)
+
+
+def get_language_stopwords(language: str) -> frozenset[str]:
+    """Returns the stop words of all the languages of the analysis language
+    Args:
+        language: analysis language
+    """
+    if language not in LANGUAGE_STOPWORDS:
+        raise ValueError("Wrong language")
+    return _merge_stopwords(LANGUAGE_STOPWORDS[language])
+
+
+@lru_cache(maxsize=None)
+def _merge_stopwords(languages: tuple[str, ...]) -> frozenset[str]:
+    """Unites the stop words of the languages once per process"""
+    return frozenset().union(*map(get_stopwords_for, languages))
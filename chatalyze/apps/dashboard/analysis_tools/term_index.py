@@ -0,0 +1,121 @@
+from collections import Counter
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def make_term_index(
+    days: Sequence[int], senders: Sequence[Optional[str]], frequencies: Sequence[dict[str, int]]
+) -> dict[str, np.ndarray]:
+    """Makes index of the word frequencies of message groups, which can be summed over any days and senders
+    Args:
+        days: days since the epoch of the groups
+        senders: sender names of the groups, None for the messages without a sender
+        frequencies: dicts of words and associated frequency of the groups
+    Returns dict of the index, where
+        words: sorted words
+        senders: sorted sender names, the entries of the messages without a sender have sender index equal to
+            the number of senders
+        day, sender, word, count: entries of the index with the word frequency of every (day, sender, word),
+            days are counted since the epoch
+    """
+    words = np.asarray(sorted(set().union(*frequencies)), dtype=object)
+    sender_names = np.asarray(sorted({sender for sender in senders if sender is not None}), dtype=object)
+    word_codes = {word: code for code, word in enumerate(words.tolist())}
+    sender_codes = {sender: code for code, sender in enumerate(sender_names.tolist())}
+    sizes = np.fromiter(map(len, frequencies), dtype=np.int64, count=len(frequencies))
+    return _group_terms(
+        words,
+        sender_names,
+        np.repeat(np.asarray(days, dtype=np.int64), sizes),
+        np.repeat(
+            np.array([sender_codes.get(sender, len(sender_names)) for sender in senders], dtype=np.int64), sizes
+        ),
+        np.fromiter((word_codes[word] for group in frequencies for word in group), dtype=np.int64, count=sizes.sum()),
+        np.fromiter((count for group in frequencies for count in group.values()), dtype=np.int64, count=sizes.sum()),
+    )
+
+
+def _group_terms(
+    words: np.ndarray, senders: np.ndarray, day: np.ndarray, sender: np.ndarray, word: np.ndarray, count: np.ndarray
+) -> dict[str, np.ndarray]:
+    """Sums the counts of the entries with the same (day, sender, word) sorting the entries"""
+    first_day = day.min() if len(day) else 0
+    senders_count = len(senders) + 1
+    words_count = max(len(words), 1)
+    keys = ((day - first_day) * senders_count + sender) * words_count + word
+    entry_keys, entries = np.unique(keys, return_inverse=True)
+    return {
+        "words": words,
+        "senders": senders,
+        "day": entry_keys // (words_count * senders_count) + first_day,
+        "sender": entry_keys // words_count % senders_count,
+        "word": entry_keys % words_count,
+        "count": np.bincount(entries, weights=count, minlength=len(entry_keys)).astype(np.int64),
+    }
+
+
+def merge_term_indexes(*indexes: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Sums the term indexes of the chat parts
+    Args:
+        indexes: term indexes of the parts
+    Returns term index of all the messages
+    """
+    words = np.asarray(sorted(set().union(*(index["words"] for index in indexes))), dtype=object)
+    senders = np.asarray(sorted(set().union(*(index["senders"] for index in indexes))), dtype=object)
+    entries = {"day": [], "sender": [], "word": [], "count": []}
+    for index in indexes:
+        # the messages without a sender keep the index following the last sender
+        sender_indexes = np.append(np.searchsorted(senders, index["senders"]), len(senders)).astype(np.int64)
+        entries["day"].append(index["day"])
+        entries["sender"].append(sender_indexes[index["sender"]])
+        entries["word"].append(np.searchsorted(words, index["words"]).astype(np.int64)[index["word"]])
+        entries["count"].append(index["count"])
+    return _group_terms(
+        words, senders, *(np.concatenate(entries[name]) for name in ("day", "sender", "word", "count"))
+    )
+
+
+def get_term_frequencies(
+    index: dict[str, np.ndarray],
+    first_date: Optional[np.datetime64] = None,
+    last_date: Optional[np.datetime64] = None,
+    stop_senders: Iterable[str] = (),
+) -> dict[str, int]:
+    """Sums the word frequencies of the period without the senders in the stop list
+    Args:
+        index: term index
+        first_date: first day of the period, the chat beginning if None
+        last_date: last day of the period, the chat end if None
+        stop_senders: names of the senders to skip, the messages without a sender are kept
+    Returns dict of words and associated frequency sorted by the frequency
+    """
+    entries = np.ones(len(index["count"]), dtype=bool)
+    if first_date is not None:
+        entries &= index["day"] >= np.datetime64(first_date, "D").astype(np.int64)
+    if last_date is not None:
+        entries &= index["day"] <= np.datetime64(last_date, "D").astype(np.int64)
+    stop_senders = set(stop_senders)
+    if stop_senders:
+        is_kept = np.array([sender not in stop_senders for sender in index["senders"].tolist()] + [True])
+        entries &= is_kept[index["sender"]]
+    counts = np.bincount(index["word"][entries], weights=index["count"][entries], minlength=len(index["words"]))
+    word_count = Counter(dict(zip(index["words"].tolist(), counts.astype(np.int64).tolist())))
+    return {word: count for word, count in word_count.most_common() if count > 0}
+
+
+def get_sender_frequencies(index: dict[str, np.ndarray]) -> dict[str, dict[str, int]]:
+    """Sums the word frequencies of every sender
+    Args:
+        index: term index
+    Returns dicts of words and associated frequency by sender name
+    """
+    frequencies = pd.Series(index["count"]).groupby([index["sender"], index["word"]], sort=False).sum()
+    sender_frequencies = {}
+    words = index["words"].tolist()
+    senders = index["senders"].tolist()
+    for (sender, word), count in frequencies.items():
+        if sender < len(senders):
+            sender_frequencies.setdefault(senders[sender], {})[words[word]] = int(count)
+    return sender_frequencies
@@ -0,0 +1,268 @@
+import calendar
+import re
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from apps.dashboard.const import DATETIME_FORMATS
+
+MIN_YEAR = 2009  # WhatsApp was released in 2009
+
+# every digit of a date is replaced with "9" to get the lexical shape of the date
+_DIGITS_TO_NINES = str.maketrans("0123456789", "9999999999")
+
+# shape patterns and valid ranges of the numeric fields
+_FIELD_SHAPES = {
+    "d": ("(9{1,2})", 1, 31),
+    "m": ("(9{1,2})", 1, 12),
+    "y": ("(99)", 0, 99),
+    "Y": ("(9999)", 0, 9999),
+    "H": ("(9{1,2})", 0, 23),
+    "I": ("(9{1,2})", 1, 12),
+    "M": ("(9{1,2})", 0, 59),
+    "S": ("(9{1,2})", 0, 59),
+}
+_DIRECTIVE_REGEX = re.compile(r"%(.)|(\s+)|([^%\s]+)")
+
+
+@lru_cache(maxsize=None)
+def _compile_shape(dt_format: str) -> tuple[re.Pattern, tuple[str, ...]]:
+    """Translates datetime format to a regex matching shapes of the dates in this format
+    Returns compiled regex and the names of the numeric fields captured by its groups
+    """
+    pattern = []
+    fields = []
+    for directive, space, literal in _DIRECTIVE_REGEX.findall(dt_format):
+        if directive in _FIELD_SHAPES:
+            pattern.append(_FIELD_SHAPES[directive][0])
+            fields.append(directive)
+        elif directive == "p":
+            pattern.append(r"[^\W\d_]+")
+        elif directive:
+            raise ValueError(f"Unsupported directive %{directive}")
+        elif space:
+            pattern.append(r"\s+")  # strptime treats any whitespace in the format as one or more whitespaces
+        else:
+            pattern.append(re.escape(literal))
+    return re.compile("".join(pattern), re.IGNORECASE), tuple(fields)
+
+
+@lru_cache(maxsize=4096)
+def match_shape(signature: str) -> tuple[tuple[str, tuple[str, ...], tuple[tuple[int, int], ...]], ...]:
+    """Finds datetime formats able to produce dates of the given shape
+    Args:
+        signature: date with all digits replaced with "9"
+    Returns tuple of (datetime format, numeric field names, field positions in the date) tuples
+    """
+    candidates = []
+    for dt_format in DATETIME_FORMATS:
+        shape_regex, fields = _compile_shape(dt_format)
+        match = shape_regex.fullmatch(signature)
+        if match:
+            spans = tuple(match.span(i) for i in range(1, len(fields) + 1))
+            candidates.append((dt_format, fields, spans))
+    return tuple(candidates)
+
+
+def _read_numbers(dates: Sequence[str], signature: str) -> dict[tuple[int, int], np.ndarray]:
+    """Converts digit runs of the same shape dates to numbers
+    Returns dict of numbers by the run positions in the date
+    """
+    try:
+        codes = np.frombuffer("".join(dates).encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        codes = np.array(dates, dtype=f"<U{len(signature)}").view(np.uint32)
+    codes = codes.reshape(len(dates), len(signature))
+    numbers = {}
+    for run in re.finditer("9+", signature):
+        digits = codes[:, run.start() : run.end()].astype(np.int64) - ord("0")
+        number = digits[:, 0]
+        for i in range(1, digits.shape[1]):
+            number = number * 10 + digits[:, i]
+        numbers[run.span()] = number
+    return numbers
+
+
+def _fields_are_valid(fields: dict[str, np.ndarray], now: datetime) -> bool:
+    """Checks that all the dates built from the numeric fields exist and are between MIN_YEAR and now"""
+    for name, value in fields.items():
+        _, min_value, max_value = _FIELD_SHAPES[name]
+        if value.min() < min_value or value.max() > max_value:
+            return False
+    if "Y" in fields:
+        years = fields["Y"]
+    else:
+        # strptime maps two digit years 69-99 to 1969-1999 and 0-68 to 2000-2068
+        years = fields["y"] + np.where(fields["y"] < 69, 2000, 1900)
+    if years.min() < MIN_YEAR:
+        return False
+    months, days = fields["m"], fields["d"]
+    # the last days of short months are checked once for each distinct month
+    late = days > 28
+    year_months, inverse = np.unique((years * 100 + months)[late], return_inverse=True)
+    max_days = np.zeros(len(year_months), dtype=np.int64)
+    np.maximum.at(max_days, inverse, days[late])
+    for year_month, max_day in zip(year_months.tolist(), max_days.tolist()):
+        if max_day > calendar.monthrange(year_month // 100, year_month % 100)[1]:
+            return False
+    hours = fields.get("H", fields.get("I", 0))
+    keys = ((years * 100 + months) * 100 + days) * 10000 + hours * 100 + fields.get("M", 0)
+    keys = keys * 100 + fields.get("S", 0)
+    now_key = int(now.strftime("%Y%m%d%H%M%S"))
+    return keys.max() < now_key or (keys.max() == now_key and now.microsecond > 0)
+
+
+def _detect_by_strptime(date_list: Sequence[str], now: datetime) -> set[str]:
+    """Returns the formats suitable for all dates trying every format with strptime"""
+    result = set(DATETIME_FORMATS)
+    for date in date_list:
+        possible_formats = set()
+        for dt_format in result:
+            try:
+                dt = datetime.strptime(date, dt_format)
+            except ValueError:
+                pass
+            else:
+                if dt < now and dt.year >= MIN_YEAR:
+                    possible_formats.add(dt_format)
+        result = possible_formats
+        if not result:
+            break
+    return result
+
+
+def _detect_for_shape(signature: str, dates: Sequence[str], now: datetime) -> set[str]:
+    """Returns the formats suitable for all dates of the same shape"""
+    candidates = match_shape(signature)
+    if not candidates:
+        # shapes unknown to the classifier, like non-ASCII digits, are checked date by date
+        return _detect_by_strptime(dates, now)
+    numbers = _read_numbers(dates, signature)
+    result = set()
+    for dt_format, field_names, spans in candidates:
+        fields = {name: numbers[span] for name, span in zip(field_names, spans)}
+        if not _fields_are_valid(fields, now):
+            continue
+        # literals and AM/PM markers are the same for all dates of the shape, so a single date confirms the format
+        try:
+            datetime.strptime(dates[0], dt_format)
+        except ValueError:
+            continue
+        result.add(dt_format)
+    return result
+
+
+def _group_by_shape(dates: Sequence[str]) -> tuple[Sequence[str], np.ndarray, list[tuple[str, int, int]]]:
+    """Sorts the dates by their shape signatures
+    Returns the sorted dates, their original indexes and (signature, start, end) ranges of the shapes
+    """
+    signatures = "\n".join(dates).translate(_DIGITS_TO_NINES).split("\n")
+    if len(signatures) != len(dates):
+        signatures = [date.translate(_DIGITS_TO_NINES) for date in dates]
+    shape_codes, shapes = pd.factorize(np.array(signatures, dtype=object))
+    order = np.argsort(shape_codes, kind="stable")
+    if len(shapes) > 1:
+        dates = itemgetter(*order.tolist())(dates)
+    shape_ends = np.cumsum(np.bincount(shape_codes, minlength=len(shapes))).tolist()
+    return dates, order, list(zip(shapes, [0, *shape_ends], shape_ends))
+
+
+def detect_datetime_format(date_list: Sequence[str]) -> Optional[str]:
+    """Guesses datetime format suitable for all dates
+    Args:
+        date_list: dates list of any iterable type
+    Returns datetime format that is common for all dates in the list. If fails to guess format returns None.
+    """
+    date_list = pd.unique(np.asarray(date_list, dtype=object)).tolist()
+    if not date_list:
+        return
+    now = datetime.now()
+    date_list, _, shapes = _group_by_shape(date_list)
+    result = None
+    for signature, start, end in shapes:
+        formats = _detect_for_shape(signature, date_list[start:end], now)
+        result = formats if result is None else result & formats
+        if not result:
+            return
+    if len(result) == 1:
+        return result.pop()
+
+
+@lru_cache(maxsize=4096)
+def _match_format_shape(
+    dt_format: str, signature: str
+) -> Optional[tuple[tuple[str, ...], tuple[tuple[int, int], ...]]]:
+    """Returns the numeric field names and their positions in the dates of the given shape
+    or None if the dates can't be parsed by reading digits at fixed offsets
+    """
+    try:
+        shape_regex, fields = _compile_shape(dt_format)
+    except ValueError:
+        return
+    match = shape_regex.fullmatch(signature)
+    if not match or "I" in fields or not {"d", "m"} <= set(fields) or not {"y", "Y"} & set(fields):
+        return
+    return fields, tuple(match.span(i) for i in range(1, len(fields) + 1))
+
+
+def _build_timestamps(fields: dict[str, np.ndarray]) -> Optional[np.ndarray]:
+    """Assembles datetime64 values from the numeric fields
+    Returns None if some of the values don't make a valid date
+    """
+    for name, value in fields.items():
+        _, min_value, max_value = _FIELD_SHAPES[name]
+        if value.min() < min_value or value.max() > max_value:
+            return
+    if "Y" in fields:
+        years = fields["Y"]
+    else:
+        years = fields["y"] + np.where(fields["y"] < 69, 2000, 1900)
+    months = ((years - 1970) * 12 + fields["m"] - 1).astype("datetime64[M]")
+    month_starts = months.astype("datetime64[D]")
+    month_lengths = ((months + 1).astype("datetime64[D]") - month_starts).astype(np.int64)
+    if (fields["d"] > month_lengths).any():
+        return
+    seconds = (fields.get("H", 0) * 60 + fields.get("M", 0)) * 60 + fields.get("S", 0)
+    timestamps = (month_starts + (fields["d"] - 1)).astype("datetime64[ns]")
+    return timestamps + (seconds * 10**9).astype("timedelta64[ns]")
+
+
+def parse_timestamps(dates: Sequence[Optional[str]], dt_format: Optional[str] = None) -> np.ndarray:
+    """Parses date strings parsing each distinct string once
+    Args:
+        dates: date strings
+        dt_format: datetime format of the dates, the format is inferred by pandas if not provided
+    Returns datetime64 array
+    """
+    if dt_format is None:
+        # pandas parses ISO dates with a fast C parser, which is faster than factorizing them
+        return pd.to_datetime(pd.Series(dates, dtype=object)).to_numpy(dtype="datetime64[ns]")
+
+    codes, original_dates = pd.factorize(np.asarray(dates, dtype=object))
+    parsed = np.empty(len(original_dates) + 1, dtype="datetime64[ns]")
+    parsed[-1] = np.datetime64("NaT")  # missing dates have -1 code
+    unique_dates = original_dates.tolist()
+    unique_dates, order, shapes = _group_by_shape(unique_dates) if unique_dates else ([], None, [])
+    slow_indexes = []
+    for signature, start, end in shapes:
+        indexes = order[start:end]
+        layout = _match_format_shape(dt_format, signature)
+        timestamps = None
+        if layout:
+            # the digits of fixed-width dates are read at fixed offsets
+            field_names, spans = layout
+            numbers = _read_numbers(unique_dates[start:end], signature)
+            timestamps = _build_timestamps({name: numbers[span] for name, span in zip(field_names, spans)})
+        if timestamps is None:
+            slow_indexes.append(indexes)
+        else:
+            parsed[indexes] = timestamps
+    if slow_indexes:
+        slow_indexes = np.concatenate(slow_indexes)
+        slow_dates = original_dates[slow_indexes]
+        parsed[slow_indexes] = pd.to_datetime(slow_dates, format=dt_format).to_numpy(dtype="datetime64[ns]")
+    return parsed[codes]
@@ -0,0 +1,116 @@
+import re
+from typing import AbstractSet, Iterable, Iterator, Optional
+
+# longer messages are mostly copied texts rather than the words of the chat members
+MAX_MESSAGE_WORDS = 55
+# shorter words and numbers are not shown in the wordclouds
+MIN_WORD_LENGTH = 3
+# words of at least two characters like the default pattern of WordCloud
+WORD_REGEX = re.compile(r"\w[\w']+")
+
+PUNCTUATION = '!"#$%&()*+,-./:;<=>?@[]^_`{|}~„“«»†*—/-‘’1234567890'
+
+# character ranges of emojis and pictographs
+EMOJIS = (
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002500-\U00002BEF"  # chinese char
+    "\U00002702-\U000027B0"
+    "\U00002702-\U000027B0"
+    "\U000024C2-\U0001F251"
+    "\U0001f926-\U0001f937"
+    "\U00010000-\U0010ffff"
+    "\u2640-\u2642"
+    "\u2600-\u2B55"
+    "\u200d"
+    "\u23cf"
+    "\u23e9"
+    "\u231a"
+    "\ufe0f"  # dingbats
+    "\u3030"
+)
+EMOJI_REGEX = re.compile(f"[{EMOJIS}]+")
+# signs and emojis are removed in a single pass over the text
+_REMOVED_CHARS_REGEX = re.compile(f"[{re.escape(PUNCTUATION)}{EMOJIS}]+")
+
+
+def remove_emojis(text: str) -> str:
+    """Removes emojis from a string"""
+    return EMOJI_REGEX.sub("", text)
+
+
+def is_big_message(text: str, max_words: int = MAX_MESSAGE_WORDS) -> bool:
+    """Checks whether the message has more than max_words words"""
+    # the words following the limit are not split
+    return len(text.split(maxsplit=max_words)) > max_words
+
+
+def tokenize(text: str) -> list[str]:
+    """Extracts the lowercase words of a text removing signs, digits and emojis
+    Args:
+        text: message text
+    Returns list of words
+    """
+    return _REMOVED_CHARS_REGEX.sub("", text).lower().split()
+
+
+def tokenize_messages(
+    texts: Iterable[str], max_words: Optional[int] = MAX_MESSAGE_WORDS
+) -> Iterator[Optional[list[str]]]:
+    """Extracts the words of every message one by one skipping the big messages
+    Args:
+        texts: message texts
+        max_words: maximum number of words in a message, None to keep all the messages
+    Returns iterator of the lists of words of the messages, None for the messages with more than max_words words
+    """
+    for text in texts:
+        if max_words is not None and is_big_message(text, max_words):
+            yield None
+        else:
+            yield tokenize(text)
+
+
+def extract_terms(text: str, stopwords: AbstractSet[str], min_word_length: int = MIN_WORD_LENGTH) -> list[str]:
+    """Extracts the words and the pairs of adjacent words of a text like WordCloud.process_text, the counts of
+    the terms of any texts can be summed and scored with wordcloud_tools.score_collocations
+    Args:
+        text: message text
+        stopwords: lowercase words to skip, the pairs with a stop word are skipped as well
+        min_word_length: minimum number of characters in a word
+    Returns list of the words followed by the pairs of words joined with a space
+    """
+    words = []
+    for word in WORD_REGEX.findall(text):
+        # remove 's, numbers and short words
+        if word.lower().endswith("'s"):
+            word = word[:-2]
+        if len(word) >= min_word_length and not word.isdigit():
+            words.append(word)
+    is_stopword = [word.lower() in stopwords for word in words]
+    terms = [word for word, is_skipped in zip(words, is_stopword) if not is_skipped]
+    # the pairs are found before the stop words are removed, so "thank you very much" has no "thank much" pair
+    terms.extend(
+        f"{first} {second}"
+        for first, second, is_skipped, is_next_skipped in zip(words, words[1:], is_stopword, is_stopword[1:])
+        if not is_skipped and not is_next_skipped
+    )
+    return terms
+
+
+def extract_message_terms(
+    texts: Iterable[str], stopwords: AbstractSet[str], max_words: Optional[int] = MAX_MESSAGE_WORDS
+) -> Iterator[Optional[list[str]]]:
+    """Extracts the terms of every message one by one skipping the big messages
+    Args:
+        texts: message texts
+        stopwords: lowercase words to skip
+        max_words: maximum number of words in a message, None to keep all the messages
+    Returns iterator of the lists of terms of the messages, None for the messages with more than max_words words
+    """
+    for text in texts:
+        if max_words is not None and is_big_message(text, max_words):
+            yield None
+        else:
+            yield extract_terms(text, stopwords)
@@ -1,136 +1,202 @@
-import re
-from typing import Union
+import logging
+from operator import itemgetter
+from typing import Iterable, Optional, Union
+import numpy as np
 from wordcloud import WordCloud
+from wordcloud.tokenization import score
 from pymorphy2 import MorphAnalyzer
 from PIL.Image import Image
-from collections import Counter
+from collections import Counter, defaultdict
 
+from core import settings
 from ..utils import ProgressBar
 from ..const import TELEGRAM, WHATSAPP, FACEBOOK
 from ..models import ChatAnalysis
-from .stopwords import whatsapp_stoplist, get_stopwords_for
+from .lemma_cache import LemmaCache
+from .message_table import MessageTable
+from .stopwords import whatsapp_stoplist, get_language_stopwords
+from .term_index import make_term_index
+from .tokenizer import MAX_MESSAGE_WORDS, extract_message_terms, is_big_message, tokenize, tokenize_messages
+
+logger = logging.getLogger(__name__)
 
 morph = MorphAnalyzer()
+lemma_cache = LemmaCache(settings.LEMMA_CACHE_SIZE, settings.LEMMA_CACHE_TIMEOUT)
+
+# minimum collocation score of the pairs of words shown in the wordclouds
+COLLOCATION_THRESHOLD = 3
 
 
-def make_wordcloud(raw_messages: list, chat_platform: str, language: str, progress: ProgressBar) -> Image:
+def make_wordcloud(table: MessageTable, chat_platform: str, language: str, progress: ProgressBar) -> Image:
     """Produces wordcloud for provided messages
     Args:
-        raw_messages: list of messages in a format of message service
+        table: messages
         chat_platform: Name of chat platform
         language: Language of messages
         progress: Task progress object
     Returns a WordCloud in a PIL Image format
     """
-    if chat_platform == TELEGRAM:
-        msg_list_direct = remove_forwarded(raw_messages)
-        msg_list_txt = get_msg_text_list(msg_list_direct)
-    elif chat_platform == WHATSAPP:
-        msg_list_txt = get_msg_text_list(raw_messages)
-        msg_list_txt = filter_whatsapp_messages(msg_list_txt)
-    elif chat_platform == FACEBOOK:
-        msg_list_txt = filter_facebook_messages(raw_messages)
-        msg_list_txt = get_msg_text_list(msg_list_txt, text_key="content")
-    else:
-        raise ValueError("Wrong chat platform")
-
-    filtered_msg_list_txt = filter_big_messages(msg_list_txt)
-
-    words_list = get_words(filtered_msg_list_txt)
-
-    progress.value = 53
-    if language == ChatAnalysis.AnalysisLanguage.RUSSIAN:
-        normal_words = get_normalized_words_ru(words_list, progress)
-        progress.value = 85
-
-        # change the normal form of the word with a more common form
-        normal_words = [word if word != "деньга" else "деньги" for word in normal_words]
-
-        counted_words = get_word_count(normal_words)
-        progress.value = 90
-        wordcloud_pic = get_pic_from_frequencies(counted_words)
-    else:
-        if language == ChatAnalysis.AnalysisLanguage.ENGLISH:
-            stopwords = get_stopwords_for("english")
-        elif language == ChatAnalysis.AnalysisLanguage.UKRAINIAN:
-            stopwords = get_stopwords_for("ukrainian")
-        elif language == ChatAnalysis.AnalysisLanguage.UKRAINIAN_RUSSIAN:
-            stopwords = get_stopwords_for("ukrainian") + get_stopwords_for("russian")
-        else:
-            raise ValueError("Wrong language")
-
-        wc = WordCloud(
-            max_words=200,
-            width=1920,
-            height=1080,
-            color_func=get_colors_by_size,
-            stopwords=stopwords,
-            collocation_threshold=3,
-            min_word_length=3,
-        )
-        word_cloud = wc.generate(" ".join(filtered_msg_list_txt))
-        wordcloud_pic = word_cloud.to_image()
-
-    return wordcloud_pic
+    counted_words, _ = get_word_frequencies(table, chat_platform, language, progress)
+    progress.value = 90
+    return get_pic_from_frequencies(score_collocations(counted_words))
 
 
-def filter_whatsapp_messages(msg_list: list[str]) -> list[str]:
-    """Filters out bare links and WhatsApp service messages from the list of messages
+def get_word_frequencies(
+    table: MessageTable, chat_platform: str, language: str, progress: ProgressBar
+) -> tuple[dict[str, int], dict[str, np.ndarray]]:
+    """Counts the terms to show in the wordcloud, the counts of any chat parts can be summed and then scored with
+    score_collocations
     Args:
-        msg_list: List of messages
-    Returns filtered list of messages
+        table: messages
+        chat_platform: Name of chat platform
+        language: Language of messages
+        progress: Task progress object
+    Returns dict of terms and associated count and term index of the term counts of every day and sender
     """
-    msg_list_clean = []
-
-    for msg in msg_list:
-        for phrase in whatsapp_stoplist:
-            if phrase in msg:
-                break
-        else:
-            msg_list_clean.append(msg.strip())
-
-    return msg_list_clean
+    if chat_platform not in (TELEGRAM, WHATSAPP, FACEBOOK):
+        raise ValueError("Wrong chat platform")
+    is_russian = language == ChatAnalysis.AnalysisLanguage.RUSSIAN
+    stopwords = get_language_stopwords(language)
+    # the big messages are skipped while the terms are extracted
+    texts, senders, days = get_cloud_texts(table, chat_platform, max_words=None)
 
+    progress.value = 53
+    # every term of every day and sender is counted once
+    group_term_count = Counter()
+    message_terms = tokenize_messages(texts) if is_russian else extract_message_terms(texts, stopwords)
+    for terms, group in zip(message_terms, zip(days, senders)):
+        if terms is not None:
+            group_term_count.update((group, term) for term in terms)
+
+    normal_forms = {}
+    if is_russian:
+        # every distinct word is normalized once
+        tokens = list(dict.fromkeys(token for _, token in group_term_count))
+        normal_forms = dict(zip(tokens, get_normal_forms_ru(tokens, progress)))
+    progress.value = 85
 
-def remove_forwarded(msg_list: list[dict]) -> list[dict]:
-    """Filters out forwarded messages
+    word_count = Counter()
+    group_word_count = defaultdict(Counter)
+    for (group, term), count in group_term_count.items():
+        word = term
+        if is_russian:
+            word = normal_forms[term]
+            if word is None:
+                continue
+            # change the normal form of the word with a more common form
+            if word == "деньга":
+                word = "деньги"
+        word_count[word] += count
+        group_word_count[group][word] += count
+    return dict(word_count.most_common()), _get_group_index(group_word_count)
+
+
+def score_collocations(term_counts: dict[str, int], threshold: float = COLLOCATION_THRESHOLD) -> dict[str, int]:
+    """Chooses the pairs of words to show in the wordcloud like WordCloud.process_text, merges the cases and the
+    plurals of the words
     Args:
-        msg_list: List of Telegram messages
-    Returns filtered list of messages
+        term_counts: dict of terms and associated count, the pairs of words are joined with a space
+        threshold: minimum collocation score of the pairs of words to show
+    Returns dict of words and associated frequency
     """
-    filtered_msg_list = []
-    for msg in msg_list:
-        if not msg.get("forwarded_from"):
-            filtered_msg_list.append(msg)
-    return filtered_msg_list
+    word_counts, standard_forms = _merge_word_forms(
+        {term: count for term, count in term_counts.items() if " " not in term}
+    )
+    pair_counts, _ = _merge_word_forms({term: count for term, count in term_counts.items() if " " in term})
+    # the words shown in the pairs are discounted, but the scores use the original counts
+    original_counts = word_counts.copy()
+    words_count = sum(word_counts.values())
+    for pair, count in pair_counts.items():
+        first, second = (standard_forms[word.lower()] for word in pair.split(" "))
+        if score(count, original_counts[first], original_counts[second], words_count) > threshold:
+            word_counts[first] -= count
+            word_counts[second] -= count
+            word_counts[pair] = count
+    return {word: count for word, count in word_counts.items() if count > 0}
+
+
+def _merge_word_forms(counts: dict[str, int]) -> tuple[dict[str, int], dict[str, str]]:
+    """Sums the counts of the cases and the plurals of the words like wordcloud.tokenization.process_tokens
+    Returns dict of the most common forms and associated count and dict of the most common forms of the
+    lowercase words
+    """
+    cases = defaultdict(dict)
+    for word, count in counts.items():
+        word_cases = cases[word.lower()]
+        word_cases[word] = word_cases.get(word, 0) + count
+    # a word ending with "s" is a plural of the same word without "s" unless it ends with "ss"
+    plurals = {}
+    for word in list(cases):
+        if word.endswith("s") and not word.endswith("ss") and word[:-1] in cases:
+            singular_cases = cases[word[:-1]]
+            for case, count in cases.pop(word).items():
+                singular_cases[case[:-1]] = singular_cases.get(case[:-1], 0) + count
+            plurals[word] = word[:-1]
+    merged_counts = {}
+    standard_forms = {}
+    for word, word_cases in cases.items():
+        standard_form = max(word_cases.items(), key=itemgetter(1))[0]
+        merged_counts[standard_form] = sum(word_cases.values())
+        standard_forms[word] = standard_form
+    for plural, singular in plurals.items():
+        standard_forms[plural] = standard_forms[singular]
+    return merged_counts, standard_forms
+
+
+def _get_group_index(group_word_count: dict[tuple[int, Optional[str]], dict[str, int]]) -> dict[str, np.ndarray]:
+    """Makes term index of the word frequencies by (day, sender)"""
+    groups = list(group_word_count)
+    return make_term_index(
+        [day for day, _ in groups], [sender for _, sender in groups], [group_word_count[group] for group in groups]
+    )
 
 
-def filter_facebook_messages(msg_list: list[dict]) -> list[dict]:
-    """Removes Facebook service messages
+def get_cloud_texts(
+    table: MessageTable, chat_platform: str, max_words: Optional[int] = MAX_MESSAGE_WORDS
+) -> tuple[list[str], list[Optional[str]], list[int]]:
+    """Selects the message texts to count the words of
     Args:
-        msg_list: List of Telegram messages
-    Returns filtered list of messages
+        table: messages
+        chat_platform: Name of chat platform
+        max_words: maximum number of words in a message, None to keep the big messages
+    Returns list of texts, list of their sender names, None for the messages without a sender, and list of their
+    days since the epoch
     """
-    filtered_msg_list = []
-    for msg in msg_list:
-        if msg.get("type") == "Generic":
-            filtered_msg_list.append(msg)
-    return filtered_msg_list
+    # forwarded messages are written by other people
+    rows = np.flatnonzero(~table.forwarded)
+    # the code of the messages without a sender is -1
+    sender_names = [*table.senders, None]
+    message_days = table.get_datetimes()[rows].astype("datetime64[D]").view(np.int64).tolist()
+    texts = []
+    senders = []
+    days = []
+    for text, code, day in zip(table.get_texts(rows), table.sender_codes[rows].tolist(), message_days):
+        if not text:
+            continue
+        if chat_platform == WHATSAPP:
+            if is_whatsapp_service_message(text):
+                continue
+            text = text.strip()
+        if max_words is not None and is_big_message(text, max_words):
+            continue
+        texts.append(text)
+        senders.append(sender_names[code])
+        days.append(day)
+    return texts, senders, days
+
+
+def is_whatsapp_service_message(msg: str) -> bool:
+    """Checks whether the message is a bare link or a WhatsApp service message"""
+    return any(phrase in msg for phrase in whatsapp_stoplist)
 
 
-def get_msg_text_list(msg_list: list[dict], text_key: str = "text") -> list[str]:
-    """Parses messages text from the list of message dictionaries
+def filter_whatsapp_messages(msg_list: list[str]) -> list[str]:
+    """Filters out bare links and WhatsApp service messages from the list of messages
     Args:
-        msg_list: List of Telegram or WhatsApp messages
-        text_key: Message text key name in the dicts
-    Returns list of text messages
+        msg_list: List of messages
+    Returns filtered list of messages
     """
-    messages = []
-    for msg in msg_list:
-        msg_text = msg.get(text_key)
-        if msg_text and type(msg_text) is str:
-            messages.append(msg_text)
-    return messages
+    return [msg.strip() for msg in msg_list if not is_whatsapp_service_message(msg)]
 
 
 def filter_big_messages(msg_list: list[str]) -> list[str]:
@@ -139,35 +205,7 @@ def filter_big_messages(msg_list: list[str]) -> list[str]:
         msg_list: List of text messages
     Returns list of text messages
     """
-    return list(filter(lambda msg: len(msg.split()) < 56, msg_list))
-
-
-def remove_emojis(text: str) -> str:
-    """Removes emojis from a string"""
-    emojis = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"  # emoticons
-        "\U0001F300-\U0001F5FF"  # symbols & pictographs
-        "\U0001F680-\U0001F6FF"  # transport & map symbols
-        "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        "\U00002500-\U00002BEF"  # chinese char
-        "\U00002702-\U000027B0"
-        "\U00002702-\U000027B0"
-        "\U000024C2-\U0001F251"
-        "\U0001f926-\U0001f937"
-        "\U00010000-\U0010ffff"
-        "\u2640-\u2642"
-        "\u2600-\u2B55"
-        "\u200d"
-        "\u23cf"
-        "\u23e9"
-        "\u231a"
-        "\ufe0f"  # dingbats
-        "\u3030"
-        "]+",
-        re.UNICODE,
-    )
-    return re.sub(emojis, "", text)
+    return [msg for msg in msg_list if not is_big_message(msg)]
 
 
 def get_words(msg_list_txt: list[str]) -> list[str]:
@@ -176,13 +214,7 @@ def get_words(msg_list_txt: list[str]) -> list[str]:
         msg_list_txt: list of strings
     Returns list of words
     """
-    all_messages_text = " ".join(msg_list_txt)
-    punctuation = '!"#$%&()*+,-./:;<=>?@[]^_`{|}~„“«»†*—/-‘’1234567890'
-
-    clean_text = "".join(char for char in all_messages_text if char not in punctuation)
-    clean_text = remove_emojis(clean_text)
-
-    return clean_text.lower().split()
+    return [word for text in msg_list_txt for word in tokenize(text)]
 
 
 def get_normalized_words_ru(words: list[str], progress: ProgressBar) -> list[str]:
@@ -191,24 +223,43 @@ def get_normalized_words_ru(words: list[str], progress: ProgressBar) -> list[str
         words: list of words in russian
         progress: task progress tracking object
     """
-    normal_words = []
-    progress_total = len(words)
-    progress_current = 0
+    return [word for word in get_normal_forms_ru(words, progress) if word is not None]
+
+
+def get_normal_forms_ru(words: list[str], progress: ProgressBar) -> list[Optional[str]]:
+    """Returns normal forms of nouns in russian, None for other words and words in a stop-list
+    Args:
+        words: list of words in russian
+        progress: task progress tracking object
+    """
+    # every distinct word is parsed once, the parsed words are cached for the following analyses
+    normal_forms = dict.fromkeys(words)
+    lemmas = lemma_cache.get_many(normal_forms)
+    missing_words = [word for word in normal_forms if word not in lemmas]
+    progress_total = len(missing_words)
     init_percent = progress.value
-    stopwords_ru = get_stopwords_for("russian")
-    for word in words:
-        progress_current += 1
+    for progress_current, word in enumerate(missing_words, 1):
         word_analysis = morph.parse(word)[0]
+        # grammemes are str subclasses, which can't be pickled for the shared cache
+        part_of_speech = word_analysis.tag.POS
+        lemmas[word] = (word_analysis.normal_form, str(part_of_speech) if part_of_speech is not None else None)
         progress.value = init_percent + int(32 * progress_current / progress_total)
+    lemma_cache.set_many({word: lemmas[word] for word in missing_words})
+    progress.value = init_percent + 32
+    logger.info("Lemma cache: %s", lemma_cache.get_stats())
+
+    stopwords_ru = get_language_stopwords(ChatAnalysis.AnalysisLanguage.RUSSIAN)
+    for word in normal_forms:
+        normal_form, part_of_speech = lemmas[word]
         if (
-            word_analysis.tag.POS == "NOUN"
+            part_of_speech == "NOUN"
             and word not in stopwords_ru
-            and word_analysis.normal_form not in stopwords_ru
-            and len(word_analysis.normal_form) > 2
+            and normal_form not in stopwords_ru
+            and len(normal_form) > 2
         ):
-            normal_words.append(word_analysis.normal_form)
+            normal_forms[word] = normal_form
 
-    return normal_words
+    return [normal_forms[word] for word in words]
 
 
 def get_word_count(word_list: list[str]) -> dict[str:int]:
@@ -222,6 +273,37 @@ def get_word_count(word_list: list[str]) -> dict[str:int]:
     return dict(word_count.most_common())
 
 
+def merge_word_frequencies(*word_frequencies: dict[str, int]) -> dict[str, int]:
+    """Sums word frequencies of the chat parts
+    Args:
+        word_frequencies: dicts of words and associated frequency
+    Returns dict of words and associated frequency sorted by the frequency
+    """
+    word_count = Counter()
+    for frequencies in word_frequencies:
+        word_count.update(frequencies)
+    return dict(word_count.most_common())
+
+
+def drop_sender_words(
+    word_frequencies: dict[str, int], sender_frequencies: dict[str, dict[str, int]], stop_users: Iterable[str]
+) -> dict[str, int]:
+    """Subtracts the words of the users in the stop list from the word frequencies
+    Args:
+        word_frequencies: dict of words and associated frequency
+        sender_frequencies: dicts of words and associated frequency by sender name
+        stop_users: names of the users to remove
+    Returns dict of words and associated frequency sorted by the frequency
+    """
+    stop_users = [user for user in stop_users if user in sender_frequencies]
+    if not stop_users:
+        return word_frequencies
+    word_count = Counter(word_frequencies)
+    for user in stop_users:
+        word_count.subtract(sender_frequencies[user])
+    return {word: count for word, count in word_count.most_common() if count > 0}
+
+
 # skipcq: PYL-W0613
 def get_colors_by_size(word, font_size, position, orientation, font_path, random_state) -> Union[tuple, str]:  # noqa
     """Returns a color depending on a font size for a WordCloud generating"""
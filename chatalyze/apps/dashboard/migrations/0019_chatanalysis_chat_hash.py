@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0018_remove_chatanalysis_dashboard_chatanalysis_language_valid_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatanalysis",
+            name="chat_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
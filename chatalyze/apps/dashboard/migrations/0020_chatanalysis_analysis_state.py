@@ -0,0 +1,25 @@
+# Generated by Django 4.0.6 on 2026-10-18 12:51
+
+import apps.utils
+import django.core.files.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0019_chatanalysis_chat_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatanalysis",
+            name="analysis_state",
+            field=models.FileField(
+                blank=True,
+                null=True,
+                storage=django.core.files.storage.FileSystemStorage(location="usersfiles"),
+                upload_to=apps.utils.RandomFileName("states"),
+            ),
+        ),
+    ]
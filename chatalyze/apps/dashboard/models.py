@@ -1,8 +1,9 @@
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models.signals import pre_delete
+from django.db import models, transaction
+from django.db.models.signals import pre_delete, post_init, post_save, post_delete
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
+from django_cleanup import cleanup
 from model_utils.fields import UrlsafeTokenField
 
 from apps.utils import RandomFileName
@@ -11,12 +12,14 @@ from core.celery import app
 from .const import WHATSAPP, TELEGRAM, FACEBOOK
 
 
+@cleanup.ignore
 class ChatAnalysis(models.Model):
     """Stores analysis results and chat information
 
     Attributes:
         author: Related User model
-        chat_file: File containing chat messages
+        chat_file: File containing chat messages, the same uploaded files are stored once and shared by the analyses
+        chat_hash: SHA-256 hash of the chat file content
         chat_name: Chat title
         telegram_id: Chat id for Telegram chats
         chat_platform: Chat platform name
@@ -26,10 +29,12 @@ class ChatAnalysis(models.Model):
         updated: Date and time the last analysis finished
         status: Analysis status
         error_text: Text of error to display
-        word_cloud_pic: WordCloud picture file
+        word_cloud_pic: WordCloud picture file, can be shared by the analyses of the same chat file
         task_id: Last Celery task id for the analysis
         results: Analysis data
         progress_id: Task progress id to use in cache
+        analysis_state: Mergeable counters of the analyzed messages used to analyze only new messages of updated chats,
+            can be shared by the analyses of the same chat file
 
     """
 
@@ -61,6 +66,11 @@ class ChatAnalysis(models.Model):
         on_delete=models.CASCADE,
     )
     chat_file = models.FileField(upload_to="chats", storage=settings.private_storage)
+    chat_hash = models.CharField(
+        blank=True,
+        max_length=64,
+        db_index=True,
+    )
     chat_name = models.CharField(
         max_length=255,
         default="-",
@@ -109,6 +119,12 @@ class ChatAnalysis(models.Model):
         blank=True,
         max_length=50,
     )
+    analysis_state = models.FileField(
+        blank=True,
+        null=True,
+        upload_to=RandomFileName("states"),
+        storage=settings.private_storage,
+    )
 
     def __str__(self):
         return f"{self.author} - {self.chat_name}"
@@ -152,6 +168,53 @@ def my_handler(instance, **__):
     app.control.revoke(instance.task_id, terminate=True)
 
 
+SHARED_FILE_FIELDS = ("chat_file", "word_cloud_pic", "analysis_state")
+
+
+def _get_file_names(instance: ChatAnalysis) -> dict[str, str]:
+    # deferred fields are missing in __dict__ and are not loaded
+    names = {}
+    for field_name in SHARED_FILE_FIELDS:
+        if field_name in instance.__dict__:
+            file = instance.__dict__[field_name]
+            names[field_name] = getattr(file, "name", file) or ""
+    return names
+
+
+def _delete_unused_file(field_name: str, file_name: str) -> None:
+    """Deletes the stored file if no analysis refers to it"""
+    if not file_name or ChatAnalysis.objects.filter(**{field_name: file_name}).exists():
+        return
+    ChatAnalysis._meta.get_field(field_name).storage.delete(file_name)
+
+
+@receiver(post_init, sender=ChatAnalysis)
+def remember_file_names(instance, **__):
+    """Remembers the file names to find replaced files on save"""
+    instance._stored_file_names = _get_file_names(instance)
+
+
+@receiver(post_save, sender=ChatAnalysis)
+def delete_replaced_files(instance, update_fields=None, **__):
+    """Deletes the files replaced in the analysis unless other analyses share them.
+    The files are shared, so the model is ignored by django-cleanup.
+    """
+    new_names = _get_file_names(instance)
+    for field_name, old_name in instance._stored_file_names.items():
+        if update_fields is not None and field_name not in update_fields:
+            continue
+        if field_name in new_names and new_names[field_name] != old_name:
+            transaction.on_commit(lambda args=(field_name, old_name): _delete_unused_file(*args))
+    instance._stored_file_names = new_names
+
+
+@receiver(post_delete, sender=ChatAnalysis)
+def delete_files(instance, **__):
+    """Deletes the files of the deleted analysis unless other analyses share them"""
+    for field_name, file_name in _get_file_names(instance).items():
+        transaction.on_commit(lambda args=(field_name, file_name): _delete_unused_file(*args))
+
+
 class ShareLink(models.Model):
     """Stores public id for a shared analysis
 
@@ -1,43 +1,60 @@
-import json
-import yaml
+from contextlib import ExitStack
 
-from celery import shared_task
+from celery import chord, shared_task
+from django.db import OperationalError
 
-from .analysis_tools.main import analyze_tg, analyze_wa, analyze_fb, update_tg
+from .analysis_tools.ingestion import open_chat_export, detect_json_platform, get_chat_file_name
+from .analysis_tools.main import (
+    analyze_tg,
+    analyze_wa,
+    analyze_fb,
+    update_tg,
+    apply_stoplist,
+    analyze_statistics,
+    analyze_words,
+    finish_analyses,
+    fail_analyses,
+)
 from .const import TELEGRAM, WHATSAPP, FACEBOOK
 from .models import ChatAnalysis
 from .utils import explain_error
 
+# storage and database connection errors, which may pass on retry
+RETRY_ERRORS = (OSError, OperationalError)
+RETRY_OPTIONS = {"autoretry_for": RETRY_ERRORS, "max_retries": 2, "retry_backoff": True}
+
 
 @shared_task
 def analyze_chat_file(analysis_id):
     """Starts chat analysis"""
     analysis = ChatAnalysis.objects.get(pk=analysis_id)
-    if analysis.chat_file.name.endswith(".json"):
-        try:
-            with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-                chat_file = json.load(f)
-        except json.JSONDecodeError as e:
+    try:
+        chat_file_name = get_chat_file_name(analysis.chat_file.path)
+    except Exception as e:
+        explain_error(analysis, e, "Couldn't find the chat file in the archive")
+
+    if chat_file_name.endswith(".json"):
+        with ExitStack() as stack:
             try:
-                if analysis.chat_file.file.size > 20e6:  # don't process files bigger than 20 MB as it's very slow
-                    raise
-                with open(analysis.chat_file.path, "r", encoding="UTF8") as f:
-                    chat_file = yaml.safe_load(f)
-            except Exception:
+                header, messages = stack.enter_context(open_chat_export(analysis.chat_file.path))
+            except Exception as e:
                 explain_error(analysis, e, "File format is wrong")
 
-        if chat_file.get("participants"):
-            analyze_fb(analysis)
-        else:
-            analyze_tg(analysis)
+            if detect_json_platform(header) == FACEBOOK:
+                run = analyze_fb(analysis, header, messages)
+            else:
+                run = analyze_tg(analysis, header, messages)
 
-    elif analysis.chat_file.name.endswith(".txt"):
-        analyze_wa(analysis)
+    elif chat_file_name.endswith(".txt"):
+        run = analyze_wa(analysis)
 
     else:
         analysis.status = ChatAnalysis.AnalysisStatus.ERROR
         analysis.error_text = "Couldn't recognize message service."
         analysis.save()
+        return
+
+    start_analyses(analysis_id, run)
 
 
 @shared_task
@@ -45,8 +62,59 @@ def update_chat_analysis(analysis_id):
     """Starts updated chat analysis"""
     analysis = ChatAnalysis.objects.get(pk=analysis_id)
     if analysis.chat_platform == TELEGRAM:
-        update_tg(analysis)
+        run = update_tg(analysis)
     elif analysis.chat_platform == WHATSAPP:
-        analyze_wa(analysis)
+        run = analyze_wa(analysis)
     elif analysis.chat_platform == FACEBOOK:
-        analyze_fb(analysis)
+        run = analyze_fb(analysis)
+    else:
+        return
+    start_analyses(analysis_id, run)
+
+
+@shared_task
+def update_chat_stoplist(analysis_id):
+    """Applies the changed stop list of users to the chat analysis"""
+    analysis = ChatAnalysis.objects.get(pk=analysis_id)
+    if not apply_stoplist(analysis):
+        update_chat_analysis(analysis_id)
+
+
+def start_analyses(analysis_id: int, run: dict) -> None:
+    """Runs the general analysis and the word cloud generation of every chunk of messages in parallel tasks,
+    the results are merged once all of them finish
+    Args:
+        analysis_id: analysis info model id
+        run: parameters of the analyses
+    """
+    finish = finish_chat_analysis.s(analysis_id, run).on_error(fail_chat_analysis.s(analysis_id, run))
+    chunk_tasks = [
+        task.s(analysis_id, run, chunk)
+        for chunk in range(len(run["chunks"]))
+        for task in (count_chat_statistics, count_chat_words)
+    ]
+    chord(chunk_tasks, finish).delay()
+
+
+@shared_task(**RETRY_OPTIONS)
+def count_chat_statistics(analysis_id, run, chunk):
+    """Counts the messages of the chunk for the general analysis"""
+    analyze_statistics(ChatAnalysis.objects.get(pk=analysis_id), run, chunk)
+
+
+@shared_task(**RETRY_OPTIONS)
+def count_chat_words(analysis_id, run, chunk):
+    """Counts the words of the chunk for the word cloud"""
+    analyze_words(ChatAnalysis.objects.get(pk=analysis_id), run, chunk)
+
+
+@shared_task(**RETRY_OPTIONS)
+def finish_chat_analysis(_, analysis_id, run):
+    """Merges the results of the parallel analyses and saves them"""
+    finish_analyses(ChatAnalysis.objects.get(pk=analysis_id), run)
+
+
+@shared_task
+def fail_chat_analysis(request, exc, traceback, analysis_id, run):  # noqa
+    """Marks the analysis failed once all the parallel analyses finish"""
+    fail_analyses(ChatAnalysis.objects.filter(pk=analysis_id).first(), run)
@@ -16,5 +16,7 @@ urlpatterns = [
     path("result/<int:pk>/share-chat", views.share_analysis, name="share_analysis"),
     path("share/<str:pk>", views.shared_result, name="shared_result"),
     path("result/<int:pk>/stoplist", views.set_stoplist, name="set_stoplist"),
+    path("result/<int:pk>/query", views.query_results, name="query_results"),
+    path("result/<int:pk>/query-wordcloud", views.query_wordcloud, name="query_wordcloud"),
     path("results/task-progress", views.get_progress, name="task_progress"),
 ]
@@ -1,14 +1,21 @@
 import datetime
+import hashlib
 import json
+import os
 import re
+import tempfile
+import zipfile
 from io import BytesIO
-from typing import Optional
+from typing import Optional, Sequence
 
 from PIL.Image import Image
 from django.core.cache import cache
+from django.core.files import File
 from django.core.files.images import ImageFile
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from apps.dashboard.analysis_tools.ingestion import find_chat_files
 from apps.dashboard.models import ChatAnalysis
 
 
@@ -36,11 +43,44 @@ class ProgressBar:
         cache.delete(f"task-progress:{self.progress_id}")
 
 
-def explain_error(analysis: ChatAnalysis, e: Optional[BaseException] = None, message: Optional[str] = None) -> None:
-    """Saves error message and raises exception
+class PartProgressBar(ProgressBar):
+    """Progress bar value of one of the tasks running in parallel, the average value of the tasks is stored
+    as the progress of the analysis
+    """
+
+    def __init__(self, progress_id: str, part: str, parts: Sequence[str], timeout: int = 60 * 60):
+        super().__init__(progress_id, timeout)
+        self.part = part
+        self.parts = parts
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, val: int):
+        if self._value != val:
+            self._value = val
+            cache.set(f"task-progress:{self.progress_id}:{self.part}", val, timeout=self.timeout)
+            values = cache.get_many([f"task-progress:{self.progress_id}:{part}" for part in self.parts])
+            average = sum(values.values()) // len(self.parts)
+            cache.set(f"task-progress:{self.progress_id}", average, timeout=self.timeout)
+
+    @value.deleter
+    def value(self):
+        self._value = None
+        cache.delete(f"task-progress:{self.progress_id}:{self.part}")
+
+
+def delete_progress(progress_id: str, parts: Sequence[str] = ()) -> None:
+    """Removes the progress of the analysis and its parts from cache"""
+    cache.delete_many([f"task-progress:{progress_id}", *(f"task-progress:{progress_id}:{part}" for part in parts)])
+
+
+def mark_error(analysis: ChatAnalysis, message: Optional[str] = None) -> None:
+    """Saves error message
     Args:
         analysis: analysis info model
-        e: Exception
         message: error message to display for a user
     """
     analysis.refresh_from_db()
@@ -48,6 +88,16 @@ def explain_error(analysis: ChatAnalysis, e: Optional[BaseException] = None, mes
     analysis.error_text = message if message else "Couldn't process your file"
     analysis.save()
     cache.delete(f"task-progress:{analysis.progress_id}")
+
+
+def explain_error(analysis: ChatAnalysis, e: Optional[BaseException] = None, message: Optional[str] = None) -> None:
+    """Saves error message and raises exception
+    Args:
+        analysis: analysis info model
+        e: Exception
+        message: error message to display for a user
+    """
+    mark_error(analysis, message)
     if e:
         raise Exception from e
     else:
@@ -84,6 +134,118 @@ def get_whatsapp_chat_name(filename: str) -> Optional[str]:
         return name_regex_en.group(1)
 
 
+def bundle_chat_parts(files: Sequence[File], name: str = "messages.zip") -> File:
+    """Packs the parts of a chat export uploaded as several files into a single zip archive
+    Args:
+        files: uploaded files
+        name: archive file name
+    Returns Django File of the archive
+    """
+    archive_file = tempfile.TemporaryFile()
+    with zipfile.ZipFile(archive_file, "w", compression=zipfile.ZIP_STORED) as archive:
+        # members are sorted and have a fixed date, so the same parts are always packed into the same archive
+        for file in sorted(files, key=lambda file: file.name):
+            with archive.open(zipfile.ZipInfo(os.path.basename(file.name)), "w", force_zip64=True) as member:
+                for chunk in file.chunks():
+                    member.write(chunk)
+    archive_file.seek(0)
+    return File(archive_file, name=name)
+
+
+def inspect_chat_file(file: File) -> tuple[str, int]:
+    """Finds the chat file in the uploaded file
+    Args:
+        file: uploaded chat file or zip archive
+    Returns the name and the size of the chat file. For archives the size of the uncompressed chat files is returned.
+    """
+    if not file.name.endswith(".zip"):
+        return file.name, file.size
+    with zipfile.ZipFile(file) as archive:
+        members = find_chat_files(archive.namelist())
+        return members[0], sum(archive.getinfo(member).file_size for member in members)
+
+
+def hash_chat_file(file: File) -> str:
+    """Computes SHA-256 hash of the file content reading it chunk by chunk
+    Args:
+        file: uploaded chat file
+    Returns hex digest of the hash
+    """
+    file_hash = hashlib.sha256()
+    for chunk in file.chunks():
+        file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def store_chat_file(analysis: ChatAnalysis, file: File, chat_hash: str) -> None:
+    """Assigns the chat file to the analysis storing the file under its hash, so the same files are stored once
+    Args:
+        analysis: analysis info model
+        file: uploaded chat file
+        chat_hash: hash of the file content
+    """
+    field = analysis.chat_file.field
+    file_name = field.generate_filename(analysis, chat_hash + os.path.splitext(file.name)[1])
+    if not field.storage.exists(file_name):
+        file_name = field.storage.save(file_name, file)
+    analysis.chat_file.name = file_name
+    analysis.chat_hash = chat_hash
+
+
+def find_finished_analysis(
+    chat_hash: str, language: str, custom_stoplist: list[str], exclude_pk: Optional[int] = None
+) -> Optional[ChatAnalysis]:
+    """Finds an analysis of the same chat file with the same settings which finished without errors
+    Args:
+        chat_hash: hash of the chat file content
+        language: chat language
+        custom_stoplist: names of the users excluded from the analysis
+        exclude_pk: id of the analysis to skip
+    Returns the last finished analysis or None
+    """
+    finished = ChatAnalysis.objects.filter(
+        chat_hash=chat_hash,
+        language=language,
+        custom_stoplist=custom_stoplist,
+        status=ChatAnalysis.AnalysisStatus.READY,
+        error_text="",
+        results__isnull=False,
+        word_cloud_pic__isnull=False,
+    ).exclude(word_cloud_pic="")
+    if exclude_pk is not None:
+        finished = finished.exclude(pk=exclude_pk)
+    return finished.order_by("-updated").first()
+
+
+def reuse_finished_analysis(analysis: ChatAnalysis) -> Optional[ChatAnalysis]:
+    """Copies the results of a finished analysis of the same chat file with the same settings instead of running
+    the analysis again. The word cloud and the analysis state files are shared by the analyses. The analysis is not
+    saved.
+    Args:
+        analysis: analysis info model with the stored chat file
+    Returns the analysis the results are copied from or None if there is no suitable analysis
+    """
+    if not analysis.chat_hash:
+        return
+    finished = find_finished_analysis(analysis.chat_hash, analysis.language, analysis.custom_stoplist, analysis.pk)
+    # updated analyses must stay the same chat
+    if not finished or analysis.chat_platform not in ("-", finished.chat_platform):
+        return
+    if analysis.telegram_id not in ("", finished.telegram_id):
+        return
+    analysis.chat_platform = finished.chat_platform
+    analysis.telegram_id = finished.telegram_id
+    analysis.messages_count = finished.messages_count
+    analysis.results = finished.results
+    analysis.word_cloud_pic.name = finished.word_cloud_pic.name
+    analysis.analysis_state.name = finished.analysis_state.name
+    analysis.status = ChatAnalysis.AnalysisStatus.READY
+    analysis.error_text = ""
+    analysis.task_id = None
+    analysis.updated = timezone.now()
+    return finished
+
+
 def generate_dates(end_date: float, n: int, step_days: int = 1) -> list[str]:
     """Generates list of dates with specified parameters
     Args:
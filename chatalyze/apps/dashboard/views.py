@@ -1,4 +1,6 @@
 import json
+import zipfile
+from datetime import date
 from secrets import token_urlsafe
 from time import sleep
 
@@ -15,12 +17,44 @@ from django_celery_results.models import TaskResult
 from django.utils.translation import gettext_lazy as _
 
 from . import models, tasks
+from .analysis_tools import main as chat_analysis
 from .const import TELEGRAM, WHATSAPP, FACEBOOK
-from .utils import get_whatsapp_chat_name, load_chat_statistics
+from .utils import (
+    get_whatsapp_chat_name,
+    load_chat_statistics,
+    bundle_chat_parts,
+    inspect_chat_file,
+    hash_chat_file,
+    store_chat_file,
+    reuse_finished_analysis,
+)
 from ..authentication.models import UserProfile
 from ..config.models import SiteConfiguration
 
 
+CHAT_FILE_EXTENSIONS = (".txt", ".json", ".zip")
+
+
+def get_uploaded_chat_file(request):
+    """Returns the uploaded chat file with the name and the size of the chat file itself, looking into zip archives.
+    Facebook export parts are packed into a single archive. Returns None if the upload is not a chat export.
+    """
+    files = request.FILES.getlist("chatfile")
+    if len(files) > 1:
+        if not all(file.name.endswith(".json") for file in files):
+            return
+        file = bundle_chat_parts(files)
+    elif files and files[0].name.endswith(CHAT_FILE_EXTENSIONS):
+        file = files[0]
+    else:
+        return
+    try:
+        chat_file_name, chat_file_size = inspect_chat_file(file)
+    except (zipfile.BadZipFile, ValueError):
+        return
+    return file, chat_file_name, chat_file_size
+
+
 def index(request):
     """Displays main page"""
     chats_number = models.ChatAnalysis.objects.count()
@@ -31,21 +65,29 @@ def index(request):
 @login_required(login_url="/login/")
 def analyze(request):
     """Stores received file and starts its analysis"""
-    file = request.FILES["chatfile"]
+    upload = get_uploaded_chat_file(request)
     lang = request.POST.get("lang")
-    if file and file.name.endswith((".txt", ".json")):
-        if file.size > SiteConfiguration.get_solo().max_file_size * 1e6:
+    if upload:
+        file, chat_file_name, chat_file_size = upload
+        if chat_file_size > SiteConfiguration.get_solo().max_file_size * 1e6:
             return HttpResponseBadRequest(_("File is too big"))
         if lang not in models.ChatAnalysis.AnalysisLanguage.values:
             return HttpResponseBadRequest(_("Choose chat language"))
-        chat_name = get_whatsapp_chat_name(file.name) or "noname"
-        analysis = models.ChatAnalysis.objects.create(
+        chat_name = get_whatsapp_chat_name(chat_file_name)
+        analysis = models.ChatAnalysis(
             author=request.user,
-            chat_name=chat_name,
-            chat_file=file,
+            chat_name=chat_name or "noname",
             language=lang,
             progress_id=token_urlsafe(32),
         )
+        store_chat_file(analysis, file, hash_chat_file(file))
+        # the same chat uploaded again gets the results without running the analysis
+        finished = reuse_finished_analysis(analysis)
+        if finished:
+            analysis.chat_name = chat_name or finished.chat_name
+            analysis.save()
+            return redirect("dashboard:result", pk=analysis.pk)
+        analysis.save()
         task = tasks.analyze_chat_file.delay(analysis_id=analysis.id)
         analysis.task_id = task.id
         analysis.save()
@@ -59,24 +101,28 @@ def analyze(request):
 @login_required(login_url="/login/")
 def analysis_update(request, pk):
     """Stores the file and starts its analysis if it is compatible with specified chat_platform"""
-    file = request.FILES.get("chatfile")
-    if not file or not file.name.endswith((".txt", ".json")):
+    upload = get_uploaded_chat_file(request)
+    if not upload:
         return HttpResponseBadRequest(_("You've uploaded a wrong file"))
-    if file.size > SiteConfiguration.get_solo().max_file_size * 1e6:
+    file, chat_file_name, chat_file_size = upload
+    if chat_file_size > SiteConfiguration.get_solo().max_file_size * 1e6:
         return HttpResponseBadRequest(_("File is too big"))
 
     analysis = get_object_or_404(models.ChatAnalysis, pk=pk)
     if analysis.author != request.user:
         raise PermissionDenied()
 
-    if not (analysis.chat_platform in (TELEGRAM, FACEBOOK) and file.name.endswith(".json")) and not (
-        analysis.chat_platform == WHATSAPP and file.name.endswith(".txt")
+    if not (analysis.chat_platform in (TELEGRAM, FACEBOOK) and chat_file_name.endswith(".json")) and not (
+        analysis.chat_platform == WHATSAPP and chat_file_name.endswith(".txt")
     ):
         return HttpResponseBadRequest(_("The uploaded file doesn't match this chat's messenger"))
 
-    analysis.chat_file = file
+    store_chat_file(analysis, file, hash_chat_file(file))
     if not analysis.progress_id:
         analysis.progress_id = token_urlsafe(32)
+    if reuse_finished_analysis(analysis):
+        analysis.save()
+        return redirect("dashboard:result", pk=pk)
     analysis.save()
 
     task = tasks.update_chat_analysis.delay(analysis_id=analysis.id)
@@ -291,8 +337,11 @@ def set_stoplist(request, pk):
 
     if new_stoplist != analysis.custom_stoplist:
         analysis.custom_stoplist = new_stoplist
+        if reuse_finished_analysis(analysis):
+            analysis.save()
+            return redirect("dashboard:result", pk=pk)
         analysis.save()
-        task = tasks.update_chat_analysis.delay(analysis_id=analysis.id)
+        task = tasks.update_chat_stoplist.delay(analysis_id=analysis.id)
         analysis.task_id = task.id
         analysis.status = analysis.AnalysisStatus.PROCESSING
         analysis.save()
@@ -300,6 +349,54 @@ def set_stoplist(request, pk):
     return redirect("dashboard:result", pk=pk)
 
 
+def get_query_filters(request):
+    """Returns the first date, the last date and the users of the results query, None for missing values.
+    Raises ValueError if a date is not in the ISO format.
+    """
+    first_date, last_date = (
+        date.fromisoformat(request.GET[name]) if request.GET.get(name) else None for name in ("start", "end")
+    )
+    return first_date, last_date, request.GET.getlist("users") or None
+
+
+@login_required(login_url="/login/")
+def query_results(request, pk):
+    """Returns the general analysis results for the period and the users in the query string"""
+    analysis = get_object_or_404(models.ChatAnalysis, pk=pk)
+
+    if analysis.author != request.user:
+        raise PermissionDenied()
+
+    try:
+        data = chat_analysis.query_results(analysis, *get_query_filters(request))
+    except ValueError:
+        return HttpResponseBadRequest(_("There are no messages for the query"))
+    if data is None:
+        return HttpResponseNotFound(_("Update the chat to filter its results"))
+
+    return JsonResponse(data)
+
+
+@login_required(login_url="/login/")
+def query_wordcloud(request, pk):
+    """Returns the word cloud picture for the period and the users in the query string"""
+    analysis = get_object_or_404(models.ChatAnalysis, pk=pk)
+
+    if analysis.author != request.user:
+        raise PermissionDenied()
+
+    try:
+        wordcloud_pic = chat_analysis.query_wordcloud(analysis, *get_query_filters(request))
+    except ValueError:
+        return HttpResponseBadRequest(_("There are no words for the query"))
+    if wordcloud_pic is None:
+        return HttpResponseNotFound(_("Update the chat to filter its results"))
+
+    response = HttpResponse(content_type="image/png")
+    wordcloud_pic.save(response, format="PNG")
+    return response
+
+
 @login_required
 def get_progress(request):
     """Returns running task progress in percents"""
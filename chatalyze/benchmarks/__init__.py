@@ -0,0 +1,103 @@
+"""Performance benchmarks for the analysis pipeline.
+
+Run from the `chatalyze` directory, e.g. `python -m benchmarks.ingestion`.
+"""
+import json
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable
+
+import django
+
+
+def setup_django() -> None:
+    """Configures Django for benchmarks touching models or cache"""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    django.setup()
+
+
+def measure(func: Callable, *args, **kwargs) -> tuple[float, float]:
+    """Runs the function once
+    Returns elapsed time in seconds and peak traced memory in MB
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def time_call(func: Callable, *args, **kwargs) -> float:
+    """Runs the function once without tracing memory, which slows down allocations
+    Returns elapsed time in seconds
+    """
+    started = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def make_telegram_export(file_path: str, messages_count: int, seed: int = 0, users_count: int = 12) -> None:
+    """Writes a synthetic Telegram export file
+    Args:
+        file_path: path of the file to create
+        messages_count: number of messages in the export
+        seed: random generator seed
+        users_count: number of chat members
+    """
+    rnd = random.Random(seed)
+    users = [(f"User {i}", f"user{i}") for i in range(users_count)]
+    words = ["hello", "how", "are", "you", "message", "chat", "today", "привет", "как", "дела", "слово", "ok"]
+    date = datetime(2019, 1, 1)
+    messages = []
+    for i in range(messages_count):
+        date += timedelta(seconds=rnd.randint(1, 600))
+        name, user_id = rnd.choice(users)
+        msg = {
+            "id": i + 1,
+            "type": "message",
+            "date": date.strftime("%Y-%m-%dT%H:%M:%S"),
+            "from": name,
+            "from_id": user_id,
+            "text": " ".join(rnd.choices(words, k=rnd.randint(1, 12))),
+        }
+        if i % 15 == 0:
+            msg["media_type"] = "sticker"
+            msg["text"] = ""
+        if i % 40 == 0:
+            msg["forwarded_from"] = "Channel"
+        messages.append(msg)
+    with open(file_path, "w", encoding="UTF8") as f:
+        json.dump({"name": "Benchmark chat", "type": "private_group", "id": 1, "messages": messages}, f, indent=1)
+
+
+def make_whatsapp_export(file_path: str, messages_count: int, seed: int = 0) -> None:
+    """Writes a synthetic WhatsApp export file
+    Args:
+        file_path: path of the file to create
+        messages_count: number of messages in the export
+        seed: random generator seed
+    """
+    rnd = random.Random(seed)
+    users = [f"User {i}" for i in range(12)]
+    words = ["hello", "how", "are", "you", "message", "chat", "today", "привет", "как", "дела", "слово", "ok"]
+    date = datetime(2019, 1, 1)
+    lines = [f"{date:%m/%d/%y}, 00:00 - Messages and calls are end-to-end encrypted."]
+    for i in range(messages_count):
+        date += timedelta(seconds=rnd.randint(1, 600))
+        text = " ".join(rnd.choices(words, k=rnd.randint(1, 12)))
+        if i % 15 == 0:
+            text = "<Media omitted>"
+        elif i % 40 == 0:
+            text = "see https://example.com/page"
+        elif i % 10 == 0:
+            text += "\n" + " ".join(rnd.choices(words, k=5))
+        elif i % 500 == 0:
+            text = "This message was deleted"
+        lines.append(f"{date:%m/%d/%y}, {date:%H:%M} - {rnd.choice(users)}: {text}")
+    with open(file_path, "w", encoding="UTF8") as f:
+        f.write("\n".join(lines))
@@ -0,0 +1,72 @@
+"""Compares repairing Facebook export strings with ftfy one by one and with the bulk repair,
+and reading a multi-part export with json.load and with the streaming merge"""
+import json
+import os
+import random
+import sys
+import tempfile
+import zipfile
+
+from ftfy import ftfy
+
+from apps.dashboard.analysis_tools.ingestion import open_chat_export, read_facebook_columns, repair_mojibake
+from benchmarks import measure
+
+
+def make_strings(messages_count: int, seed: int = 0) -> list[str]:
+    """Returns message texts encoded the way Facebook exports them"""
+    rnd = random.Random(seed)
+    words = ["hello", "how", "are", "you", "message", "chat", "café", "привет", "как", "дела", "слово", "😀"]
+    texts = [" ".join(rnd.choices(words, k=rnd.randint(1, 12))) for _ in range(messages_count)]
+    return [text.encode("UTF8").decode("latin-1") for text in texts]
+
+
+def make_parts_archive(file_path: str, messages_count: int, parts_count: int = 5) -> None:
+    """Writes a zip archive of Facebook export parts, the first part having the newest messages"""
+    contents = make_strings(messages_count)
+    messages = [
+        {"sender_name": f"User {i % 7}", "timestamp_ms": 1_600_000_000_000 - i * 1000, "type": "Generic", "content": c}
+        for i, c in enumerate(contents)
+    ]
+    part_size = -(-messages_count // parts_count)
+    with zipfile.ZipFile(file_path, "w") as archive:
+        for i in range(parts_count):
+            part = {"participants": [], "messages": messages[i * part_size : (i + 1) * part_size], "title": "Chat"}
+            archive.writestr(f"inbox/chat/message_{i + 1}.json", json.dumps(part, indent=1))
+
+
+def fix_one_by_one(strings: list[str]) -> list[str]:
+    return [ftfy(string) for string in strings]
+
+
+def load_parts(file_path: str) -> None:
+    messages = []
+    with zipfile.ZipFile(file_path) as archive:
+        for name in archive.namelist():
+            messages += json.loads(archive.read(name))["messages"]
+    messages.sort(key=lambda msg: msg["timestamp_ms"], reverse=True)
+
+
+def merge_parts(file_path: str) -> None:
+    with open_chat_export(file_path) as (header, messages):
+        read_facebook_columns(messages)
+
+
+def main(messages_count: int = 500_000) -> None:
+    strings = make_strings(messages_count)
+    print(f"Facebook strings: {messages_count}")
+    for name, func in (("ftfy", fix_one_by_one), ("repair_mojibake", repair_mojibake)):
+        elapsed, peak = measure(func, strings)
+        print(f"{name:>16}: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "messages.zip")
+        make_parts_archive(file_path, messages_count)
+        print(f"Facebook export parts archive: {os.path.getsize(file_path) / 1e6:.1f} MB")
+        for name, func in (("load and sort", load_parts), ("streaming merge", merge_parts)):
+            elapsed, peak = measure(func, file_path)
+            print(f"{name:>16}: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
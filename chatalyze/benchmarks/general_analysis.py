@@ -0,0 +1,308 @@
+"""Compares the single pass general analysis with the pandas operations per metric it replaced"""
+import os
+import statistics
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import measure, setup_django, make_telegram_export
+
+
+def make_general_analysis_pandas(msg_list: dict[str, list], chat_platform: str) -> dict:
+    """Returns dict of analyses values computing each of them with separate pandas operations
+    Args:
+        msg_list: dict of message columns
+        chat_platform: The chat platform name
+    """
+    from apps.dashboard.const import TELEGRAM, WHATSAPP, FACEBOOK
+
+    if chat_platform == TELEGRAM:
+        df = df_from_tg(msg_list)
+    elif chat_platform == WHATSAPP:
+        df = df_from_wa(msg_list)
+    elif chat_platform == FACEBOOK:
+        df = df_from_fb(msg_list)
+    else:
+        raise ValueError("Unsupported chat platform")
+    df = generate_more_data(df)
+    df_unique_seq = df.drop_duplicates(subset=["seq"]).reset_index(drop=True)
+    if chat_platform == TELEGRAM and "forwarded_from" in df:
+        df_no_forwarded = df[pd.isna(df["forwarded_from"])].drop("forwarded_from", axis=1).reset_index(drop=True)
+    elif chat_platform == WHATSAPP:
+        df_no_forwarded = df.query("`text`.str.len() < 230")
+    else:
+        df_no_forwarded = df
+
+    daily_year_msg = get_daily_msg_amount(df, 365)
+    top_day = get_top_day(df_unique_seq)
+    top_weekday = get_top_weekday(df_unique_seq)
+    hourly_messages = get_avg_for_each_hour(df)
+    msg_per_user = get_msg_count_per_user(df)
+    msg_per_day = get_user_msg_per_day(df)
+    words_per_message = get_words_per_message(df_no_forwarded)
+    media_text_share = get_media_share(df)
+    response_time = get_response_time(df)
+    response_time_hour = get_response_hours(df)
+    results = {
+        "daily_year_msg": daily_year_msg,
+        "top_day": top_day,
+        "top_weekday": top_weekday,
+        "hourly_messages": hourly_messages,
+        "msg_per_user": msg_per_user,
+        "msg_per_day": msg_per_day,
+        "words_per_message": words_per_message,
+        "media_text_share": media_text_share,
+        "response_time": response_time,
+        "response_time_hour": response_time_hour,
+    }
+    return results
+
+
+def df_from_tg(msg_columns: dict[str, list]) -> pd.DataFrame:
+    """Makes DataFrame of Telegram messages adding needed info and filtering out service messages
+    Args:
+        msg_columns: Telegram message columns
+    Returns Pandas Dataframe with messages
+    """
+    from apps.dashboard.analysis_tools.timestamps import parse_timestamps
+
+    df = pd.DataFrame(msg_columns)
+    df = df[df.type == "message"].drop("type", axis=1).reset_index(drop=True)
+    df["timestamp"] = parse_timestamps(df.date)
+    df["from"] = df["from"].fillna(df["from_id"])
+    if "media_type" not in df:
+        df.insert(-1, "media_type", np.nan)
+    return df
+
+
+def df_from_wa(msg_columns: dict[str, list]) -> pd.DataFrame:
+    """Makes DataFrame of WhatsApp messages adding needed info
+    Args:
+        msg_columns: WhatsApp message columns
+    Returns Pandas Dataframe with messages
+    """
+    from apps.dashboard.analysis_tools.timestamps import detect_datetime_format, parse_timestamps
+
+    df = pd.DataFrame(msg_columns)
+    df["timestamp"] = parse_timestamps(df["date"], detect_datetime_format(df.date))
+    df.insert(0, "id", np.array(range(0, len(df))))
+    return df
+
+
+def df_from_fb(msg_columns: dict[str, list]) -> pd.DataFrame:
+    """Makes DataFrame of Facebook messages adding needed info and filtering out service messages
+    Args:
+        msg_columns: Facebook message columns
+    Returns Pandas Dataframe with messages
+    """
+    df = pd.DataFrame(msg_columns)
+    df = df.iloc[::-1]
+    df = df[(df["type"] == "Generic")].drop("type", axis=1).reset_index(drop=True)
+    df["media_type"] = np.where(df["content"].isna(), "media", pd.NA)  # noqa
+    df["timestamp"] = pd.to_datetime(df["timestamp_ms"], unit="ms")
+    df.rename(columns={"sender_name": "from", "content": "text"}, inplace=True)
+    df.insert(0, "id", np.array(range(0, len(df))))
+    return df
+
+
+def generate_more_data(df: pd.DataFrame) -> pd.DataFrame:
+    from apps.dashboard.analysis_tools.aggregates import get_seq, get_seq_difference
+
+    df["hour"] = df["timestamp"].dt.hour
+    df["date"] = df.timestamp.dt.date
+    df["from"] = df["from"].astype("category")
+    df["word"] = df["text"].apply(lambda text: len(text.split()) if type(text) is str else 0)
+    df["weekday"] = df["timestamp"].dt.weekday
+    df["diff"] = np.insert(np.diff(df["timestamp"]), 0, 0)
+    df["seq"] = get_seq(df["from"])
+    df["seq_diff"] = get_seq_difference(df["seq"], df["diff"], "5 hours")
+
+    return df
+
+
+def get_daily_msg_amount(df: pd.DataFrame, days: int = 365) -> dict:
+    """Generates data for daily amount of messages chart
+    Args:
+        df: DataFrame to analyze
+        days: amount of days until the final message date
+    Returns a dict, where
+        values: list[int]: daily number of messages list
+        end_date: float: the last day in the unix timestamp format
+        average: float: average message amount for all days from the first to the last message in the chat
+    """
+    daily_msg = df[["timestamp", "id"]].set_index("timestamp").resample("D").count().reset_index()
+    end_date = daily_msg.iloc[-1:].timestamp.dt.to_pydatetime()[0].timestamp()
+    average_msg_amount = statistics.mean(daily_msg["id"].to_list())
+    return {
+        "values": daily_msg.iloc[-days:]["id"].to_list(),
+        "end_date": end_date,
+        "average": average_msg_amount,
+    }
+
+
+def get_top_day(df: pd.DataFrame) -> str:
+    """Returns date of the highest amount of messages in the format of dd.mm.yyyy"""
+    amount_by_date = df[["id", "date", "seq"]].groupby("date").count()
+    sorted_dates = amount_by_date.sort_values("id", ascending=False).reset_index()
+    return sorted_dates.date[0].strftime("%d.%m.%Y")
+
+
+def get_top_weekday(df: pd.DataFrame) -> int:
+    """Returns name of the weekday with the highest average amount of messages"""
+    weekdays = df[["id", "weekday", "seq"]].groupby("weekday").count()
+    sorted_weekdays = weekdays.sort_values("id", ascending=False).reset_index()
+    return int(sorted_weekdays.weekday[0])
+
+
+def get_days_duration(df: pd.DataFrame) -> int:
+    """Returns duration of the chat in days"""
+    date_start = df[["timestamp"]].iloc[0]
+    date_end = df[["timestamp"]].iloc[-1]
+    days = int((date_end - date_start).dt.days) + 1
+    return days
+
+
+def get_avg_for_each_hour(df: pd.DataFrame) -> list[float]:
+    """Returns list of average amount of messages for each hour from 0 to 23"""
+    days = get_days_duration(df)
+    hourly_msg_avg = df[["id", "hour", "seq"]].groupby("hour").count()["id"].to_list()
+    hourly_msg_avg = [*map(lambda x: round(x / days, 2), hourly_msg_avg)]
+    return hourly_msg_avg
+
+
+def get_msg_count_per_user(df: pd.DataFrame) -> dict:
+    """Returns dict containing amount of messages for top 4 users and sum for others"""
+    total = len(df)
+    users = df["from"].cat.categories.to_list()
+    user_msg_count = df[["id", "from"]].groupby("from").count().sort_values("id", ascending=False)
+    if len(users) > 5:
+        user_msg_count = user_msg_count[:4].to_dict()["id"]
+        user_msg_count["others"] = total - sum(user_msg_count.values())
+    else:
+        user_msg_count = user_msg_count.to_dict()["id"]
+    return user_msg_count
+
+
+def get_user_msg_per_day(df: pd.DataFrame) -> dict:
+    """Returns dict containing average amount of messages per day for top-5 users"""
+    users = df["from"].cat.categories.to_list()
+    average_msg = {}
+    for user in users:
+        user_messages = df[["timestamp", "id", "from"]][df["from"] == user]
+        msg_per_day = user_messages.set_index("timestamp").resample("D").count()["id"].tolist()
+        msg_per_day.sort()
+        five_perc = int(len(msg_per_day) * 0.05)
+        msg_per_day_cut = msg_per_day[five_perc:-five_perc]
+        msg_per_day = msg_per_day_cut if msg_per_day_cut else msg_per_day
+        average_msg[user] = round(statistics.mean(msg_per_day), 1)
+    average_msg = dict(sorted(average_msg.items(), key=lambda item: item[1], reverse=True))
+    if len(average_msg) > 5:
+        average_msg = {k: average_msg[k] for k in list(average_msg)[:5]}
+    return average_msg
+
+
+def get_words_per_message(df: pd.DataFrame) -> dict:
+    """Returns dict containing average amount of words per message for top-5 users"""
+    df_without_media = df[df["media_type"].isna()].reset_index()
+    user_word_count = df_without_media[["from", "word"]].groupby("from").sum("word")
+    user_word_count = user_word_count.to_dict()["word"]
+
+    total = df_without_media[["from", "word"]].groupby("from").count().to_dict()["word"]
+
+    for user in list(user_word_count):
+        if total[user] == 0:
+            user_word_count[user] = 0
+            continue
+        user_word_count[user] = round(user_word_count[user] / total[user], 2)
+    sorted_user_word_count = dict(sorted(user_word_count.items(), key=lambda item: item[1], reverse=True))
+    if len(sorted_user_word_count) > 5:
+        sorted_user_word_count = {k: sorted_user_word_count[k] for k in list(sorted_user_word_count)[:5]}
+
+    return sorted_user_word_count
+
+
+def get_media_share(df: pd.DataFrame) -> dict:
+    """Returns dict containing the share of text messages and the share of other messages in percents"""
+    text_perc = round(100 * df.media_type.isna().sum() / len(df), 2)
+    media_perc = round(100 - text_perc, 2)
+    return {"text": text_perc, "media": media_perc}
+
+
+def get_response_time(df: pd.DataFrame) -> dict:
+    """Returns dict containing average time (in seconds) between messages from different users for top-5 users"""
+    answer_time = df[["from", "seq_diff"]].groupby("from").seq_diff.apply(np.mean)
+    return answer_time.sort_values()[:5].to_dict()
+
+
+def get_response_hours(df: pd.DataFrame) -> dict[str:int]:
+    """Returns dict containing start and end hours for the fastest response time."""
+    answer_time = df[["hour", "seq_diff"]].groupby("hour").seq_diff.apply(np.mean)
+    answer_time = answer_time.sort_values()
+    hour_list = answer_time.index
+
+    hot_hours = []
+    for hour in hour_list:
+        if not hot_hours:
+            hot_hours.append(hour)
+            continue
+        for prev_hour in hot_hours:
+            if prev_hour == 23:
+                if hour in (22, 0):
+                    hot_hours.append(hour)
+                    break
+            elif prev_hour == 0:
+                if hour in (23, 1):
+                    hot_hours.append(hour)
+                    break
+            else:
+                if hour in (prev_hour - 1, prev_hour + 1):
+                    hot_hours.append(hour)
+                    break
+        else:
+            break
+    hot_hours = hot_hours[:5]
+
+    hot_hours = sorted(hot_hours)
+
+    if 0 in hot_hours and 23 in hot_hours:
+        lower = filter(lambda h: h >= 12, hot_hours)
+        higher = filter(lambda h: h < 12, hot_hours)
+        hot_hours = [*lower, *higher]
+
+    return {"start": hot_hours[0], "end": hot_hours[-1] + 1}
+
+
+def main(messages_count: int = 1_000_000, users_count: int = 12) -> None:
+    setup_django()
+    from apps.dashboard.analysis_tools.general_analysis import make_general_analysis
+    from apps.dashboard.analysis_tools.ingestion import open_json_export, read_telegram_columns
+    from apps.dashboard.analysis_tools.message_table import make_message_table
+    from apps.dashboard.const import TELEGRAM
+    from apps.dashboard.utils import ProgressBar
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "result.json")
+        make_telegram_export(file_path, messages_count, users_count=users_count)
+        with open_json_export(file_path) as (_, messages):
+            msg_columns = read_telegram_columns(messages)
+    print(f"Telegram chat: {messages_count} messages, {users_count} users")
+    df_size = df_from_tg(msg_columns).memory_usage(deep=True).sum() / 2**20
+    table_size = make_message_table(msg_columns, TELEGRAM).nbytes / 2**20
+    print(f"DataFrame {df_size:.1f} MB, message table {table_size:.1f} MB")
+
+    def make_general_analysis_of_columns(msg_columns, chat_platform, progress):
+        return make_general_analysis(make_message_table(msg_columns, chat_platform), chat_platform, progress)
+
+    progress = ProgressBar("benchmark")
+    for name, func, args in (
+        ("pandas per metric", make_general_analysis_pandas, (msg_columns, TELEGRAM)),
+        ("single pass", make_general_analysis_of_columns, (msg_columns, TELEGRAM, progress)),
+    ):
+        elapsed, peak = measure(func, *args)
+        print(f"{name:>18}: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,39 @@
+"""Compares parsing a Telegram export twice with json.load (platform detection + analysis)
+with the single streaming ingestion pass"""
+import json
+import os
+import sys
+import tempfile
+
+from apps.dashboard.analysis_tools.ingestion import open_json_export, detect_json_platform, read_telegram_columns
+from benchmarks import measure, make_telegram_export
+
+
+def parse_twice(file_path: str) -> None:
+    with open(file_path, "r", encoding="UTF8") as f:
+        chat_history = json.load(f)
+    chat_history.get("participants")
+    with open(file_path, "r", encoding="UTF8") as f:
+        chat_history = json.load(f)
+    len(chat_history["messages"])
+
+
+def parse_once(file_path: str) -> None:
+    with open_json_export(file_path) as (header, messages):
+        detect_json_platform(header)
+        read_telegram_columns(messages)
+
+
+def main(messages_count: int = 500_000) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "result.json")
+        make_telegram_export(file_path, messages_count)
+        size = os.path.getsize(file_path) / 1e6
+        print(f"Telegram export: {messages_count} messages, {size:.1f} MB")
+        for name, func in (("parse twice", parse_twice), ("parse once", parse_once)):
+            elapsed, peak = measure(func, file_path)
+            print(f"{name:>12}: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
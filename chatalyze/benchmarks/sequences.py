@@ -0,0 +1,79 @@
+"""Compares the vectorized message sequence functions with the loops they replaced"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import measure, setup_django
+
+LOOP_MAX_ROWS = 1_000_000  # the loops take minutes on bigger chats
+
+
+def get_seq_loop(series: pd.Series) -> np.ndarray:
+    """Returns count of consequential items that are different from previous"""
+    seq = np.zeros(len(series)).astype(int)
+    _count = 1
+    sender = series[0]
+    seq[0] = _count
+
+    for i in range(1, len(series)):
+        if series[i] != sender:
+            _count += 1
+            sender = series[i]
+        seq[i] = _count
+    return seq
+
+
+def get_seq_difference_loop(seq: pd.Series, diff: pd.Series, delta_max: str = "1 day") -> pd.Series:
+    """Returns time between different sequences or
+    NA if they are the same or time between them is more than delta_max"""
+    prev_seq = None
+    seq_diff = []
+    for row in zip(seq, diff):
+        if prev_seq is None:
+            prev_seq = row[0]
+        if row[0] == prev_seq:
+            seq_diff.append(pd.NA)
+        else:
+            prev_seq = row[0]
+            if row[1] < pd.Timedelta(delta_max):
+                seq_diff.append(row[1].seconds)
+            else:
+                seq_diff.append(pd.NA)
+    return pd.Series(seq_diff)
+
+
+def make_messages(messages_count: int, users_count: int = 20, seed: int = 0) -> pd.DataFrame:
+    """Returns senders and time since the previous message of a chat where users answer each other in bursts"""
+    rnd = np.random.default_rng(seed)
+    senders = rnd.integers(0, users_count, messages_count)
+    # every user writes two messages in a row on average
+    senders = np.where(rnd.random(messages_count) < 0.5, np.roll(senders, 1), senders)
+    diff = rnd.exponential(30 * 60, messages_count).astype("timedelta64[s]")
+    return pd.DataFrame({"from": pd.Categorical(senders.astype(str)), "diff": diff})
+
+
+def main(*sizes: int) -> None:
+    setup_django()
+    from apps.dashboard.analysis_tools.aggregates import get_seq, get_seq_difference
+
+    for messages_count in sizes or (10_000, 1_000_000, 10_000_000):
+        df = make_messages(messages_count)
+        seq = get_seq(df["from"])
+        print(f"Messages: {messages_count}")
+        functions = [
+            ("get_seq", get_seq, (df["from"],)),
+            ("get_seq_difference", get_seq_difference, (seq, df["diff"], "5 hours")),
+        ]
+        if messages_count <= LOOP_MAX_ROWS:
+            functions += [
+                ("get_seq loop", get_seq_loop, (df["from"],)),
+                ("get_seq_difference loop", get_seq_difference_loop, (pd.Series(seq), df["diff"], "5 hours")),
+            ]
+        for name, func, args in functions:
+            elapsed, peak = measure(func, *args)
+            print(f"{name:>24}: {elapsed:7.3f} s, peak {peak:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
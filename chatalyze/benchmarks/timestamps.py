@@ -0,0 +1,37 @@
+"""Compares pd.to_datetime with parse_timestamps on WhatsApp and Telegram dates of a busy chat"""
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import measure, setup_django
+
+
+def make_dates(messages_count: int, dt_format: str, seed: int = 0) -> pd.Series:
+    """Returns dates of messages sent every few seconds"""
+    rnd = np.random.default_rng(seed)
+    seconds = np.cumsum(rnd.integers(0, 20, messages_count))
+    start = datetime(2019, 1, 1)
+    return pd.Series([(start + timedelta(seconds=int(s))).strftime(dt_format) for s in seconds])
+
+
+def main(messages_count: int = 1_000_000) -> None:
+    setup_django()
+    from apps.dashboard.analysis_tools.timestamps import detect_datetime_format, parse_timestamps
+
+    # Telegram dates are ISO formatted and parsed without an explicit format
+    for name, dt_format in (("WhatsApp", "%d.%m.%y, %H:%M"), ("Telegram", None)):
+        dates = make_dates(messages_count, dt_format or "%Y-%m-%dT%H:%M:%S")
+        print(f"{name} dates: {messages_count}, distinct {dates.nunique()}")
+        if dt_format:
+            elapsed, peak = measure(detect_datetime_format, dates)
+            print(f"{'detect format':>18}: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+        elapsed, peak = measure(pd.to_datetime, dates, format=dt_format)
+        print(f"{'pd.to_datetime':>18}: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+        elapsed, peak = measure(parse_timestamps, dates, dt_format)
+        print(f"{'parse_timestamps':>18}: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""Compares parsing of a WhatsApp export into message columns with the per-line loop it replaced"""
+import os
+import re
+import sys
+import tempfile
+
+from benchmarks import measure, make_whatsapp_export, setup_django, time_call
+
+
+def get_msg_dict_wa_loop(text: str) -> list[dict]:
+    """Parses WhatsApp export file
+    Args:
+        text: WhatsApp export file text
+    Returns list of messages
+    """
+    from apps.dashboard.analysis_tools.stopwords import whatsapp_stoplist_except_media
+
+    link_regex = re.compile(
+        r"""(?i)\b(?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,6}/)(?:[^\s()<>]+|\((?:[^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’])"""
+    )
+
+    msg_pattern = re.compile(
+        r"\[?(?P<datetime>\d{1,2}[\/|\.]\d{1,2}[\/|\.]\d{2,4},?\s\d{2}[:|\.]\d{2}(?:[:|\.]\d{2})?(?:\s?[APap][Mm])?)\]?\s-?\s?(?P<sender>\S+|[^:]*):\s(?P<text>.*)"
+    )
+
+    msg_list = []
+
+    for line_text in text.splitlines():
+        for phrase in whatsapp_stoplist_except_media:
+            if phrase in line_text:
+                break
+        else:
+            message = msg_pattern.search(line_text)
+            if message:
+                msg = {
+                    "from": message.group("sender") or "You",
+                    "date": message.group("datetime"),
+                    "text": message.group("text"),
+                    "media_type": None,
+                }
+                if link_regex.search(line_text):
+                    msg["media_type"] = "url"
+                    msg["text"] = ""
+                elif "Без медиафайлов" in msg["text"] or "Media omitted" in msg["text"]:
+                    msg["media_type"] = "media"
+                    msg["text"] = ""
+                msg_list.append(msg)
+            else:
+                if msg_list:
+                    msg_list[-1]["text"] += "\n" + line_text
+    if len(msg_list) < 3:
+        raise ValueError("msg_list is too short")
+    return msg_list
+
+
+def main(messages_count: int = 1_000_000) -> None:
+    setup_django()
+    from apps.dashboard.analysis_tools.general_analysis import parse_whatsapp
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "chat.txt")
+        make_whatsapp_export(file_path, messages_count)
+        with open(file_path, "r", encoding="UTF8") as f:
+            text = f.read()
+    lines_count = text.count("\n") + 1
+    print(f"WhatsApp export: {lines_count} lines, {len(text) / 1e6:.1f}M characters")
+    elapsed_loop = time_call(get_msg_dict_wa_loop, text)
+    _, peak = measure(get_msg_dict_wa_loop, text)
+    print(f"get_msg_dict_wa loop: {elapsed_loop:6.2f} s, peak {peak:7.1f} MB")
+    elapsed = time_call(parse_whatsapp, text)
+    _, peak = measure(parse_whatsapp, text)
+    print(f"      parse_whatsapp: {elapsed:6.2f} s, peak {peak:7.1f} MB")
+    print(f"             speedup: {elapsed_loop / elapsed:6.1f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
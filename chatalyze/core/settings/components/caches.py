@@ -14,6 +14,11 @@ CACHES = {
     },
 }
 
+# Normal forms of the words analyzed by pymorphy2 are kept in the memory of every worker process
+# and in the default cache
+LEMMA_CACHE_SIZE = config("LEMMA_CACHE_SIZE", cast=int, default=200000)
+LEMMA_CACHE_TIMEOUT = config("LEMMA_CACHE_TIMEOUT", cast=int, default=30 * 24 * 60 * 60)
+
 
 # django-axes
 # https://django-axes.readthedocs.io/en/latest/4_configuration.html#configuring-caches
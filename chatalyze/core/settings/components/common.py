@@ -210,3 +210,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 CELERY_BROKER_URL = config("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = "django-db"
 CELERY_CACHE_BACKEND = "default"
+
+# Chat files of this size in bytes and bigger are analyzed in chunks of messages by parallel tasks
+CHUNKED_ANALYSIS_FILE_SIZE = config("CHUNKED_ANALYSIS_FILE_SIZE", cast=int, default=50 * 1024 * 1024)
+ANALYSIS_CHUNK_MESSAGES = config("ANALYSIS_CHUNK_MESSAGES", cast=int, default=200000)
@@ -0,0 +1,13 @@
+import pytest
+
+from core import settings as project_settings
+
+
+@pytest.fixture(autouse=True)
+def temporary_storages(settings, tmp_path, monkeypatch):
+    """Keeps the chats, the analysis states and the word clouds saved by the tests out of the project directory"""
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    # the location of the private storage is read once, so its cached values are replaced
+    location = tmp_path / "usersfiles"
+    monkeypatch.setitem(project_settings.private_storage.__dict__, "base_location", str(location))
+    monkeypatch.setitem(project_settings.private_storage.__dict__, "location", str(location.resolve()))
@@ -0,0 +1,235 @@
+import io
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from apps.dashboard.analysis_tools.aggregates import (
+    get_seq,
+    get_seq_difference,
+    count_messages,
+    drop_users,
+    merge_counters,
+    select_days,
+    sum_cells,
+)
+from apps.dashboard.analysis_tools.analysis_state import dump_analysis_state, load_analysis_state
+from apps.dashboard.analysis_tools.message_table import MessageTable, make_message_table
+from apps.dashboard.analysis_tools.term_index import get_sender_frequencies, make_term_index
+from apps.dashboard.analysis_tools.general_analysis import (
+    make_general_analysis,
+    get_user_msg_per_day,
+    count_chat_messages,
+    get_general_results,
+)
+from apps.dashboard.const import TELEGRAM, WHATSAPP, FACEBOOK
+from apps.dashboard.utils import ProgressBar
+from benchmarks.general_analysis import (
+    make_general_analysis_pandas,
+    get_user_msg_per_day as get_user_msg_per_day_resample,
+)
+from benchmarks.sequences import get_seq_loop, get_seq_difference_loop, make_messages
+
+progress = ProgressBar("test")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_get_seq_equals_loop(seed):
+    df = make_messages(500, users_count=4, seed=seed)
+    senders = df["from"].cat.add_categories("x")
+    senders[senders == "1"] = np.nan  # consecutive missing senders are different senders
+    senders[0] = "x"
+    assert np.array_equal(get_seq(senders), get_seq_loop(senders))
+    assert np.array_equal(get_seq(senders.astype(object)), get_seq_loop(senders))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_get_seq_difference_equals_loop(seed):
+    df = make_messages(500, users_count=3, seed=seed)
+    # messages of merged or unordered exports can go back in time
+    df.loc[::7, "diff"] = -df["diff"][::7]
+    seq = get_seq(df["from"])
+    expected = get_seq_difference_loop(pd.Series(seq), df["diff"], "5 hours").astype("Float64")
+    seq_diff = get_seq_difference(seq, df["diff"], "5 hours")
+    assert np.array_equal(seq_diff, expected.to_numpy(dtype=float, na_value=np.nan), equal_nan=True)
+
+
+def test_count_messages():
+    table = MessageTable(
+        pd.to_datetime(["2022-01-01 10:00", "2022-01-01 10:30", "2022-01-03 23:59", "2022-01-03 23:59"]),
+        ["Bob", "Alice", "Bob", None],
+        ["one two", "three", None, "four five six"],
+        media_types=[None, None, "photo", None],
+    )
+    counters = count_messages(table, np.array([True, False, True, True]))
+    assert counters["users"].tolist() == ["Alice", "Bob"]
+    assert counters["total"] == 4
+    assert sum_cells(counters, "day", "messages").tolist() == [2, 0, 2]
+    assert sum_cells(counters, "user", "messages").tolist() == [1, 2, 1]
+    assert sum_cells(counters, "user", "words").tolist() == [0, 2, 3]
+    assert sum_cells(counters, "user", "texts").tolist() == [0, 1, 1]
+    assert sum_cells(counters, "hour", "media", 24)[23] == 1
+    assert sum_cells(counters, "user", "response_seconds").tolist() == [30 * 60, 0, 0]
+
+
+def _random_chat(chat_platform, messages_count, seed):
+    """Returns message columns of a random chat with few users, so many metrics have equal values"""
+    rnd = np.random.default_rng(seed)
+    users = ["Alice", "Bob", "Carol", "Dave", "Eve", "Frank", "Grace"][: rnd.integers(2, 8)]
+    senders = rnd.choice(users, messages_count).tolist()
+    seconds = np.cumsum(rnd.exponential(3 * 60 * 60, messages_count)).astype(int)
+    start = datetime(2021, 12, 25, 20)
+    dates = [start + timedelta(seconds=int(s)) for s in seconds]
+    texts = [" ".join(["word"] * int(n)) if n < 40 else None for n in rnd.integers(0, 45, messages_count)]
+    is_media = rnd.random(messages_count) < 0.2
+    if chat_platform == TELEGRAM:
+        return {
+            "id": list(range(messages_count)),
+            "type": ["message" if r < 0.95 else "service" for r in rnd.random(messages_count)],
+            "date": [date.isoformat() for date in dates],
+            "from": senders,
+            "from_id": ["user" + sender for sender in senders],
+            "text": texts,
+            "media_type": ["photo" if media else None for media in is_media],
+            "forwarded_from": ["News" if r < 0.1 else None for r in rnd.random(messages_count)],
+        }
+    if chat_platform == WHATSAPP:
+        return {
+            "from": senders,
+            "date": [date.strftime("%d.%m.%Y, %H:%M") for date in dates],
+            "text": [text or "x" * 300 for text in texts],
+            "media_type": ["media" if media else None for media in is_media],
+        }
+    return {
+        "timestamp_ms": [int(date.timestamp() * 1000) for date in reversed(dates)],
+        "sender_name": list(reversed(senders)),
+        "type": ["Generic" if r < 0.95 else "Share" for r in rnd.random(messages_count)],
+        "content": list(reversed(texts)),
+    }
+
+
+def _clean(results):
+    return json.loads(json.dumps(results).replace("NaN", "null"))
+
+
+@pytest.mark.parametrize("chat_platform", [TELEGRAM, WHATSAPP, FACEBOOK])
+@pytest.mark.parametrize("seed", range(4))
+def test_make_general_analysis_equals_pandas(chat_platform, seed):
+    msg_columns = _random_chat(chat_platform, 300, seed)
+    expected = make_general_analysis_pandas(msg_columns, chat_platform)
+    table = make_message_table(msg_columns, chat_platform)
+    assert _clean(make_general_analysis(table, chat_platform, progress)) == _clean(expected)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_get_user_msg_per_day_equals_resample(seed):
+    # many members writing on a few scattered days, so most users have long runs of empty days
+    rnd = np.random.default_rng(seed)
+    messages_count = 3000
+    df = pd.DataFrame(
+        {
+            "id": np.arange(messages_count),
+            "timestamp": pd.Timestamp("2021-01-01") + pd.to_timedelta(rnd.integers(0, 400 * 24, messages_count), "h"),
+            "from": pd.Categorical(rnd.zipf(1.5, messages_count).astype(str)),
+            "text": None,
+            "media_type": None,
+        }
+    )
+    table = MessageTable(df["timestamp"], df["from"], df["text"], media_types=df["media_type"])
+    counters = count_messages(table, np.ones(messages_count, dtype=bool))
+    assert get_user_msg_per_day(counters) == get_user_msg_per_day_resample(df)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_merge_counters_equals_full_chat(seed):
+    msg_columns = _random_chat(TELEGRAM, 300, seed)
+    splits = sorted(np.random.default_rng(seed).choice(np.arange(1, 300), 2, replace=False).tolist())
+    counters = None
+    for start, end in zip([0, *splits], [*splits, 300]):
+        part = make_message_table({name: column[start:end] for name, column in msg_columns.items()}, TELEGRAM)
+        part_counters = count_chat_messages(part, TELEGRAM, counters)
+        counters = part_counters if counters is None else merge_counters(counters, part_counters)
+    expected = make_general_analysis(make_message_table(msg_columns, TELEGRAM), TELEGRAM, progress)
+    assert _clean(get_general_results(counters, progress)) == _clean(expected)
+
+
+def test_analysis_state_round_trip():
+    table = make_message_table(_random_chat(TELEGRAM, 100, 0), TELEGRAM)
+    counters = count_chat_messages(table, TELEGRAM)
+    word_frequencies = {"word": 10, "слово": 3}
+    term_index = make_term_index(
+        [19000, 19000, 19001], ["Alice", None, "Bob"], [{"word": 8, "слово": 3}, {}, {"word": 2}]
+    )
+    state = dump_analysis_state(counters, word_frequencies, term_index, {"last_message_id": 99})
+    loaded_counters, loaded_frequencies, loaded_term_index, settings = load_analysis_state(io.BytesIO(state))
+    assert settings["last_message_id"] == 99
+    assert loaded_frequencies == word_frequencies
+    for name in ("words", "senders", "day", "sender", "word", "count"):
+        assert loaded_term_index[name].tolist() == term_index[name].tolist()
+    assert get_sender_frequencies(loaded_term_index) == {"Alice": {"word": 8, "слово": 3}, "Bob": {"word": 2}}
+    assert _clean(get_general_results(loaded_counters, progress)) == _clean(get_general_results(counters, progress))
+
+
+@pytest.mark.parametrize("chat_platform", [TELEGRAM, WHATSAPP, FACEBOOK])
+@pytest.mark.parametrize("seed", range(4))
+def test_drop_users_equals_filtered_chat(chat_platform, seed):
+    table = make_message_table(_random_chat(chat_platform, 300, seed), chat_platform)
+    stop_users = table.senders[: len(table.senders) // 2] + ["Nobody"]
+    rows = np.flatnonzero(~np.isin(table.sender_codes, np.arange(len(table.senders) // 2)))
+    texts = table.get_texts(rows)
+    filtered = MessageTable(
+        table.timestamps[rows],
+        table.get_senders()[rows],
+        texts,
+        media_types=np.asarray([*table.media_types, None], dtype=object)[table.media_codes[rows]],
+        forwarded=table.forwarded[rows],
+    )
+    counters = drop_users(count_chat_messages(table, chat_platform), stop_users)
+    expected = count_chat_messages(filtered, chat_platform)
+    for name in ("first_day", "first_timestamp", "last_timestamp", "total"):
+        assert counters[name] == expected[name]
+    assert counters["users"].tolist() == expected["users"].tolist()
+    for by in ("user", "day", "hour"):
+        for field in ("messages", "texts", "words", "media"):
+            assert sum_cells(counters, by, field).tolist() == sum_cells(expected, by, field).tolist()
+    # reply sequences stay the ones of the whole chat
+    results = get_general_results(counters, progress)
+    expected_results = get_general_results(expected, progress)
+    for name in ("daily_year_msg", "hourly_messages", "msg_per_user", "msg_per_day", "words_per_message"):
+        assert _clean(results[name]) == _clean(expected_results[name])
+
+
+@pytest.mark.parametrize("chat_platform", [TELEGRAM, WHATSAPP, FACEBOOK])
+@pytest.mark.parametrize("seed", range(2))
+def test_select_days_equals_chat_period(chat_platform, seed):
+    table = make_message_table(_random_chat(chat_platform, 300, seed), chat_platform)
+    counters = count_chat_messages(table, chat_platform)
+    assert _clean(get_general_results(select_days(counters, None, None))) == _clean(get_general_results(counters))
+
+    days = table.get_datetimes().astype("datetime64[D]")
+    first_date, last_date = days[100], days[200]
+    rows = np.flatnonzero((days >= first_date) & (days <= last_date))
+    period = MessageTable(
+        table.timestamps[rows],
+        table.get_senders()[rows],
+        table.get_texts(rows),
+        media_types=np.asarray([*table.media_types, None], dtype=object)[table.media_codes[rows]],
+        forwarded=table.forwarded[rows],
+    )
+    counters = select_days(counters, first_date.item(), last_date)
+    expected = count_chat_messages(period, chat_platform)
+    for name in ("first_day", "total"):
+        assert counters[name] == expected[name]
+    assert counters["users"].tolist() == expected["users"].tolist()
+    assert first_date <= counters["first_timestamp"] <= expected["first_timestamp"]
+    for by in ("user", "day", "hour"):
+        for field in ("messages", "texts", "words", "media"):
+            assert sum_cells(counters, by, field).tolist() == sum_cells(expected, by, field).tolist()
+    results = get_general_results(counters)
+    expected_results = get_general_results(expected)
+    for name in ("daily_year_msg", "msg_per_user", "msg_per_day", "words_per_message", "media_text_share"):
+        assert _clean(results[name]) == _clean(expected_results[name])
+    with pytest.raises(ValueError):
+        select_days(counters, last_date + 1, None)
@@ -1,10 +1,26 @@
 import json
 import os
+from collections import Counter
+
+import numpy as np
 from PIL import Image
 import pytest
+from wordcloud import WordCloud
 
-from apps.dashboard.analysis_tools.general_analysis import get_msg_dict_wa, make_general_analysis
-from apps.dashboard.analysis_tools.wordcloud_tools import make_wordcloud
+from apps.dashboard.analysis_tools.general_analysis import get_msg_dict_wa, make_general_analysis, parse_whatsapp
+from apps.dashboard.analysis_tools.message_table import table_from_wa
+from apps.dashboard.analysis_tools.term_index import get_sender_frequencies, get_term_frequencies, merge_term_indexes
+from apps.dashboard.analysis_tools import wordcloud_tools
+from apps.dashboard.analysis_tools.lemma_cache import LemmaCache
+from apps.dashboard.analysis_tools.stopwords import get_language_stopwords, get_stopwords_for
+from apps.dashboard.analysis_tools.tokenizer import extract_terms, is_big_message, tokenize, tokenize_messages
+from apps.dashboard.analysis_tools.wordcloud_tools import (
+    make_wordcloud,
+    get_word_frequencies,
+    drop_sender_words,
+    get_normal_forms_ru,
+    score_collocations,
+)
 from apps.dashboard.utils import ProgressBar, load_chat_statistics
 from apps.dashboard.const import WHATSAPP
 from apps.dashboard.models import ChatAnalysis
@@ -29,13 +45,62 @@ def test_get_msg_dict_wa(datafiles):
     assert len(msg_list) == 16
 
 
+@WHATSAPP_DATA
+def test_parse_whatsapp(datafiles):
+    path = str(datafiles)
+    with open(path + "/WhatsApp Chat with User.txt", "r", encoding="UTF8") as f:
+        text = f.read()
+    msg_columns = parse_whatsapp(text)
+    assert list(msg_columns) == ["from", "date", "text", "media_type"]
+    assert len(msg_columns["from"]) == 16
+    assert msg_columns["from"][0] == "User:)"
+    assert msg_columns["date"][0] == "6/1/22, 00:47"
+    assert msg_columns["media_type"][1] == "media"
+    assert msg_columns["text"][1] == ""
+
+
+def test_parse_whatsapp_continuation_lines():
+    text = "\n".join(
+        [
+            "1/2/22, 10:15 - A: first",
+            "second line",
+            "This message was deleted",
+            "",
+            "1/2/22, 10:16 - B: https://example.com/x",
+            "more",
+            "1/2/22, 10:17 - B: bye",
+        ]
+    )
+    msg_columns = parse_whatsapp(text)
+    assert msg_columns["text"] == ["first\nsecond line\n", "\nmore", "bye"]
+    assert msg_columns["media_type"] == [None, "url", None]
+
+
+def test_parse_whatsapp_line_breaks():
+    lines = [
+        "1/2/22, 10:15 - A: first",
+        "1/2/22, 10:16 - B: second",
+        "more",
+        "1/2/22, 10:17 - C: third",
+        "Missed voice call",
+    ]
+    msg_columns = parse_whatsapp("\n".join(lines))
+    assert msg_columns["text"] == ["first", "second\nmore", "third"]
+    assert parse_whatsapp("\r\n".join(lines) + "\r\n") == msg_columns
+
+
+def test_parse_whatsapp_too_short():
+    with pytest.raises(ValueError):
+        parse_whatsapp("1/2/22, 10:15 - A: hi\n1/2/22, 10:16 - B: hey")
+
+
 @WHATSAPP_DATA
 def test_make_general_analysis(datafiles):
     path = str(datafiles)
     with open(path + "/WhatsApp Chat with User.txt", "r", encoding="UTF8") as f:
         text = f.read()
-    msg_list = get_msg_dict_wa(text)
-    results = make_general_analysis(msg_list, WHATSAPP, progress)
+    msg_columns = parse_whatsapp(text)
+    results = make_general_analysis(table_from_wa(msg_columns), WHATSAPP, progress)
     assert results["daily_year_msg"]["end_date"] == 1654981200.0
     assert results["top_day"] == "05.06.2022"
     assert results["top_weekday"] == 6
@@ -53,8 +118,8 @@ def test_get_chat_statistics(datafiles):
     path = str(datafiles)
     with open(path + "/WhatsApp Chat with User.txt", "r", encoding="UTF8") as f:
         text = f.read()
-    msg_list = get_msg_dict_wa(text)
-    results = make_general_analysis(msg_list, WHATSAPP, progress)
+    msg_columns = parse_whatsapp(text)
+    results = make_general_analysis(table_from_wa(msg_columns), WHATSAPP, progress)
     results_json = json.dumps(results)
     chat_statistics = load_chat_statistics(results_json)
     assert type(chat_statistics) is dict
@@ -65,6 +130,128 @@ def test_make_wordcloud(datafiles):
     path = str(datafiles)
     with open(path + "/WhatsApp Chat with User.txt", "r", encoding="UTF8") as f:
         text = f.read()
-    msg_list = get_msg_dict_wa(text)
-    result = make_wordcloud(msg_list, WHATSAPP, ChatAnalysis.AnalysisLanguage.ENGLISH, progress)
+    msg_columns = parse_whatsapp(text)
+    result = make_wordcloud(table_from_wa(msg_columns), WHATSAPP, ChatAnalysis.AnalysisLanguage.ENGLISH, progress)
     assert type(result) is Image.Image
+
+
+@WHATSAPP_DATA
+def test_drop_sender_words(datafiles):
+    with open(str(datafiles) + "/WhatsApp Chat with User.txt", "r", encoding="UTF8") as f:
+        table = table_from_wa(parse_whatsapp(f.read()))
+    word_frequencies, term_index = get_word_frequencies(
+        table, WHATSAPP, ChatAnalysis.AnalysisLanguage.ENGLISH, progress
+    )
+    assert word_frequencies and not get_stopwords_for("english").intersection(word_frequencies)
+    sender_frequencies = get_sender_frequencies(term_index)
+    assert set(sender_frequencies) <= set(table.senders)
+    assert drop_sender_words(word_frequencies, sender_frequencies, []) == word_frequencies
+    sender, frequencies = next(iter(sender_frequencies.items()))
+    dropped = drop_sender_words(word_frequencies, sender_frequencies, [sender])
+    assert all(
+        dropped.get(word, 0) == max(count - frequencies.get(word, 0), 0) for word, count in word_frequencies.items()
+    )
+
+
+@WHATSAPP_DATA
+def test_term_index(datafiles):
+    with open(str(datafiles) + "/WhatsApp Chat with User.txt", "r", encoding="UTF8") as f:
+        table = table_from_wa(parse_whatsapp(f.read()))
+    language = ChatAnalysis.AnalysisLanguage.ENGLISH
+    _, term_index = get_word_frequencies(table, WHATSAPP, language, progress)
+    assert get_term_frequencies(term_index)
+    # the index of the chat parts split between the days is the sum of the part indexes
+    days = table.get_datetimes().astype("datetime64[D]")
+    split = int(np.searchsorted(days, days[len(days) // 2]))
+    parts = [table.get_slice(0, split), table.get_slice(split, len(table))]
+    merged = merge_term_indexes(*(get_word_frequencies(part, WHATSAPP, language, progress)[1] for part in parts))
+    for name in ("words", "senders", "day", "sender", "word", "count"):
+        assert merged[name].tolist() == term_index[name].tolist()
+
+    first_date = days[split]
+    period = get_word_frequencies(parts[1], WHATSAPP, language, progress)[1]
+    assert get_term_frequencies(term_index, first_date) == get_term_frequencies(period)
+    assert get_term_frequencies(term_index, None, first_date - 1) == get_term_frequencies(
+        get_word_frequencies(parts[0], WHATSAPP, language, progress)[1]
+    )
+    sender = term_index["senders"][0]
+    assert get_term_frequencies(term_index, stop_senders=term_index["senders"][1:]) == dict(
+        Counter(get_sender_frequencies(term_index)[sender]).most_common()
+    )
+
+
+@WHATSAPP_DATA
+def test_score_collocations(datafiles):
+    with open(str(datafiles) + "/WhatsApp Chat with User.txt", "r", encoding="UTF8") as f:
+        texts = table_from_wa(parse_whatsapp(f.read())).get_texts()
+    texts += [
+        "Bob's dogs and dog's toys 42 1999s",
+        "Ice Cream ice cream ICE CREAM Dogs dog pizza hot tea cats dogs " * 3,
+    ]
+    stopwords = get_stopwords_for("english")
+    wc = WordCloud(stopwords=stopwords, collocation_threshold=3, min_word_length=3)
+    for text in texts + [" ".join(texts)]:
+        assert score_collocations(Counter(extract_terms(text, stopwords))) == wc.process_text(text)
+    # the counts of the messages are summed before the collocations are scored, the pairs of words of different
+    # messages are not counted like the pairs with a stop word
+    parts = [Counter(extract_terms(text, stopwords)) for text in texts[-2:]]
+    assert score_collocations(parts[0] + parts[1]) == wc.process_text(" and ".join(texts[-2:]))
+
+
+def test_get_language_stopwords():
+    english = get_stopwords_for("english")
+    assert isinstance(english, frozenset)
+    assert "the" in english and not any(word != word.strip() or not word for word in english)
+    # the lines of the ukrainian stop words are separated by carriage returns
+    assert "будь ласка" in get_stopwords_for("ukrainian") and "вище" in get_stopwords_for("ukrainian")
+    ukrainian_russian = get_language_stopwords(ChatAnalysis.AnalysisLanguage.UKRAINIAN_RUSSIAN)
+    assert ukrainian_russian == get_stopwords_for("ukrainian") | get_stopwords_for("russian")
+    assert get_language_stopwords("U+R") is ukrainian_russian
+    with pytest.raises(ValueError):
+        get_language_stopwords("XXX")
+
+
+def test_tokenize():
+    assert tokenize("Привет, Мир!😀 It's 2022-й год…") == ["привет", "мир", "it's", "й", "год…"]
+    assert tokenize("👍🏻 - ...") == []
+    # the words are not joined across the messages
+    assert [word for text in ("раз,", "два") for word in tokenize(text)] == ["раз", "два"]
+
+
+def test_tokenize_messages():
+    big_message = " ".join(["слово"] * 56)
+    assert not is_big_message(" ".join(["слово"] * 55))
+    assert is_big_message(big_message)
+    assert list(tokenize_messages(["Раз, два!", big_message, ""])) == [["раз", "два"], None, []]
+    assert list(tokenize_messages([big_message], max_words=None)) == [["слово"] * 56]
+
+
+def test_get_normal_forms_ru():
+    progress = ProgressBar("test")
+    progress.value = 53
+    words = ["кошки", "бежать", "кошки", "кошку", "он"]
+    assert get_normal_forms_ru(words, progress) == ["кошка", None, "кошка", "кошка", None]
+    assert progress.value == 85
+
+
+def test_lemma_cache():
+    lemma_cache = LemmaCache(2, key_prefix="test-lemma")
+    lemma_cache.set_many({"кошки": ("кошка", "NOUN"), "бежать": ("бежать", "INFN"), "он": ("он", None)})
+    assert len(lemma_cache) == 2
+    assert lemma_cache.get_many(["бежать", "он"]) == {"бежать": ("бежать", "INFN"), "он": ("он", None)}
+    # the evicted word is found in the shared cache
+    lemma_cache.clear()
+    assert lemma_cache.get_many(["кошки", "кошку"]) == {"кошки": ("кошка", "NOUN")}
+    assert lemma_cache.get_many(["кошки"]) == {"кошки": ("кошка", "NOUN")}
+    stats = lemma_cache.get_stats()
+    assert (stats["hits"], stats["shared_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 2 / 3
+
+
+def test_get_normal_forms_ru_uses_lemma_cache(monkeypatch):
+    monkeypatch.setattr(wordcloud_tools, "lemma_cache", LemmaCache(10, key_prefix="test-normal-forms"))
+    words = ["кошки", "бежать", "кошки"]
+    assert get_normal_forms_ru(words, ProgressBar("test")) == ["кошка", None, "кошка"]
+    monkeypatch.setattr(wordcloud_tools.morph, "parse", None)
+    assert get_normal_forms_ru(words, ProgressBar("test")) == ["кошка", None, "кошка"]
+    assert wordcloud_tools.lemma_cache.get_stats()["hits"] == 2
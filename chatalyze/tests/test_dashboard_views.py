@@ -1,12 +1,20 @@
+import io
 import json
+import zipfile
+
+import pandas as pd
 import pytest
 from django.core.exceptions import PermissionDenied
 from django.core.files.uploadedfile import SimpleUploadedFile
 from pytest_django.asserts import assertTemplateUsed
 
+from apps.dashboard.analysis_tools.general_analysis import count_chat_messages, get_general_results
+from apps.dashboard.analysis_tools.main import save_state
+from apps.dashboard.analysis_tools.message_table import MessageTable
+from apps.dashboard.analysis_tools.term_index import make_term_index
 from apps.dashboard.const import TELEGRAM
 from apps.dashboard.models import ChatAnalysis
-from apps.dashboard.views import analyze, analysis_update
+from apps.dashboard.views import analyze, analysis_update, set_stoplist
 
 
 def test_index(admin_client):
@@ -29,6 +37,65 @@ def test_analyze(rf, admin_user):
     request.FILES["chatfile"] = SimpleUploadedFile("file.py", b"file_content")
     response = analyze(request)
     assert response.status_code == 400
+    request.FILES.setlist(
+        "chatfile", [SimpleUploadedFile("message_1.json", b"{}"), SimpleUploadedFile("message_2.json", b"{}")]
+    )
+    response = analyze(request)
+    assert response.status_code == 302
+    analysis = ChatAnalysis.objects.latest("pk")
+    assert analysis.chat_file.name.endswith(".zip")
+    with zipfile.ZipFile(analysis.chat_file.path) as archive:
+        assert archive.namelist() == ["message_1.json", "message_2.json"]
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("WhatsApp Chat with Bob.txt", "file_content")
+        f.writestr("IMG-1.jpg", b"jpg")
+    request.FILES["chatfile"] = SimpleUploadedFile("WhatsApp Chat with Bob.zip", archive.getvalue())
+    response = analyze(request)
+    assert response.status_code == 302
+    assert ChatAnalysis.objects.latest("pk").chat_name == "Bob"
+    request.FILES["chatfile"] = SimpleUploadedFile("photos.zip", b"not an archive")
+    response = analyze(request)
+    assert response.status_code == 400
+
+
+def test_analyze_duplicate_upload(rf, admin_user, django_user_model, django_capture_on_commit_callbacks):
+    request = rf.post("/", data={"lang": ChatAnalysis.AnalysisLanguage.ENGLISH})
+    request.user = admin_user
+    request.FILES["chatfile"] = SimpleUploadedFile("WhatsApp Chat with Bob.txt", b"duplicate_content")
+    analyze(request)
+    first = ChatAnalysis.objects.latest("pk")
+    assert first.chat_hash and first.chat_file.name == f"chats/{first.chat_hash}.txt"
+    first.status = ChatAnalysis.AnalysisStatus.READY
+    first.results = json.dumps({"chat": "results"})
+    first.word_cloud_pic = SimpleUploadedFile("wc.png", b"png")
+    first.save()
+
+    request.user = django_user_model.objects.create_user(username="user", email="user@user.us", password="1234")
+    request.FILES["chatfile"] = SimpleUploadedFile("WhatsApp Chat with Bob.txt", b"duplicate_content")
+    response = analyze(request)
+    assert response.status_code == 302
+    second = ChatAnalysis.objects.latest("pk")
+    assert second.pk != first.pk and second.status == ChatAnalysis.AnalysisStatus.READY and second.task_id is None
+    assert second.results == first.results and second.chat_name == "Bob"
+    assert second.chat_file.name == first.chat_file.name and second.word_cloud_pic.name == first.word_cloud_pic.name
+
+    # another stop list needs a new analysis
+    request = rf.post("/", data={"stoplist": ["Bob"]})
+    request.user = second.author
+    set_stoplist(request, second.pk)
+    second.refresh_from_db()
+    assert second.status == ChatAnalysis.AnalysisStatus.PROCESSING and second.task_id is not None
+
+    # shared files are deleted with the last analysis using them
+    with django_capture_on_commit_callbacks(execute=True):
+        first.delete()
+    assert second.chat_file.storage.exists(second.chat_file.name)
+    assert second.word_cloud_pic.storage.exists(second.word_cloud_pic.name)
+    with django_capture_on_commit_callbacks(execute=True):
+        second.delete()
+    assert not second.chat_file.storage.exists(second.chat_file.name)
+    assert not second.word_cloud_pic.storage.exists(second.word_cloud_pic.name)
 
 
 def test_analysis_update(rf, admin_user, django_user_model):
@@ -43,6 +110,12 @@ def test_analysis_update(rf, admin_user, django_user_model):
     request.FILES["chatfile"] = SimpleUploadedFile("file.json", b"file_content")
     response = analysis_update(request, analysis.pk)
     assert response.status_code == 302
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("ChatExport/result.json", "{}")
+    request.FILES["chatfile"] = SimpleUploadedFile("export.zip", archive.getvalue())
+    response = analysis_update(request, analysis.pk)
+    assert response.status_code == 302
     user = django_user_model.objects.create_user(username="user", email="user@user.us", password="1234")
     request.user = user
     with pytest.raises(PermissionDenied):
@@ -118,3 +191,41 @@ def test_share_analysis(admin_client, admin_user):
     new_link = json.loads(new_response.getvalue().decode())["link"]
     assert response.status_code == 200
     assert link != new_link
+
+
+def test_query_results(admin_client, admin_user):
+    analysis = ChatAnalysis.objects.create(author=admin_user, chat_platform=TELEGRAM)
+    response = admin_client.get(f"/result/{analysis.pk}/query")
+    assert response.status_code == 404
+    table = MessageTable(
+        pd.to_datetime(
+            ["2022-01-01 10:00", "2022-01-01 11:00", "2022-01-02 10:00", "2022-01-03 12:00", "2022-01-04 09:00"]
+        ),
+        ["Alice", "Bob", "Alice", "Bob", "Bob"],
+        ["hi", "hello there", "bye", "ok", "see you"],
+    )
+    counters = count_chat_messages(table, TELEGRAM)
+    term_index = make_term_index([18993, 18994], ["Alice", "Bob"], [{"hello": 2}, {"bye": 1}])
+    state = {"counters": counters, "word_frequencies": {"hello": 2, "bye": 1}, "term_index": term_index}
+    save_state(analysis, {**state, "last_message_id": 5, "messages_count": 5})
+    analysis.save()
+    response = admin_client.get(f"/result/{analysis.pk}/query")
+    assert response.json() == json.loads(json.dumps(get_general_results(counters)))
+    response = admin_client.get(f"/result/{analysis.pk}/query?start=2022-01-02&users=Alice")
+    assert response.status_code == 200
+    assert response.json()["msg_per_user"] == {"Alice": 1}
+    # the only message of the period continues the sequence of the previous day
+    for query in ("start=2022-01-04", "start=2022-01-04&end=2022-01-04&users=Bob"):
+        response = admin_client.get(f"/result/{analysis.pk}/query?{query}")
+        assert response.status_code == 200
+        assert response.json()["top_day"] == "04.01.2022"
+        assert response.json()["top_weekday"] == 1
+    response = admin_client.get(f"/result/{analysis.pk}/query?start=2022-01-05")
+    assert response.status_code == 400
+    response = admin_client.get(f"/result/{analysis.pk}/query?end=yesterday")
+    assert response.status_code == 400
+    response = admin_client.get(f"/result/{analysis.pk}/query-wordcloud?users=Bob")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/png"
+    response = admin_client.get(f"/result/{analysis.pk}/query-wordcloud?end=2022-01-01&users=Bob")
+    assert response.status_code == 400
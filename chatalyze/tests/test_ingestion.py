@@ -0,0 +1,157 @@
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+from apps.dashboard.analysis_tools.ingestion import (
+    open_json_export,
+    open_chat_export,
+    find_chat_files,
+    read_chat_text,
+    get_chat_file_name,
+    get_chat_file_size,
+    detect_json_platform,
+    read_telegram_columns,
+    read_facebook_columns,
+    repair_mojibake,
+)
+from apps.dashboard.analysis_tools.json_stream import iter_json_export
+from apps.dashboard.const import TELEGRAM, FACEBOOK
+
+_dir = os.path.dirname(os.path.realpath(__file__))
+TEST_FILES = _dir + "/test_files"
+TELEGRAM_DATA = pytest.mark.datafiles(TEST_FILES + "/result.json")
+WHATSAPP_DATA = pytest.mark.datafiles(TEST_FILES + "/WhatsApp Chat with User.txt")
+
+
+@TELEGRAM_DATA
+def test_open_json_export(datafiles):
+    with open_json_export(str(datafiles) + "/result.json") as (header, messages):
+        assert header["id"] == 1234567
+        assert detect_json_platform(header) == TELEGRAM
+        msg_columns = read_telegram_columns(messages)
+    assert len(msg_columns["id"]) == 10
+    assert msg_columns["from"][6] is None and msg_columns["from_id"][6] == "user3"
+    assert msg_columns["text"][4] is None
+    assert msg_columns["forwarded_from"][5] == "News channel"
+
+
+def test_iter_json_export_small_chunks():
+    export = {"name": "Chat", "id": 10, "messages": [{"id": i, "text": "a" * i} for i in range(100)], "tail": 1.5}
+    header, messages = iter_json_export(io.StringIO(json.dumps(export, indent=1)), chunk_size=7)
+    assert header == {"name": "Chat", "id": 10}
+    assert list(messages) == export["messages"]
+    assert header["tail"] == 1.5
+
+
+@pytest.mark.parametrize("chunk_size", [3, 7, 1 << 20])
+def test_iter_json_export_trailing_commas(chunk_size):
+    text = (
+        '{"name": "a, }", "messages": [{"id": 1, "text": "b\\\\",},\n {"id": 2, "text": "c\\", ]",},\n], "tail": 1,}'
+    )
+    header, messages = iter_json_export(io.StringIO(text), chunk_size=chunk_size)
+    assert list(messages) == [{"id": 1, "text": "b\\"}, {"id": 2, "text": 'c", ]'}]
+    assert header == {"name": "a, }", "tail": 1}
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1 << 20])
+def test_iter_json_export_truncated(chunk_size):
+    export = {"name": "Chat", "messages": [{"id": i, "text": "a" * i} for i in range(10)], "tail": 1}
+    text = json.dumps(export, indent=1)
+    header, messages = iter_json_export(io.StringIO(text[: text.index('"id": 5')]), chunk_size=chunk_size)
+    assert list(messages) == export["messages"][:5]
+    assert header == {"name": "Chat"}
+    header, messages = iter_json_export(io.StringIO(text[: text.index('"tail"') + 3]), chunk_size=chunk_size)
+    assert list(messages) == export["messages"]
+    assert header == {"name": "Chat"}
+
+
+def test_open_json_export_encoding_noise(tmp_path):
+    file_path = str(tmp_path / "result.json")
+    with open(file_path, "wb") as f:
+        f.write(b'\xef\xbb\xbf{"name": "Chat", "messages": [{"id": 1, "text": "ok \xff"}]}')
+    with open_json_export(file_path) as (header, messages):
+        assert list(messages) == [{"id": 1, "text": "ok �"}]
+    assert header == {"name": "Chat"}
+
+
+def test_detect_json_platform():
+    assert detect_json_platform({"participants": [{"name": "User"}], "messages": []}) == FACEBOOK
+    assert detect_json_platform({"name": "Chat", "id": 1, "messages": []}) == TELEGRAM
+
+
+def _facebook_encode(text):
+    return text.encode("UTF8").decode("latin-1")
+
+
+def test_read_facebook_columns():
+    messages = [
+        {"sender_name": "Bob", "timestamp_ms": 2, "type": "Generic", "content": "hi", "is_unsent": False},
+        {"sender_name": "Bob", "timestamp_ms": 1, "type": "Generic", "photos": [{"uri": "photo.jpg"}]},
+    ]
+    msg_columns = read_facebook_columns(messages)
+    assert list(msg_columns["timestamp_ms"]) == [2, 1]
+    assert msg_columns["content"] == ["hi", None]
+    assert list(msg_columns) == ["timestamp_ms", "sender_name", "type", "content"]
+
+
+def test_repair_mojibake():
+    texts = ["Привет, как дела?", "café", None, "", "plain", "Привет, как дела?", "emoji 😀"]
+    assert repair_mojibake([text and _facebook_encode(text) for text in texts]) == texts
+
+
+def test_repair_mojibake_mixed_encodings():
+    # strings that are not latin-1 encoded UTF-8 are kept or fixed with ftfy
+    texts = [_facebook_encode("Привет"), "already fine ✓", "café", "The Mona Lisa doesnÃ¢â‚¬â„¢t have eyebrows."]
+    assert repair_mojibake(texts) == ["Привет", "already fine ✓", "café", "The Mona Lisa doesn't have eyebrows."]
+
+
+def _facebook_export(messages, title="Chat"):
+    return json.dumps({"participants": [{"name": "Bob"}], "messages": messages, "title": title})
+
+
+def test_open_chat_export_facebook_parts(tmp_path):
+    messages = [{"sender_name": "Bob", "timestamp_ms": ts, "type": "Generic", "content": str(ts)} for ts in range(20)]
+    messages.reverse()
+    archive_path = str(tmp_path / "messages.zip")
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        # parts overlap in time to check that they are merged, not concatenated
+        archive.writestr("inbox/chat/message_1.json", _facebook_export(messages[0::2]))
+        archive.writestr("inbox/chat/message_10.json", _facebook_export(messages[1::4]))
+        archive.writestr("inbox/chat/message_2.json", _facebook_export(messages[3::4]))
+        archive.writestr("inbox/chat/photos/1.jpg", b"jpg")
+    with open_chat_export(archive_path) as (header, messages_iterator):
+        assert detect_json_platform(header) == FACEBOOK
+        assert list(messages_iterator) == messages
+    assert header["title"] == "Chat"
+
+
+def test_find_chat_files():
+    assert find_chat_files(["a/message_2.json", "a/message_1.json", "a/1.jpg"]) == [
+        "a/message_1.json",
+        "a/message_2.json",
+    ]
+    assert find_chat_files(["ChatExport/result.json", "ChatExport/files/doc.json"]) == ["ChatExport/result.json"]
+    assert find_chat_files(["WhatsApp Chat with Bob.txt", "notes.txt", "IMG-1.jpg"]) == ["WhatsApp Chat with Bob.txt"]
+    assert find_chat_files(["_chat.txt", "__MACOSX/._chat.txt", "1.opus"]) == ["_chat.txt"]
+    with pytest.raises(ValueError):
+        find_chat_files(["a/message_1.json", "b/message_1.json"])
+    with pytest.raises(ValueError):
+        find_chat_files(["photos/1.jpg"])
+
+
+@WHATSAPP_DATA
+def test_read_chat_text_from_archive(datafiles, tmp_path):
+    chat_path = str(datafiles) + "/WhatsApp Chat with User.txt"
+    archive_path = str(tmp_path / "WhatsApp Chat with User.zip")
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.write(chat_path, "WhatsApp Chat with User.txt")
+        archive.writestr("IMG-20220601-WA0001.jpg", os.urandom(1000))
+    assert get_chat_file_name(archive_path) == "WhatsApp Chat with User.txt"
+    assert get_chat_file_size(archive_path) == os.path.getsize(chat_path)
+    assert read_chat_text(archive_path) == read_chat_text(chat_path)
+    with pytest.raises(ValueError):
+        with open_chat_export(archive_path):
+            pass
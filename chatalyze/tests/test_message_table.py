@@ -0,0 +1,110 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from apps.dashboard.analysis_tools.message_table import (
+    MessageTable,
+    dump_message_table,
+    load_message_table,
+    table_from_tg,
+    table_from_wa,
+    table_from_fb,
+)
+
+
+def test_message_table_texts():
+    texts = ["plain", None, "", "Привет 😀", "broken \ud83d surrogate", "tab\tand\nnewline"]
+    table = MessageTable(pd.to_datetime(["2022-01-01"] * len(texts)), ["Bob"] * len(texts), texts)
+    expected = [text or "" for text in texts]
+    assert table.get_texts() == expected
+    assert table.get_texts(np.array([False, False, False, True, True, False])) == expected[3:5]
+    assert table.get_texts(np.array([5, 0])) == [expected[5], expected[0]]
+    assert table.get_text_lengths().tolist() == list(map(len, expected))
+    assert table.nbytes < 400
+
+
+def test_table_from_tg():
+    msg_columns = {
+        "id": [1, 2, 3, 4],
+        "type": ["message", "service", "message", "message"],
+        "date": ["2022-01-01T10:00:00", "2022-01-01T10:01:00", "2022-01-02T00:00:00", "2022-01-02T00:01:00"],
+        "from": ["Bob", "Bob", None, "Alice"],
+        "from_id": ["user1", "user1", "user2", "user3"],
+        "text": ["hi", "pinned a message", None, "look"],
+        "media_type": [None, None, "sticker", None],
+        "forwarded_from": [None, None, None, "News"],
+    }
+    table = table_from_tg(msg_columns)
+    assert len(table) == 3
+    expected_dates = pd.to_datetime(["2022-01-01 10:00", "2022-01-02", "2022-01-02 00:01"]).to_numpy()
+    assert np.array_equal(table.get_datetimes(), expected_dates)
+    assert table.senders == ["Alice", "Bob", "user2"]
+    assert table.sender_codes.tolist() == [1, 2, 0]
+    assert table.media_types == ["sticker"] and table.media_codes.tolist() == [-1, 0, -1]
+    assert table.forwarded.tolist() == [False, False, True]
+    assert table.get_texts() == ["hi", "", "look"]
+
+
+def test_table_from_wa():
+    msg_columns = {
+        "from": ["Bob", "Alice", "Bob"],
+        "date": ["01.02.2022, 10:15", "01.02.2022, 10:16", "02.02.2022, 09:00"],
+        "text": ["hi", "", "bye"],
+        "media_type": [None, "media", None],
+    }
+    table = table_from_wa(msg_columns)
+    assert table.get_senders().tolist() == ["Bob", "Alice", "Bob"]
+    assert table.get_datetimes()[-1] == np.datetime64("2022-02-02T09:00")
+    assert table.media_codes.tolist() == [-1, 0, -1]
+    assert not table.forwarded.any()
+
+
+def test_table_from_fb():
+    msg_columns = {
+        "timestamp_ms": [3000, 2000, 1000],
+        "sender_name": ["Bob", "Alice", "Bob"],
+        "type": ["Generic", "Share", "Generic"],
+        "content": [None, "link", "hi"],
+    }
+    table = table_from_fb(msg_columns)
+    assert table.timestamps.tolist() == [1000 * 10**6, 3000 * 10**6]
+    assert table.get_senders().tolist() == ["Bob", "Bob"]
+    assert table.get_texts() == ["hi", ""]
+    assert table.media_types == ["media"] and table.media_codes.tolist() == [-1, 0]
+
+
+def test_message_table_word_counts():
+    # every character between two letters, including the multibyte spaces str.split() splits on
+    texts = ["a" + chr(code) + "b" for code in range(0x3100) if not 0xD800 <= code < 0xE000]
+    texts += ["", None, " leading and trailing　", "  ", "слово 😀 word", "x\ud83dy z"]
+    table = MessageTable(pd.to_datetime(["2022-01-01"] * len(texts)), ["Bob"] * len(texts), texts)
+    assert table.get_word_counts().tolist() == [len(text.split()) if text else 0 for text in texts]
+
+
+def test_dump_message_table():
+    texts = ["hi", None, "Привет \ud83d"]
+    table = MessageTable(
+        pd.to_datetime(["2022-01-01", "2022-01-02", "2022-01-03"]),
+        ["Bob", None, "Алиса"],
+        texts,
+        media_types=[None, "sticker", None],
+        forwarded=[False, False, True],
+    )
+    loaded = load_message_table(io.BytesIO(dump_message_table(table)))
+    for name in MessageTable.__slots__:
+        assert np.array_equal(getattr(loaded, name), getattr(table, name))
+    assert loaded.get_texts() == table.get_texts()
+
+
+def test_message_table_slice():
+    texts = ["plain", None, "Привет 😀", "", "tab\tand\nnewline"]
+    senders = ["Bob", None, "Алиса", "Bob", "Алиса"]
+    table = MessageTable(pd.date_range("2022-01-01", periods=len(texts)), senders, texts, forwarded=[1, 0, 0, 1, 0])
+    for start, stop in ((0, 5), (1, 3), (2, 2), (3, 10)):
+        part = table.get_slice(start, stop)
+        assert len(part) == len(texts[start:stop])
+        assert part.get_texts() == [text or "" for text in texts[start:stop]]
+        assert part.get_senders().tolist() == table.get_senders().tolist()[start:stop]
+        assert part.forwarded.tolist() == table.forwarded.tolist()[start:stop]
+        assert part.get_word_counts().tolist() == table.get_word_counts().tolist()[start:stop]
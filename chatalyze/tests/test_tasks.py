@@ -0,0 +1,112 @@
+import json
+import os
+import zipfile
+
+import pytest
+from django.core.files.base import ContentFile
+
+from apps.dashboard import tasks
+from apps.dashboard.analysis_tools.general_analysis import parse_whatsapp
+from apps.dashboard.analysis_tools.main import (
+    RUN_FILES,
+    delete_run_files,
+    fail_analyses,
+    load_state,
+    run_analyses,
+    _get_run_file_name,
+    _run_file_exists,
+)
+from apps.dashboard.analysis_tools.message_table import table_from_wa
+from apps.dashboard.const import WHATSAPP
+from apps.dashboard.models import ChatAnalysis
+from core import settings
+from core.celery import app
+
+_dir = os.path.dirname(os.path.realpath(__file__))
+TEST_FILES = _dir + "/test_files"
+
+
+@pytest.fixture
+def eager_tasks(monkeypatch):
+    monkeypatch.setitem(app.conf, "CELERY_TASK_ALWAYS_EAGER", True)
+
+
+def _list_run_files():
+    return set(settings.private_storage.listdir("runs")[1]) if settings.private_storage.exists("runs") else set()
+
+
+@pytest.mark.django_db
+def test_analyze_chat_file_runs_parallel_analyses(admin_user, eager_tasks):
+    with open(TEST_FILES + "/WhatsApp Chat with User.txt", "rb") as f:
+        analysis = ChatAnalysis.objects.create(author=admin_user, language=ChatAnalysis.AnalysisLanguage.ENGLISH)
+        analysis.chat_file.save("chat.txt", f)
+    run_files = _list_run_files()
+    tasks.analyze_chat_file(analysis.pk)
+    analysis.refresh_from_db()
+    assert analysis.status == ChatAnalysis.AnalysisStatus.READY
+    assert analysis.chat_platform == WHATSAPP
+    assert json.loads(analysis.results)["msg_per_user"]
+    assert analysis.word_cloud_pic and analysis.analysis_state
+    assert _list_run_files() == run_files
+
+    # the state is reused by the stop list changes
+    user = next(iter(json.loads(analysis.results)["msg_per_user"]))
+    analysis.custom_stoplist = [user]
+    analysis.save()
+    tasks.update_chat_stoplist(analysis.pk)
+    analysis.refresh_from_db()
+    assert analysis.status == ChatAnalysis.AnalysisStatus.READY
+    assert user not in json.loads(analysis.results)["msg_per_user"]
+
+
+@pytest.mark.django_db
+def test_chunked_analysis_equals_single_chunk(admin_user, eager_tasks, monkeypatch):
+    results = []
+    word_frequencies = []
+    for file_size in (1 << 40, 0):
+        monkeypatch.setattr(settings, "CHUNKED_ANALYSIS_FILE_SIZE", file_size)
+        monkeypatch.setattr(settings, "ANALYSIS_CHUNK_MESSAGES", 7)
+        with open(TEST_FILES + "/WhatsApp Chat with User.txt", "rb") as f:
+            analysis = ChatAnalysis.objects.create(author=admin_user, language=ChatAnalysis.AnalysisLanguage.ENGLISH)
+            analysis.chat_file.save("chat.txt", f)
+        tasks.analyze_chat_file(analysis.pk)
+        analysis.refresh_from_db()
+        assert analysis.status == ChatAnalysis.AnalysisStatus.READY
+        results.append(json.loads(analysis.results))
+        word_frequencies.append(load_state(analysis)["word_frequencies"])
+    assert analysis.messages_count > 7
+    assert results[0] == results[1]
+    # the term counts of the chunks are summed before the collocations are scored
+    assert word_frequencies[0] and word_frequencies[0] == word_frequencies[1]
+
+
+@pytest.mark.django_db
+def test_zipped_chat_is_chunked_by_uncompressed_size(admin_user, monkeypatch, tmp_path):
+    chat_path = TEST_FILES + "/WhatsApp Chat with User.txt"
+    archive_path = tmp_path / "WhatsApp Chat with User.zip"
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.write(chat_path, "WhatsApp Chat with User.txt")
+    analysis = ChatAnalysis.objects.create(author=admin_user, language=ChatAnalysis.AnalysisLanguage.ENGLISH)
+    with open(archive_path, "rb") as f:
+        analysis.chat_file.save("chat.zip", f)
+    assert analysis.chat_file.size < os.path.getsize(chat_path)
+    monkeypatch.setattr(settings, "CHUNKED_ANALYSIS_FILE_SIZE", analysis.chat_file.size + 1)
+    monkeypatch.setattr(settings, "ANALYSIS_CHUNK_MESSAGES", 7)
+    with open(chat_path, "r", encoding="utf8") as f:
+        table = table_from_wa(parse_whatsapp(f.read()))
+    run = run_analyses(analysis, table)
+    delete_run_files(run)
+    assert len(run["chunks"]) == -(-len(table) // 7) > 1
+
+
+@pytest.mark.django_db
+def test_fail_analyses(admin_user):
+    analysis = ChatAnalysis.objects.create(author=admin_user, status=ChatAnalysis.AnalysisStatus.PROCESSING)
+    run = {"id": "test", "merge_state": False, "last_message_id": None, "messages_count": 1, "chunks": [None, {}]}
+    for name, chunk in (("table", 0), ("table", 1), ("counters", 0), ("counters", 1), ("frequencies", 0)):
+        settings.private_storage.save(_get_run_file_name(run, name, chunk), ContentFile(b"data"))
+    fail_analyses(analysis, run)
+    analysis.refresh_from_db()
+    assert analysis.status == ChatAnalysis.AnalysisStatus.ERROR
+    assert analysis.error_text == "Couldn't build a wordcloud of your chat."
+    assert not any(_run_file_exists(run, name, chunk) for name in RUN_FILES for chunk in range(2))
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from apps.dashboard.analysis_tools.timestamps import (
+    detect_datetime_format,
+    match_shape,
+    parse_timestamps,
+    _detect_by_strptime,
+)
+
+
+@pytest.mark.parametrize(
+    "dates, expected",
+    [
+        (["6/1/22, 00:47", "6/13/22, 20:33", "12/2/22, 9:05"], "%m/%d/%y, %H:%M"),
+        (["01.06.2022, 00:47:10", "13.06.2022, 20:33:00"], "%d.%m.%Y, %H:%M:%S"),
+        (["1/6/22 12:47 PM", "31/12/21 1:05 AM"], "%d/%m/%y %H:%M %p"),
+        (["22/06/13 20.33", "21/12/31 01.05"], "%y/%m/%d %H.%M"),
+        (["01.06.22, 00:47", "02.06.22, 20:33"], None),  # day and month can't be told apart
+        (["31/02/22, 00:47", "13/06/22, 20:33"], None),  # there's no February 31
+        (["31/12/08, 20:33", "13/06/22, 20:33"], None),  # 2008 is too early
+        (["6/1/22, 00:47", "not a date"], None),
+        ([], None),
+    ],
+)
+def test_detect_datetime_format(dates, expected):
+    assert detect_datetime_format(dates) == expected
+
+
+def test_detect_datetime_format_future_date():
+    next_year = str(datetime.now().year + 1)[2:]
+    assert detect_datetime_format(["31.12.22, 20:33"]) == "%d.%m.%y, %H:%M"
+    assert detect_datetime_format(["31.12.22, 20:33", f"31.12.{next_year}, 20:33"]) is None
+
+
+def test_detect_datetime_format_matches_strptime():
+    dates = ["6/1/22, 00:47", "6/13/22, 20:33", " 6/2/22, 00:47", "6/3/22,   10:11", "٦/٤/٢٢, 10:11"]
+    for i in range(len(dates)):
+        expected = _detect_by_strptime(dates[: i + 1], datetime.now())
+        assert detect_datetime_format(dates[: i + 1]) == (expected.pop() if len(expected) == 1 else None)
+
+
+def test_match_shape():
+    dt_formats = {dt_format for dt_format, _, _ in match_shape("9/99/99, 99:99")}
+    assert dt_formats == {"%m/%d/%y, %H:%M", "%d/%m/%y, %H:%M"}
+    assert match_shape("9/99/99 99:99 PM")
+    assert not match_shape("9/99/99, 99:99:99:99")
+
+
+@pytest.mark.parametrize(
+    "dt_format",
+    ["%m/%d/%y, %H:%M", "%d.%m.%Y %H.%M.%S", "%y/%m/%d %H:%M %p", None],
+)
+def test_parse_timestamps(dt_format):
+    dates = ["6/1/22, 00:47", "06/01/22, 00:47", "12/31/21, 23:59", "6/1/22, 00:47", "2/29/24, 7:05", "7/10/09, 10:00"]
+    if dt_format:
+        dates = [datetime.strptime(date, "%m/%d/%y, %H:%M").strftime(dt_format) for date in dates]
+    else:
+        dates = [datetime.strptime(date, "%m/%d/%y, %H:%M").isoformat() for date in dates]
+    expected = pd.to_datetime(pd.Series(dates), format=dt_format).to_numpy()
+    assert (parse_timestamps(dates, dt_format) == expected).all()
+    assert (parse_timestamps(pd.Series(dates), dt_format) == expected).all()
+
+
+def test_parse_timestamps_missing_and_invalid_dates():
+    timestamps = parse_timestamps(["1.6.22, 00:47", None, "1.6.22, 00:47"], "%d.%m.%y, %H:%M")
+    assert np.isnat(timestamps[1]) and timestamps[0] == timestamps[2] == np.datetime64("2022-06-01T00:47")
+    with pytest.raises(ValueError):
+        parse_timestamps(["31.6.22, 00:47", "1.6.22, 00:47"], "%d.%m.%y, %H:%M")